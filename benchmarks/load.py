@@ -0,0 +1,202 @@
+"""
+A small asyncio HTTP/1.1 load generator used by the serving benchmarks. Each connection is kept alive and sends one
+request at a time. run_load keeps a fixed number of requests in flight, run_rate sends requests at a fixed rate however
+long the server takes to answer them.
+"""
+import asyncio
+import time
+
+import numpy as np
+
+
+class HttpConnection:
+    """
+    A keep alive HTTP/1.1 connection, responses must have a Content-Length or use chunked transfer encoding.
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        """
+        Sends a request and reads the whole response.
+
+        :return: tuple of (status, body bytes)
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}']
+
+        for name, value in (headers or {}).items():
+            lines.append(f'{name}: {value}')
+
+        if body is not None:
+            if not any(name.lower() == 'content-type' for name in (headers or {})):
+                lines.append('Content-Type: application/json')
+
+            lines.append(f'Content-Length: {len(body)}')
+
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+
+        if not status_line:
+            raise ConnectionError('Connection closed by server')
+
+        status = int(status_line.split(b' ', 2)[1])
+        response_headers = {}
+
+        while True:
+            line = await self.reader.readline()
+
+            if line in (b'\r\n', b''):
+                break
+
+            name, value = line.decode('latin-1').split(':', 1)
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = bytearray()
+
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                content += await self.reader.readexactly(size + 2)
+
+                if size == 0:
+                    break
+
+            content = bytes(content)
+        else:
+            content = await self.reader.readexactly(int(response_headers.get('content-length', 0)))
+
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+
+        return status, content
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader, self.writer = None, None
+
+
+async def _worker(host, port, next_request, deadline, results):
+    connection = HttpConnection(host, port)
+
+    while time.monotonic() < deadline:
+        name, method, path, body = next_request()
+        started = time.perf_counter()
+
+        try:
+            status, _ = await connection.request(method, path, body)
+            error = status >= 500
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError):
+            await connection.close()
+            error = True
+
+        results.append((name, time.perf_counter() - started, error))
+
+    await connection.close()
+
+
+def run_load(host, port, next_request, concurrency, duration):
+    """
+    Sends requests to a server as fast as it answers them for duration seconds.
+
+    :param host: str
+    :param port: int
+    :param next_request: function that returns the next request to send as (name, method, path, body).
+    :param concurrency: int, the number of connections, each with one request in flight.
+    :param duration: float, how long to run for in seconds.
+    :return: list of (name, seconds, is_error) tuples, one per request.
+    """
+    results = []
+
+    async def main():
+        deadline = time.monotonic() + duration
+        await asyncio.gather(*[_worker(host, port, next_request, deadline, results) for _ in range(concurrency)])
+
+    asyncio.run(main())
+
+    return results
+
+
+def run_rate(host, port, next_request, rate, duration, max_connections=256):
+    """
+    Sends rate requests per second for duration seconds, on up to max_connections keep alive connections. Latency is
+    measured from when a request was due to be sent, so time spent waiting for a free connection when the server falls
+    behind counts against it, like it would for users.
+
+    :param host: str
+    :param port: int
+    :param next_request: function that returns the next request to send as (name, method, path, body).
+    :param rate: float, requests per second.
+    :param duration: float, how long to send requests for in seconds.
+    :param max_connections: int, the maximum number of requests in flight.
+    :return: list of (name, seconds, is_error) tuples, one per request. Any 4xx or 5xx response is an error.
+    """
+    results = []
+
+    async def send(semaphore, idle, due, name, method, path, body):
+        async with semaphore:
+            connection = idle.pop() if len(idle) > 0 else HttpConnection(host, port)
+
+            try:
+                status, _ = await connection.request(method, path, body)
+                error = status >= 400
+                idle.append(connection)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError, ValueError):
+                await connection.close()
+                error = True
+
+        results.append((name, time.perf_counter() - due, error))
+
+    async def main():
+        semaphore = asyncio.Semaphore(max_connections)
+        idle = []
+        tasks = []
+        started = time.perf_counter()
+
+        for idx in range(int(rate * duration)):
+            due = started + idx / rate
+            delay = due - time.perf_counter()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            tasks.append(asyncio.ensure_future(send(semaphore, idle, due, *next_request())))
+
+        await asyncio.gather(*tasks)
+
+        for connection in idle:
+            await connection.close()
+
+    asyncio.run(main())
+
+    return results
+
+
+def summarize(results, duration):
+    """
+    Returns the throughput, error rate and latency percentiles of a load run.
+
+    :return: dict
+    """
+    latencies = np.array([seconds for _, seconds, _ in results]) * 1000
+    errors = sum(1 for _, _, error in results if error)
+
+    if len(latencies) == 0:
+        latencies = np.array([np.nan])
+
+    return {
+        'requests': len(results),
+        'rps': len(results) / duration,
+        'errors': errors / max(len(results), 1),
+        'p50': float(np.percentile(latencies, 50)),
+        'p90': float(np.percentile(latencies, 90)),
+        'p99': float(np.percentile(latencies, 99)),
+        'max': float(np.max(latencies)),
+    }
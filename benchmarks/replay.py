@@ -0,0 +1,300 @@
+"""
+Replays dashboard style traffic against the metrics server at a fixed request rate, and reports latency percentiles,
+throughput and error rates for each kind of request. The App is served by waitress on a thread of this process, and
+reads from a local store (see cassandra.backend local) with a simulated Cassandra latency. Unless --store is given, a
+temporary store is seeded with a week of synthetic metrics first.
+
+The traffic is a weighted mix of:
+* dashboard - rendering one of the time series dashboards created at start up.
+* metric - a metric request over a 15 minute to 7 day range, with a size between 100 and 2000.
+* alert - a batch of alerts evaluated in summary mode, like an alert dashboard polling.
+* catalog - the list of every metric.
+
+Each --config is a space separated list of the environment variables read_config_from_env reads, and is benchmarked
+in turn with the same traffic, e.g. to compare thread counts:
+
+    python -m benchmarks.replay --config METRICS_SERVER_THREADS=4 --config METRICS_SERVER_THREADS=16
+
+The load generator shares the process, and the GIL, with the server, so compare configs with each other rather than
+with production numbers.
+
+Usage: python -m benchmarks.replay [--config "VAR=value ..."]... [--rate 50] [--duration 30]
+    [--mix dashboard=1,metric=6,alert=2,catalog=1] [--latency-ms 5] [--jitter-ms 5] [--store metrics.db]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shlex
+import tempfile
+import threading
+import urllib.parse
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from unittest import mock
+
+from waitress import create_server, wasyncore
+
+from benchmarks.load import run_rate, summarize
+from metrics_server.app import App
+from metrics_server.run import read_config_from_env
+from metrics_server.seed_local_store import seed
+from metrics_server.timing import STATS
+
+DEFAULT_MIX = 'dashboard=1,metric=6,alert=2,catalog=1'
+RANGES = [timedelta(minutes=15), timedelta(hours=1), timedelta(hours=6), timedelta(days=1), timedelta(days=7)]
+SIZES = [100, 250, 500, 1000, 2000]
+TIMER_COLUMNS = ['p99', 'p99,p75,mean', 'mean', 'max', 'one_min_rate']
+COUNTER_COLUMNS = ['interval_count', 'count']
+DASHBOARDS = 5
+CHARTS_PER_DASHBOARD = 4
+ALERTS_PER_POLL = 5
+
+
+class InProcessServer:
+    """
+    Serves an App with waitress on a background thread, on a free port of 127.0.0.1.
+    """
+    def __init__(self, config):
+        self.app = App(config)
+        # A full task queue is expected when the server falls behind, don't log a warning for every request.
+        logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+        self.server = create_server(self.app.flask_app, host='127.0.0.1', port=0,
+                                    threads=config['server']['threads'], connection_limit=1000)
+        self.port = self.server.effective_port
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stopped:
+            wasyncore.loop(timeout=0.1, map=self.server._map, use_poll=self.server.adj.asyncore_use_poll, count=1)
+
+    def __enter__(self):
+        self._thread.start()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        # Let the requests in flight finish while the loop still runs, they pull the server's trigger when they're done
+        # and it is closed with the server.
+        self.server.task_dispatcher.shutdown()
+        self._stopped = True
+        self._thread.join()
+        self.server.close()
+        self.app.services['MetricsService'].stop_catalog_refresh()
+        self.app.services['CassandraService'].cluster.shutdown()
+
+
+def parse_mix(mix):
+    """
+    Parses a mix like dashboard=1,metric=6 into an OrderedDict of request kind to weight.
+    """
+    weights = OrderedDict()
+
+    for item in mix.split(','):
+        kind, _, weight = item.partition('=')
+
+        if kind not in REQUESTS:
+            raise ValueError(f'Unknown request kind "{kind}", expected one of {", ".join(REQUESTS)}')
+
+        weights[kind] = float(weight or 1)
+
+    return weights
+
+
+def server_config(overrides, store, latency_ms, jitter_ms):
+    """
+    Reads the config the server would read from the environment with overrides applied, and points it at the store.
+
+    :param overrides: str, space separated VAR=value pairs.
+    :return: dict
+    """
+    env = dict(item.split('=', 1) for item in shlex.split(overrides))
+    env.update({
+        'METRICS_SERVER_LOCAL_STORE': store,
+        'METRICS_SERVER_LOCAL_STORE_LATENCY_MS': str(latency_ms),
+        'METRICS_SERVER_LOCAL_STORE_JITTER_MS': str(jitter_ms),
+    })
+
+    with mock.patch.dict(os.environ, env):
+        os.environ.pop('METRICS_SERVER_CASSANDRA', None)
+        return read_config_from_env()
+
+
+def timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def metric_request(rng, metrics):
+    table, environment, application, metric = rng.choice(metrics)
+    columns = rng.choice(TIMER_COLUMNS if table == 'raw_timer_with_interval' else COUNTER_COLUMNS)
+    end = datetime.utcnow() - timedelta(seconds=rng.randrange(60))
+    query = urllib.parse.urlencode({
+        'columns': columns,
+        'start_timestamp': timestamp(end - rng.choice(RANGES)),
+        'end_timestamp': timestamp(end),
+        'size': rng.choice(SIZES),
+    })
+
+    return 'GET', f'/api/v1/metrics/{table}/{environment}/{application}/{metric}?{query}', None
+
+
+def dashboard_request(rng, metrics):
+    return 'GET', f'/api/v1/dashboards/time_series/replay-{rng.randrange(DASHBOARDS)}/render?size=500', None
+
+
+def alert_request(rng, metrics):
+    timers = [metric for metric in metrics if metric[0] == 'raw_timer_with_interval']
+    end = datetime.utcnow()
+    alerts = [
+        {'environment': environment, 'application': application, 'table': table, 'metric': metric,
+         'measure': 'p99', 'warning': 100, 'error': 200}
+        for table, environment, application, metric in rng.sample(timers, min(ALERTS_PER_POLL, len(timers)))
+    ]
+    body = {'alerts': alerts, 'start': timestamp(end - timedelta(hours=1)), 'end': timestamp(end), 'mode': 'summary'}
+
+    return 'POST', '/api/v1/alerts/batch', json.dumps(body).encode('utf-8')
+
+
+def catalog_request(rng, metrics):
+    return 'GET', '/api/v1/metrics', None
+
+
+REQUESTS = OrderedDict([
+    ('dashboard', dashboard_request),
+    ('metric', metric_request),
+    ('alert', alert_request),
+    ('catalog', catalog_request),
+])
+
+
+def request_factory(weights, metrics, seed_=42):
+    """
+    Returns a function that picks the next request of the mix, the same sequence for every config.
+    """
+    rng = random.Random(seed_)
+    kinds = list(weights)
+    kind_weights = list(weights.values())
+
+    def next_request():
+        kind = rng.choices(kinds, weights=kind_weights)[0]
+
+        return (kind, *REQUESTS[kind](rng, metrics))
+
+    return next_request
+
+
+def list_metrics(app):
+    """
+    Returns (table, environment, application, metric) of every metric in the store.
+    """
+    metrics_service = app.services['MetricsService']
+
+    return [
+        (table, row['environment'], row['application'], row['metric_name'])
+        for table in ('raw_timer_with_interval', 'raw_counter_with_interval')
+        for row in metrics_service.get_distinct_metrics_for_table(table)
+    ]
+
+
+def create_dashboards(app, metrics, rng):
+    """
+    Saves the time series dashboards the dashboard requests render, each with a few charts over different ranges.
+    """
+    client = app.flask_app.test_client()
+    ranges = [(15, 'minutes'), (1, 'hours'), (6, 'hours'), (1, 'days'), (7, 'days')]
+
+    for idx in range(DASHBOARDS):
+        charts = []
+
+        for _ in range(CHARTS_PER_DASHBOARD):
+            multiplier, period = rng.choice(ranges)
+            chart_metrics = []
+
+            for table, environment, application, metric in rng.sample(metrics, min(3, len(metrics))):
+                measure = 'p99' if table == 'raw_timer_with_interval' else 'interval_count'
+                chart_metrics.append({'environment': environment, 'application': application, 'table': table,
+                                      'metric_name': metric, 'measure': measure})
+
+            charts.append({'rangeType': 'dynamic', 'rangeMultiplier': multiplier, 'rangePeriod': period,
+                           'metrics': chart_metrics})
+
+        body = {'name': f'replay-{idx}', 'type': 'time_series', 'data': {'charts': charts}}
+        resp = client.put(f'/api/v1/dashboards/time_series/replay-{idx}', json=body)
+
+        if resp.status_code == 404:
+            client.post('/api/v1/dashboards', json=body)
+
+
+def print_results(label, results, duration):
+    print(label)
+    print(f'  {"request":<12}{"requests":>10}{"req/s":>10}{"errors":>10}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}'
+          f'{"max ms":>10}')
+    kinds = OrderedDict((name, [result for result in results if result[0] == name]) for name in REQUESTS)
+    kinds['all'] = results
+
+    for kind, kind_results in kinds.items():
+        if len(kind_results) == 0:
+            continue
+
+        stats = summarize(kind_results, duration)
+        print(f'  {kind:<12}{stats["requests"]:>10}{stats["rps"]:>10.1f}{stats["errors"]:>10.2%}{stats["p50"]:>10.1f}'
+              f'{stats["p90"]:>10.1f}{stats["p99"]:>10.1f}{stats["max"]:>10.1f}')
+
+    stages = STATS.to_dict()['stages']
+
+    if len(stages) > 0:
+        print('  server stages, mean ms: ' + ', '.join(
+            f'{name} {stage["mean_ms"]:.1f}' for name, stage in sorted(stages.items())
+        ))
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Replay dashboard traffic against the metrics server.')
+    parser.add_argument('--config', action='append', default=None,
+                        help='Space separated VAR=value environment overrides, may be given more than once.')
+    parser.add_argument('--rate', type=float, default=50, help='Requests per second to send.')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to send requests for, per config.')
+    parser.add_argument('--warmup', type=float, default=3, help='Seconds of traffic before measuring, per config.')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Comma separated request kinds and their weights.')
+    parser.add_argument('--latency-ms', type=float, default=5, help='Simulated Cassandra latency per query.')
+    parser.add_argument('--jitter-ms', type=float, default=5, help='Random extra latency of up to this much.')
+    parser.add_argument('--store', default=None, help='A seeded local store, see seed-local-store.')
+    parser.add_argument('--max-connections', type=int, default=256, help='The most requests in flight.')
+    args = parser.parse_args()
+    weights = parse_mix(args.mix)
+    configs = args.config or ['']
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = args.store
+
+        if store is None:
+            store = os.path.join(tmp_dir, 'metrics.db')
+            print('Seeding a local store with a week of metrics...')
+            seed(store, ['dev'], applications=2, metrics=3, days=7, interval=30)
+
+        print(f'{args.rate:g} req/s for {args.duration:g} s, mix {args.mix}, '
+              f'{args.latency_ms:g} ms latency with {args.jitter_ms:g} ms jitter')
+
+        for overrides in configs:
+            config = server_config(overrides, store, args.latency_ms, args.jitter_ms)
+
+            with InProcessServer(config) as server:
+                metrics = list_metrics(server.app)
+
+                if len(metrics) == 0:
+                    raise SystemExit(f'{store} has no metrics, seed it with seed-local-store')
+
+                create_dashboards(server.app, metrics, random.Random(42))
+                run_rate('127.0.0.1', server.port, request_factory(weights, metrics, seed_=1), args.rate,
+                         args.warmup, args.max_connections)
+                STATS.reset()
+                results = run_rate('127.0.0.1', server.port, request_factory(weights, metrics), args.rate,
+                                   args.duration, args.max_connections)
+
+            print_results(f'{overrides or "defaults"}, {config["server"]["threads"]} threads', results, args.duration)
+
+
+if __name__ == '__main__':
+    run()
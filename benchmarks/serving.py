@@ -0,0 +1,262 @@
+"""
+Compares requests per second and latency of the waitress and ASGI server modes under dashboard style fan out. The
+server runs in its own process pinned to --cores CPUs, so both modes get the same number of cores, and talks to a
+simulated Cassandra session that answers every query after --latency-ms milliseconds with --rows rows.
+
+The ASGI mode needs uvicorn (pip install uvicorn).
+
+Usage: python -m benchmarks.serving [--modes waitress,asgi] [--cores 2] [--threads 4] [--concurrency 32]
+    [--duration 10] [--latency-ms 20] [--rows 2000] [--size 500]
+"""
+import argparse
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.load import run_load, summarize
+from metrics_server.columnar import ColumnarRows
+
+SELECT_RE = re.compile(r'SELECT (?P<columns>.+?) FROM (?P<table>\w+)', re.IGNORECASE)
+METRICS = [f'central-ledger.transfer.metric-{i}' for i in range(20)]
+MEASURES = ['p99', 'p75', 'mean', 'max']
+
+
+class DelayedResults:
+    """
+    Completes fake response futures after a delay, on a single thread like the driver's event loop.
+    """
+    def __init__(self):
+        self._heap = []
+        self._counter = 0
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def schedule(self, delay, fn):
+        with self._condition:
+            self._counter += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._counter, fn))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._heap) == 0 or self._heap[0][0] > time.monotonic():
+                    timeout = None if len(self._heap) == 0 else self._heap[0][0] - time.monotonic()
+                    self._condition.wait(timeout)
+
+                _, _, fn = heapq.heappop(self._heap)
+
+            fn()
+
+
+class FakeResultSet:
+    has_more_pages = False
+
+    def __init__(self, current_rows):
+        self.current_rows = current_rows
+
+    def __iter__(self):
+        return iter(self.current_rows)
+
+
+class FakeResponseFuture:
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def set_result(self, result):
+        with self._lock:
+            self._result = result
+            self._event.set()
+            callbacks = self._callbacks
+
+        for callback, _ in callbacks:
+            callback(result.current_rows)
+
+    def result(self):
+        self._event.wait()
+
+        return self._result
+
+    def add_callbacks(self, callback, errback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append((callback, errback))
+                return
+
+        callback(self._result.current_rows)
+
+
+class FakeSession:
+    """
+    Answers metric data queries with generated rows after a fixed latency, and everything else with no rows.
+    """
+    def __init__(self, latency, rows):
+        self.latency = latency
+        self.rows = rows
+        self.default_fetch_size = None
+        self.scheduler = DelayedResults()
+        self._results = {}
+
+    def prepare(self, cql):
+        return SimpleNamespace(query_string=cql, fetch_size=None, is_idempotent=False)
+
+    def _result(self, statement):
+        match = SELECT_RE.match(statement.query_string)
+
+        if match is None or 'metric_timestamp' not in match.group('columns'):
+            return FakeResultSet([])
+
+        columns = tuple(column.strip() for column in match.group('columns').split(','))
+
+        if columns not in self._results:
+            random = np.random.RandomState(42)
+            end = np.datetime64(datetime.utcnow(), 'ns')
+            arrays = {'metric_timestamp': end - np.arange(self.rows)[::-1] * np.timedelta64(5, 's')}
+
+            for column in columns[1:]:
+                values = random.lognormal(3, 1, self.rows)
+                arrays[column] = np.cumsum(values).astype(np.int64) if 'count' in column else values
+
+            self._results[columns] = FakeResultSet(ColumnarRows(columns, arrays))
+
+        return self._results[columns]
+
+    def execute(self, statement, params=None, **kwargs):
+        time.sleep(self.latency)
+
+        return self._result(statement)
+
+    def execute_async(self, statement, params=None, **kwargs):
+        future = FakeResponseFuture()
+        result = self._result(statement)
+        self.scheduler.schedule(self.latency, lambda: future.set_result(result))
+
+        return future
+
+
+def serve(mode, port, cores, threads, latency, rows):
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+    session = FakeSession(latency, rows)
+    cluster = mock.Mock()
+    cluster.return_value.connect.return_value = session
+
+    with mock.patch('metrics_server.cassandra_service.Cluster', cluster):
+        from metrics_server.app import App
+        app = App({'cassandra': {'host': '127.0.0.1'}})
+
+    if mode == 'asgi':
+        import uvicorn
+        from metrics_server.asgi import AsgiApp
+
+        uvicorn.run(AsgiApp(app, threads), host='127.0.0.1', port=port, log_level='warning')
+    else:
+        from waitress import serve as waitress_serve
+
+        # A full task queue is the point of the benchmark, don't log a warning for every request.
+        logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+        waitress_serve(app.flask_app, host='127.0.0.1', port=port, threads=threads, connection_limit=1000)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise TimeoutError(f'Server did not start listening on port {port}')
+
+
+def request_factory(size):
+    """
+    Returns a function that cycles through metric requests like the ones a dashboard sends when it loads.
+    """
+    end = datetime.utcnow()
+    start = end - timedelta(hours=6)
+    paths = [
+        f'/api/v1/metrics/raw_timer_with_interval/dev/central-ledger/{metric}?columns={measure}'
+        f'&start_timestamp={start.isoformat()}Z&end_timestamp={end.isoformat()}Z&size={size}'
+        for metric in METRICS for measure in MEASURES
+    ]
+    counter = itertools.count()
+
+    return lambda: ('metric', 'GET', paths[next(counter) % len(paths)], None)
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Benchmark the waitress and ASGI server modes.')
+    parser.add_argument('--modes', default='waitress,asgi', help='Comma separated server modes to benchmark.')
+    parser.add_argument('--cores', type=int, default=2, help='Number of CPUs the server process may use.')
+    parser.add_argument('--threads', type=int, default=4, help='server.threads for both modes.')
+    parser.add_argument('--concurrency', type=int, default=32, help='Number of requests in flight.')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to send requests for, per mode.')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Simulated Cassandra latency per query.')
+    parser.add_argument('--rows', type=int, default=2000, help='Rows returned by each metric query.')
+    parser.add_argument('--size', type=int, default=500, help='The size argument of each metric request.')
+    args = parser.parse_args()
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    server_cores = set(available[:args.cores])
+
+    if hasattr(os, 'sched_setaffinity') and len(available) > args.cores:
+        # Keep the load generator off the server's cores.
+        os.sched_setaffinity(0, set(available[args.cores:]))
+
+    print(f'{args.cores} server cores, {args.threads} threads, {args.concurrency} concurrent requests, '
+          f'{args.latency_ms:g} ms latency, {args.rows} rows per query, size {args.size}')
+    print(f'{"mode":<12}{"requests":>10}{"req/s":>10}{"errors":>10}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}')
+
+    for mode in args.modes.split(','):
+        if mode == 'asgi':
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                print(f'{mode:<12}skipped, pip install uvicorn to benchmark it')
+                continue
+
+        port = free_port()
+        server = multiprocessing.get_context('spawn').Process(
+            target=serve, args=(mode, port, server_cores, args.threads, args.latency_ms / 1000, args.rows), daemon=True
+        )
+        server.start()
+
+        try:
+            wait_for_port(port)
+            # Warm up the prepared statement registry and the generated results.
+            run_load('127.0.0.1', port, request_factory(args.size), args.concurrency, 1)
+            results = run_load('127.0.0.1', port, request_factory(args.size), args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.join()
+
+        stats = summarize(results, args.duration)
+        print(f'{mode:<12}{stats["requests"]:>10}{stats["rps"]:>10.1f}{stats["errors"]:>10.2%}{stats["p50"]:>10.1f}'
+              f'{stats["p90"]:>10.1f}{stats["p99"]:>10.1f}')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,83 @@
+"""
+Compares the size and encode time of the formats the metric endpoint can respond with.
+
+Usage: python -m benchmarks.wire_formats [--rows 1000] [--columns 4] [--repeat 20]
+"""
+import argparse
+import gzip
+import json
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from metrics_server.data_frame_encoder import (
+    DataFrameEncoder, OrjsonDataFrameEncoder, orjson, to_columnar_binary, to_columnar_json
+)
+
+ENVELOPE = {
+    'environment': 'dev',
+    'application': 'central-ledger',
+    'table': 'raw_timer_with_interval',
+    'metric': 'central-ledger.transfer.prepare',
+}
+TIMER_COLUMNS = ['mean', 'p75', 'p95', 'p99', 'max', 'min', 'std_dev', 'median']
+
+
+def make_data_frame(rows, columns):
+    """
+    Builds a DataFrame shaped like the output of MetricsService.get_metric_data, with a few missing values.
+    """
+    random = np.random.RandomState(42)
+    index = pd.date_range('2017-01-01', periods=rows, freq='15S', tz='UTC', name='metric_timestamp')
+    data = {column: random.lognormal(3, 1, rows) for column in TIMER_COLUMNS[:columns]}
+    df = pd.DataFrame(data, index=index)
+    df.iloc[::50] = np.nan
+
+    return df.reset_index()
+
+
+def encode_rows(df):
+    return json.dumps({'data': {**ENVELOPE, 'rows': df}}, cls=DataFrameEncoder).encode('utf-8')
+
+
+def encode_rows_orjson(df):
+    return json.dumps({'data': {**ENVELOPE, 'rows': df}}, cls=OrjsonDataFrameEncoder).encode('utf-8')
+
+
+def encode_columnar_json(df):
+    return f'{{"data": {to_columnar_json(ENVELOPE, df)}}}'.encode('utf-8')
+
+
+def encode_columnar_binary(df):
+    return to_columnar_binary(ENVELOPE, df)
+
+
+FORMATS = [
+    ('application/json', encode_rows),
+    ('application/vnd.metrics.columnar+json', encode_columnar_json),
+    ('application/vnd.metrics.columnar', encode_columnar_binary),
+]
+
+if orjson is not None:
+    FORMATS.insert(1, ('application/json (orjson)', encode_rows_orjson))
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Benchmark the metric endpoint wire formats.')
+    parser.add_argument('--rows', type=int, default=1000, help='Number of rows in the DataFrame.')
+    parser.add_argument('--columns', type=int, default=4, help=f'Number of data columns, at most {len(TIMER_COLUMNS)}.')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of times to encode with each format.')
+    args = parser.parse_args()
+    df = make_data_frame(args.rows, min(args.columns, len(TIMER_COLUMNS)))
+    print(f'{args.rows} rows, {len(df.columns)} columns, best of {args.repeat}')
+    print(f'{"format":<40}{"bytes":>12}{"gzip bytes":>12}{"encode ms":>12}')
+
+    for mimetype, encode in FORMATS:
+        payload = encode(df)
+        seconds = min(timeit.repeat(lambda: encode(df), number=1, repeat=args.repeat))
+        print(f'{mimetype:<40}{len(payload):>12}{len(gzip.compress(payload)):>12}{seconds * 1000:>12.2f}')
+
+
+if __name__ == '__main__':
+    run()
@@ -116,6 +116,8 @@ class AlertDashboard extends Component {
       error: alert.error,
       start: this.state.startDate.toISOString(),
       end: this.state.endDate.toISOString(),
+      // We only display the number of warnings and errors, so don't download every breaching data point.
+      mode: 'summary',
     };
 
     const onLoad = (error, response) => {
@@ -132,8 +134,61 @@ class AlertDashboard extends Component {
   }
 
   refreshDashboard() {
-    const dashboard = this.state.dashboard;
-    dashboard.alerts.forEach((_, idx) => this.loadAlertData(idx));
+    /**
+     * Loads the data for every alert in a single request, see /api/v1/alerts/batch.
+     */
+    const alerts = this.state.dashboard.alerts;
+
+    if (alerts.length === 0) {
+      return;
+    }
+
+    const body = {
+      alerts: alerts.map(alert => ({
+        environment: alert.metric.environment,
+        application: alert.metric.application,
+        table: alert.metric.table,
+        metric: alert.metric.metric_name,
+        measure: alert.metric.measure,
+        warning: alert.warning,
+        error: alert.error,
+      })),
+      start: this.state.startDate.toISOString(),
+      end: this.state.endDate.toISOString(),
+      mode: 'summary',
+    };
+
+    const onLoad = (error, response) => {
+      this.setState((state) => {
+        const updated = state.dashboard.alerts.map((alert, idx) => {
+          if (error !== null) {
+            return { ...alert, loadError: 'Error loading alert data', isLoading: false };
+          }
+
+          const result = response.body.alerts[idx];
+
+          if (result === undefined) {
+            // The alert was added while the request was in flight.
+            return alert;
+          }
+
+          if (result.load_error !== undefined) {
+            return { ...alert, loadError: result.load_error, isLoading: false };
+          }
+
+          return { ...alert, data: result.data, loadError: null, isLoading: false };
+        });
+
+        return { dashboard: { ...state.dashboard, alerts: updated } };
+      });
+    };
+
+    this.setState(state => ({
+      dashboard: {
+        ...state.dashboard,
+        alerts: state.dashboard.alerts.map(alert => ({ ...alert, isLoading: true })),
+      },
+    }), () => request.post('/api/v1/alerts/batch').send(body).end(onLoad));
   }
 
   refreshLoop() {
@@ -12,7 +12,7 @@ class AlertRow extends PureComponent {
     let errorClass = '';
 
     if (props.data.warnings !== null) {
-      warningCount = props.data.warnings.length;
+      warningCount = props.data.warnings.count;
 
       if (warningCount === 0) {
         warningClass = 'alert-row__col--ok';
@@ -20,7 +20,7 @@ class AlertRow extends PureComponent {
     }
 
     if (props.data.errors !== null) {
-      errorCount = props.data.errors.length;
+      errorCount = props.data.errors.count;
 
       if (errorCount === 0) {
         errorClass = 'alert-row__col--ok';
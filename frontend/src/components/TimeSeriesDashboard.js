@@ -81,21 +81,55 @@ class TimeSeriesDashboard extends Component {
 
   loadDashboardData() {
     /**
-     * Loads all the data for each chart in a dashboard.
+     * Loads all the data for each chart in a dashboard in a single request, see the dashboard render endpoint. If the
+     * saved dashboard doesn't match the one on screen, or the request fails, each series is loaded separately.
      */
-    this.state.dashboard.charts.forEach((chart, chartIdx) => {
+    const charts = this.state.dashboard.charts;
+    const loadEach = () => charts.forEach((chart, chartIdx) => {
+      chart.metrics.forEach((metric, metricIdx) => {
+        this.loadData(chartIdx, metricIdx, metric, chart.startDate, chart.endDate, true);
+      });
+    });
+
+    charts.forEach((chart) => {
       /* eslint-disable no-param-reassign */
       chart.initialLoad = true;
       chart.previewData = [];
       chart.data = [];
-      chart.metrics.forEach((metric, metricIdx) => {
+      chart.metrics.forEach((metric) => {
         const dataObj = createDataObject(metric);
         chart.data.push({ ...dataObj });
         chart.previewData.push({ ...dataObj });
-        this.loadData(chartIdx, metricIdx, metric, chart.startDate, chart.endDate, true);
       });
       /* eslint-enable */
     });
+
+    const windowWidth = (window.innerWidth || document.documentElement.clientWidth || document.body.clientWidth);
+    const pad = 144; // Subtract 144 because we have 64 pixels of padding on the window and 80 pixels on SVG
+    const onLoad = (error, response) => {
+      const rendered = error === null ? response.body.charts : null;
+
+      if (rendered === null || rendered.length !== charts.length
+        || rendered.some((r, idx) => r.series.length !== charts[idx].metrics.length)) {
+        loadEach();
+        return;
+      }
+
+      rendered.forEach((r, chartIdx) => r.series.forEach((series, metricIdx) => {
+        const metric = charts[chartIdx].metrics[metricIdx];
+
+        if (has.call(series, 'error')) {
+          this.previewDataHandler(chartIdx, metricIdx, metric, series.error, { body: { error: series.error } });
+        } else {
+          this.previewDataHandler(chartIdx, metricIdx, metric, null, { body: { data: { rows: series.rows } } });
+        }
+      }));
+    };
+
+    request.get(`/api/v1/dashboards/time_series/${encodeURIComponent(this.state.dashboard.name)}/render`)
+      .query({ size: windowWidth - pad })
+      .set('Accept', 'application/json')
+      .end(onLoad);
   }
 
   addChart() {
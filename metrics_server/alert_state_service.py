@@ -0,0 +1,331 @@
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+from cassandra.cluster import Session
+
+from metrics_server.alerts_service import (
+    ERROR, WARNING, AlertsService, _to_datetimes, classify, dashboard_alerts, measure_values
+)
+from metrics_server.base_service import BaseService
+from metrics_server.cassandra_service import COLUMNAR_PROFILE, execute_concurrently, raise_first_error
+from metrics_server.columnar import as_columnar
+from metrics_server.dashboards_service import DashboardsService, dashboard_range
+from metrics_server.errors import NotFoundError
+from metrics_server.metrics_service import validate_columns
+from metrics_server.rollups import floor_timestamp
+
+logger = logging.getLogger(__name__)
+# See migrations/04_add_alert_state_schema.py
+STATE_SELECT_CQL = 'SELECT watermark FROM alert_state WHERE alert_id = ?;'
+STATE_UPDATE_CQL = 'INSERT INTO alert_state (alert_id, watermark, updated_at) VALUES (?, ?, ?);'
+TALLIES_SELECT_CQL = (
+    'SELECT bucket, warnings, errors, first_warning, last_warning, first_error, last_error '
+    'FROM alert_tallies WHERE alert_id = ? AND bucket >= ?;'
+)
+TALLIES_INSERT_CQL = (
+    'INSERT INTO alert_tallies (alert_id, bucket, warnings, errors, first_warning, last_warning, first_error, '
+    'last_error) VALUES (?, ?, ?, ?, ?, ?, ?, ?) USING TTL ?;'
+)
+SPEC_KEYS = ('environment', 'application', 'table', 'metric', 'measure', 'warning', 'error')
+LEVELS = (('warning', WARNING), ('error', ERROR))
+
+
+def alert_id(alert) -> str:
+    """
+    Identifies an alert by everything that affects its result, so alerts with the same metric, measure and thresholds
+    share their state even if they are on different dashboards.
+
+    :param alert: dict, a complete alert spec.
+    :return: str
+    """
+    key = json.dumps([alert[key] for key in SPEC_KEYS])
+
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def complete_alert(alert):
+    """
+    Returns a copy of an alert spec with numeric thresholds, or None if the alert isn't completely configured.
+    """
+    if any(alert.get(key) in (None, '') for key in SPEC_KEYS):
+        return None
+
+    try:
+        return {**alert, 'warning': float(alert['warning']), 'error': float(alert['error'])}
+    except (TypeError, ValueError):
+        return None
+
+
+def _empty_tally():
+    return {
+        'warnings': 0, 'errors': 0, 'first_warning': None, 'last_warning': None, 'first_error': None,
+        'last_error': None
+    }
+
+
+def _merge(tally, other):
+    """
+    Adds the counts in other to tally and widens its first and last breach times.
+    """
+    for name, _ in LEVELS:
+        tally[f'{name}s'] += other[f'{name}s'] or 0
+        first = [value for value in (tally[f'first_{name}'], other[f'first_{name}']) if value is not None]
+        last = [value for value in (tally[f'last_{name}'], other[f'last_{name}']) if value is not None]
+        tally[f'first_{name}'] = min(first, default=None)
+        tally[f'last_{name}'] = max(last, default=None)
+
+    return tally
+
+
+def tally(timestamps: np.ndarray, levels: np.ndarray, bucket_seconds) -> dict:
+    """
+    Counts the warnings and errors in each time bucket, and finds the first and last of each.
+
+    :param timestamps: datetime64 array of the timestamp of each data point, oldest first.
+    :param levels: np.ndarray, the level of each data point, see alerts_service.classify.
+    :param bucket_seconds: int, the size of the buckets.
+    :return: dict of bucket start (naive UTC datetime) to dict of counts and breach times.
+    """
+    ns = timestamps.astype('datetime64[ns]').view(np.int64)
+    bucket_ns = int(bucket_seconds) * 10 ** 9
+    tallies = {}
+
+    for name, level in LEVELS:
+        breaches = ns[levels == level]
+
+        if len(breaches) == 0:
+            continue
+
+        buckets = breaches - breaches % bucket_ns
+        starts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+        ends = np.append(starts[1:], len(breaches))
+        bucket_starts = _to_datetimes(buckets[starts].astype('datetime64[ns]'))
+        firsts = _to_datetimes(breaches[starts].astype('datetime64[ns]'))
+        lasts = _to_datetimes(breaches[ends - 1].astype('datetime64[ns]'))
+
+        for bucket, count, first, last in zip(bucket_starts, (ends - starts).tolist(), firsts, lasts):
+            entry = tallies.setdefault(bucket, _empty_tally())
+            entry[f'{name}s'] = count
+            entry[f'first_{name}'] = first
+            entry[f'last_{name}'] = last
+
+    return tallies
+
+
+class AlertStateService(BaseService):
+    """
+    AlertStateService evaluates every alert on every saved alert dashboard in the background, so viewing a dashboard
+    doesn't have to scan its whole time range. Each run only reads the data points that arrived since the alert's
+    watermark, and adds their warnings and errors to per bucket tallies. Summing the tallies in a dashboard's time range
+    gives the same counts as the summary mode of AlertsService.get_alert, to within one bucket at the start of the range.
+    """
+    def __init__(self, config, services):
+        super().__init__(config, services)
+        self._session = self.services['CassandraService'].session
+        alerts_config = self.config.get('alerts', {})
+        self.bucket_seconds = alerts_config.get('bucket_seconds', 60)
+        # Data points can arrive late, so we only evaluate data points this much older than now.
+        self.lag = timedelta(seconds=alerts_config.get('lag_seconds', 30))
+        self.concurrency = alerts_config.get('concurrency', 50)
+
+    @property
+    def session(self) -> Session:
+        return self._session
+
+    @property
+    def alerts_service(self) -> AlertsService:
+        return self.services['AlertsService']
+
+    @property
+    def dashboards_service(self) -> DashboardsService:
+        return self.services['DashboardsService']
+
+    def _prepare(self, cql):
+        return self.services['CassandraService'].prepare(cql)
+
+    def get_alerts(self):
+        """
+        Collects the alerts on every alert dashboard.
+
+        :return: OrderedDict of alert_id to (alert spec, the longest time range of any dashboard the alert is on)
+        """
+        alerts = OrderedDict()
+
+        for dashboard in self.dashboards_service.get_dashboards('alert'):
+            window = dashboard_range(dashboard['data'])
+
+            for alert in dashboard_alerts(dashboard['data']):
+                alert = complete_alert(alert)
+
+                if alert is None:
+                    continue
+
+                key = alert_id(alert)
+
+                if key not in alerts or alerts[key][1] < window:
+                    alerts[key] = (alert, window)
+
+        return alerts
+
+    def _get_watermarks(self, alert_ids):
+        results = execute_concurrently(self.session, self._prepare(STATE_SELECT_CQL), [[key] for key in alert_ids],
+                                       self.concurrency)
+        watermarks = {}
+
+        for key, result in zip(alert_ids, results):
+            if isinstance(result, Exception):
+                logger.error('Failed to read the state of alert %s: %s', key, result)
+                continue
+
+            row = next(iter(result), None)
+            watermarks[key] = None if row is None else row['watermark']
+
+        return watermarks
+
+    def run_once(self, now=None):
+        """
+        Evaluates the data points that arrived since the last run for every alert. Alerts on the same metric share one
+        query, and the queries for every metric run concurrently.
+
+        :param now: naive UTC datetime, defaults to the current time.
+        :return: int, the number of alerts evaluated.
+        """
+        if now is None:
+            now = datetime.utcnow()
+
+        end = now - self.lag
+        alerts = self.get_alerts()
+        watermarks = self._get_watermarks(list(alerts))
+        groups = OrderedDict()
+
+        for key, watermark in watermarks.items():
+            alert, window = alerts[key]
+
+            try:
+                validate_columns(alert['table'], [alert['measure']])
+            except NotFoundError as e:
+                logger.error('Skipping alert %s: %s', alert, e)
+                continue
+
+            if watermark is not None and watermark >= end:
+                continue
+
+            group = (alert['environment'], alert['application'], alert['table'], alert['metric'])
+            groups.setdefault(group, []).append(key)
+
+        pending = []
+
+        for (environment, application, table, metric), keys in groups.items():
+            start = min(watermarks[key] or floor_timestamp(end - alerts[key][1], self.bucket_seconds) for key in keys)
+            statement, columns = self.alerts_service.alert_query(table, [alerts[key][0]['measure'] for key in keys])
+            params = [environment, application, metric, start, end]
+            future = self.session.execute_async(statement, params, execution_profile=COLUMNAR_PROFILE)
+            pending.append((keys, columns, future))
+
+        evaluated = 0
+
+        for keys, columns, future in pending:
+            try:
+                rows = as_columnar(future.result().current_rows, columns)
+            except Exception:
+                # The watermarks haven't moved, so these alerts will be caught up on the next run.
+                logger.exception('Failed to query data for alerts %s', keys)
+                continue
+
+            for key in keys:
+                alert, window = alerts[key]
+
+                try:
+                    self._evaluate(key, alert, window, rows, watermarks[key], end, now)
+                    evaluated += 1
+                except Exception:
+                    logger.exception('Failed to evaluate alert %s', alert)
+
+        return evaluated
+
+    def _evaluate(self, key, alert, window, rows, watermark, end, now):
+        timestamps, values = measure_values(rows, alert['measure'])
+
+        if watermark is not None:
+            # The query covers every alert on the metric, so skip data points this alert has already seen.
+            new = timestamps > np.datetime64(watermark, 'ns')
+            timestamps, values = timestamps[new], values[new]
+
+        levels = classify(values, alert['warning'], alert['error'])
+        # Tallies are kept as long as the longest time range they are shown in.
+        ttl = int(window.total_seconds()) + self.bucket_seconds
+        self._write_tallies(key, tally(timestamps, levels, self.bucket_seconds), ttl)
+        self.session.execute(self._prepare(STATE_UPDATE_CQL), [key, end, now])
+
+    def _write_tallies(self, key, tallies, ttl):
+        if len(tallies) == 0:
+            return
+
+        # Only the first bucket can already have a tally, from data points evaluated on the previous run.
+        for row in self.session.execute(self._prepare(TALLIES_SELECT_CQL), [key, min(tallies)]):
+            if row['bucket'] in tallies:
+                _merge(tallies[row['bucket']], row)
+
+        params = [
+            [key, bucket, entry['warnings'], entry['errors'], entry['first_warning'], entry['last_warning'],
+             entry['first_error'], entry['last_error'], ttl]
+            for bucket, entry in sorted(tallies.items())
+        ]
+        results = execute_concurrently(self.session, self._prepare(TALLIES_INSERT_CQL), params, self.concurrency)
+        raise_first_error(results)
+
+    def get_dashboard_state(self, name, now=None):
+        """
+        Returns the warning and error counts of every alert on a dashboard over the dashboard's time range, from the
+        tallies kept by run_once. Raises a NotFoundError if the dashboard does not exist.
+
+        :param name: str, the name of the alert dashboard.
+        :param now: naive UTC datetime, defaults to the current time.
+        :return: list containing, for each alert in the same order, a dict with the result in the same format as the
+            summary mode of AlertsService.get_alert plus the watermark, or the exception explaining why there is none.
+        """
+        if now is None:
+            now = datetime.utcnow()
+
+        dashboard = self.dashboards_service.get_dashboard('alert', name)
+        since = floor_timestamp(now - dashboard_range(dashboard['data']), self.bucket_seconds)
+        alerts = [complete_alert(alert) for alert in dashboard_alerts(dashboard['data'])]
+        keys = [alert_id(alert) for alert in alerts if alert is not None]
+        watermarks = self._get_watermarks(keys)
+        tallies = execute_concurrently(self.session, self._prepare(TALLIES_SELECT_CQL), [[key, since] for key in keys],
+                                       self.concurrency)
+        tallies = dict(zip(keys, tallies))
+        results = []
+
+        for alert in alerts:
+            if alert is None:
+                results.append(ValueError('Alert is not completely configured'))
+                continue
+
+            key = alert_id(alert)
+
+            if isinstance(tallies[key], Exception):
+                results.append(tallies[key])
+                continue
+
+            if watermarks.get(key) is None:
+                results.append(NotFoundError('Alert has not been evaluated yet'))
+                continue
+
+            total = _empty_tally()
+
+            for row in tallies[key]:
+                _merge(total, row)
+
+            results.append({
+                'warnings': {'count': total['warnings'], 'first': total['first_warning'],
+                             'last': total['last_warning']},
+                'errors': {'count': total['errors'], 'first': total['first_error'], 'last': total['last_error']},
+                'watermark': watermarks[key],
+            })
+
+        return results
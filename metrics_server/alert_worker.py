@@ -0,0 +1,40 @@
+import logging
+import time
+
+from metrics_server.alert_state_service import AlertStateService
+from metrics_server.alerts_service import AlertsService
+from metrics_server.cassandra_service import CassandraService
+from metrics_server.dashboards_service import DashboardsService
+from metrics_server.metrics_service import MetricsService
+from metrics_server.run import read_config
+
+logger = logging.getLogger(__name__)
+
+
+def run():
+    """
+    Bootstraps the services needed to evaluate alert dashboards and evaluates new data points for every alert forever,
+    once every alerts.interval seconds.
+
+    :return:
+    """
+    logging.basicConfig(level=logging.INFO)
+    config = read_config()
+    services = {}
+
+    for service_class in (CassandraService, MetricsService, DashboardsService, AlertsService, AlertStateService):
+        services[service_class.__name__] = service_class(config, services)
+
+    alert_state_service = services['AlertStateService']
+    interval = config.get('alerts', {}).get('interval', 30)
+
+    while True:
+        started = time.monotonic()
+        evaluated = alert_state_service.run_once()
+        elapsed = time.monotonic() - started
+        logger.info('Evaluated %d alerts in %.2f seconds', evaluated, elapsed)
+        time.sleep(max(interval - elapsed, 0))
+
+
+if __name__ == '__main__':
+    run()
@@ -1,8 +1,11 @@
 from flask import jsonify
 from marshmallow import Schema, fields
+from marshmallow.validate import OneOf
 
-from metrics_server.alerts_service import AlertsService
+from metrics_server.alert_state_service import AlertStateService
+from metrics_server.alerts_service import ALERT_MODES, AlertsService
 from metrics_server.base_controller import BaseController, validate_with
+from metrics_server.errors import NotFoundError
 
 
 class AlertSchema(Schema):
@@ -12,6 +15,27 @@ class AlertSchema(Schema):
     error = fields.Float(required=True)
     start = fields.DateTime(required=True)
     end = fields.DateTime(required=True)
+    mode = fields.String(missing='points', validate=OneOf(ALERT_MODES))
+
+
+class AlertSpecSchema(Schema):
+    environment = fields.String(required=True)
+    application = fields.String(required=True)
+    table = fields.String(required=True)
+    metric = fields.String(required=True)
+    measure = fields.String(required=True)
+    # Alerts on a dashboard can be saved before their thresholds are set, get_alerts_batch fails only those alerts.
+    warning = fields.Float(allow_none=True, missing=None)
+    error = fields.Float(allow_none=True, missing=None)
+
+
+class AlertBatchSchema(Schema):
+    # Either the name of a saved alert dashboard or a list of alerts.
+    dashboard = fields.String(missing=None)
+    alerts = fields.Nested(AlertSpecSchema, many=True, missing=None)
+    start = fields.DateTime(required=True)
+    end = fields.DateTime(required=True)
+    mode = fields.String(missing='points', validate=OneOf(ALERT_MODES))
 
 
 class FakeSchema(Schema):
@@ -23,11 +47,82 @@ class AlertsController(BaseController):
     def alerts_service(self) -> AlertsService:
         return self.services['AlertsService']
 
+    @property
+    def alert_state_service(self) -> AlertStateService:
+        return self.services['AlertStateService']
+
     @validate_with(AlertSchema(), validate_query_args=True)
     def alert(self, env, app, table, metric, body: dict):
-        warnings, errors = self.alerts_service.get_alert_data(env, app, table, metric, body['measure'], body['warning'],
-                                                              body['error'], body['start'], body['end'])
-        return jsonify(warnings=warnings, errors=errors), 200
+        result = self.alerts_service.get_alert(env, app, table, metric, body['measure'], body['warning'], body['error'],
+                                               body['start'], body['end'], body['mode'])
+        return jsonify(**result), 200
+
+    @validate_with(AlertBatchSchema())
+    def batch_alerts(self, body: dict):
+        """
+        Evaluates every alert of a saved alert dashboard, or a list of alerts, in one request. The response contains an
+        entry for each alert in the same order, with the result in data or, if the alert failed, the reason in
+        load_error.
+
+        :param body: A dict that has been validated against AlertBatchSchema.
+        :return: JSON
+        """
+        if (body['dashboard'] is None) == (body['alerts'] is None):
+            return jsonify(error='You must specify either dashboard or alerts'), 400
+
+        alerts = body['alerts']
+
+        if alerts is None:
+            try:
+                alerts = self.alerts_service.get_dashboard_alerts(body['dashboard'])
+            except NotFoundError as e:
+                return jsonify(error=str(e)), 404
+
+        results = self.alerts_service.get_alerts_batch(alerts, body['start'], body['end'], body['mode'])
+        data = []
+
+        for alert, result in zip(alerts, results):
+            entry = dict(alert)
+
+            if isinstance(result, Exception):
+                entry['load_error'] = str(result)
+            else:
+                entry['data'] = result
+
+            data.append(entry)
+
+        return jsonify(alerts=data), 200
+
+    def dashboard_state(self, name):
+        """
+        Returns the warning and error counts of every alert of a saved alert dashboard over the dashboard's time range,
+        as kept up to date by the alert worker. Entries are in the same format as the summary mode of batch_alerts,
+        plus the time the alert was last evaluated up to in data.watermark.
+
+        :param name: The name of the alert dashboard.
+        :return: JSON
+        """
+        try:
+            alerts = self.alerts_service.get_dashboard_alerts(name)
+            results = self.alert_state_service.get_dashboard_state(name)
+        except NotFoundError as e:
+            return jsonify(error=str(e)), 404
+
+        data = []
+
+        for alert, result in zip(alerts, results):
+            entry = dict(alert)
+
+            if isinstance(result, Exception):
+                entry['load_error'] = str(result)
+            else:
+                entry['data'] = result
+
+            data.append(entry)
+
+        return jsonify(alerts=data), 200
 
     def add_routes(self):
+        self.add_route('/api/v1/alerts/batch', self.batch_alerts, ['POST'])
+        self.add_route('/api/v1/alerts/dashboards/<name>/state', self.dashboard_state, ['GET'])
         self.add_route('/api/v1/alerts/<env>/<app>/<table>/<metric>', self.alert, ['GET'])
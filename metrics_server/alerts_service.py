@@ -1,7 +1,164 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
 from cassandra.cluster import Session
 
 from metrics_server.base_service import BaseService
+from metrics_server.cassandra_service import COLUMNAR_PROFILE
+from metrics_server.columnar import as_columnar
+from metrics_server.dashboards_service import DashboardsService
+from metrics_server.errors import NotFoundError
 from metrics_server.metrics_service import validate_columns
+from metrics_server.timing import stage
+
+# How alert results are returned, see AlertsService.get_alert.
+ALERT_MODES = ('points', 'summary', 'episodes')
+OK = 0
+WARNING = 1
+ERROR = 2
+
+
+def classify(values: np.ndarray, warning, error) -> np.ndarray:
+    """
+    Classifies every value at once as OK, WARNING or ERROR. A value is an error if it is at or above the error
+    threshold, otherwise it's a warning if it is at or above the warning threshold. NaN is never a breach.
+
+    :param values: np.ndarray of the measured values.
+    :param warning: float, the warning threshold.
+    :param error: float, the error threshold.
+    :return: np.ndarray of int8 levels.
+    """
+    levels = np.full(len(values), OK, dtype=np.int8)
+    levels[values >= warning] = WARNING
+    levels[values >= error] = ERROR
+
+    return levels
+
+
+def _to_datetimes(timestamps: np.ndarray) -> list:
+    return list(pd.to_datetime(timestamps).to_pydatetime())
+
+
+def alert_points(timestamps: np.ndarray, values: np.ndarray, levels: np.ndarray, measure):
+    """
+    Returns every breaching data point, only the breaching rows are converted to Python objects.
+
+    :return: tuple of (warnings, errors), each a list of dicts with the measure and the metric_timestamp.
+    """
+    results = []
+
+    for level in (WARNING, ERROR):
+        idx = np.flatnonzero(levels == level)
+        results.append([
+            {measure: value, 'metric_timestamp': timestamp}
+            for timestamp, value in zip(_to_datetimes(timestamps[idx]), values[idx].tolist())
+        ])
+
+    return results[0], results[1]
+
+
+def alert_summary(timestamps: np.ndarray, levels: np.ndarray) -> dict:
+    """
+    Returns the number of warnings and errors and the times of the first and last of each.
+
+    :return: dict with warnings and errors keys, each a dict with count, first, and last.
+    """
+    summary = {}
+
+    for key, level in (('warnings', WARNING), ('errors', ERROR)):
+        breaches = timestamps[levels == level]
+        first, last = _to_datetimes(breaches[[0, -1]]) if len(breaches) > 0 else (None, None)
+        summary[key] = {'count': len(breaches), 'first': first, 'last': last}
+
+    return summary
+
+
+def alert_episodes(timestamps: np.ndarray, values: np.ndarray, levels: np.ndarray) -> list:
+    """
+    Merges consecutive breaching data points into episodes. An episode is an error if its peak is an error, otherwise
+    it's a warning.
+
+    :return: list of dicts with the start, end, peak, peak_timestamp, level, and count of each episode.
+    """
+    breaching = np.concatenate([[0], (levels > OK).astype(np.int8), [0]])
+    edges = np.diff(breaching)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    episodes = []
+
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        peak_idx = start + int(np.nanargmax(values[start:end]))
+        start_ts, end_ts, peak_ts = _to_datetimes(timestamps[[start, end - 1, peak_idx]])
+        episodes.append({
+            'start': start_ts,
+            'end': end_ts,
+            'peak': values[peak_idx].item(),
+            'peak_timestamp': peak_ts,
+            'level': 'error' if levels[peak_idx] == ERROR else 'warning',
+            'count': end - start,
+        })
+
+    return episodes
+
+
+def evaluate(timestamps: np.ndarray, values: np.ndarray, measure, warning, error, mode='points') -> dict:
+    """
+    Evaluates an alert against the values of its measure, see AlertsService.get_alert for the modes.
+
+    :return: dict
+    """
+    if mode not in ALERT_MODES:
+        raise ValueError(f'Invalid alert mode "{mode}"')
+
+    levels = classify(values, warning, error)
+
+    if mode == 'summary':
+        return alert_summary(timestamps, levels)
+
+    if mode == 'episodes':
+        return {'episodes': alert_episodes(timestamps, values, levels)}
+
+    warnings, errors = alert_points(timestamps, values, levels, measure)
+
+    return {'warnings': warnings, 'errors': errors}
+
+
+def measure_values(rows, measure):
+    """
+    Returns the values of a measure from the columnar rows of an alert query, as (timestamps, values).
+    """
+    if len(rows) == 0:
+        return np.zeros(0, dtype='datetime64[ns]'), np.zeros(0)
+
+    if measure == 'interval_count':
+        return rows['metric_timestamp'], rows['count'] - rows['previous_count']
+
+    return rows['metric_timestamp'], rows[measure]
+
+
+def dashboard_alerts(data) -> list:
+    """
+    Converts the alerts saved in the data of an alert dashboard to alert specs, see AlertsService.get_alerts_batch.
+
+    :param data: dict, the data of an alert dashboard.
+    :return: list of dicts, alerts that haven't been completely configured have None values.
+    """
+    alerts = []
+
+    for alert in data.get('alerts', []):
+        metric = alert.get('metric') or {}
+        alerts.append({
+            'environment': metric.get('environment'),
+            'application': metric.get('application'),
+            'table': metric.get('table'),
+            'metric': metric.get('metric_name'),
+            'measure': metric.get('measure') or None,
+            'warning': alert.get('warning'),
+            'error': alert.get('error'),
+        })
+
+    return alerts
 
 
 class AlertsService(BaseService):
@@ -13,32 +170,154 @@ class AlertsService(BaseService):
     def session(self) -> Session:
         return self._session
 
-    def get_alert_data(self, environment, application, table, metric, measure, warning, error, start, end):
-        columns, is_interval_count = validate_columns(table, [measure])
-        columns = ['metric_timestamp'] + columns
+    @property
+    def dashboards_service(self) -> DashboardsService:
+        return self.services['DashboardsService']
+
+    def alert_query(self, table, measures):
+        """
+        Builds the statement that reads every measure in measures for an alert, measures are validated first.
+
+        :return: tuple of (PreparedStatement, list of selected columns)
+        """
+        columns = ['metric_timestamp']
+
+        for measure in measures:
+            measure_columns, _ = validate_columns(table, [measure])
+            columns += [column for column in measure_columns if column not in columns]
+
         query = (
             f'SELECT {", ".join(columns)} FROM {table} '
-            'WHERE environment = %s '
-            'AND application = %s '
-            'AND metric_name = %s '
-            'AND metric_timestamp >= %s '
-            'AND metric_timestamp <= %s '
+            'WHERE environment = ? '
+            'AND application = ? '
+            'AND metric_name = ? '
+            'AND metric_timestamp >= ? '
+            'AND metric_timestamp <= ? '
+            'ORDER BY metric_timestamp ASC'
         )
-        rows = self.session.execute(query, [environment, application, metric, start, end]).current_rows
-        warnings = []
-        errors = []
 
-        for row in rows:
-            if is_interval_count:
-                value = row['count'] - row['previous_count']
-            else:
-                value = row[measure]
+        return self.services['CassandraService'].prepare(query), columns
+
+    def get_alert_values(self, environment, application, table, metric, measure, start, end):
+        """
+        Retrieves the values of the measure an alert is on, oldest first.
+
+        :return: tuple of (datetime64 array of timestamps, np.ndarray of values)
+        """
+        statement, columns = self.alert_query(table, [measure])
+        params = [environment, application, metric, start, end]
+
+        with stage('alert_query'):
+            result = self.session.execute(statement, params, execution_profile=COLUMNAR_PROFILE)
+
+        return measure_values(as_columnar(result.current_rows, columns), measure)
+
+    def get_alert(self, environment, application, table, metric, measure, warning, error, start, end,
+                  mode='points'):
+        """
+        Evaluates an alert over a time range.
+
+        :param mode: str, one of ALERT_MODES:
+            - points: {"warnings": [...], "errors": [...]} every breaching data point.
+            - summary: {"warnings": {"count", "first", "last"}, "errors": {...}} only the counts and first and last
+              breach times.
+            - episodes: {"episodes": [...]} consecutive breaches merged into runs, see alert_episodes.
+        :return: dict
+        """
+        if mode not in ALERT_MODES:
+            raise ValueError(f'Invalid alert mode "{mode}"')
+
+        timestamps, values = self.get_alert_values(environment, application, table, metric, measure, start, end)
+
+        with stage('alert_evaluate'):
+            return evaluate(timestamps, values, measure, warning, error, mode)
+
+    def get_alert_data(self, environment, application, table, metric, measure, warning, error, start, end):
+        timestamps, values = self.get_alert_values(environment, application, table, metric, measure, start, end)
+
+        with stage('alert_evaluate'):
+            return alert_points(timestamps, values, classify(values, warning, error), measure)
+
+    def get_dashboard_alerts(self, name):
+        """
+        Returns the alerts saved in an alert dashboard as alert specs, see get_alerts_batch. Raises a NotFoundError if
+        the dashboard does not exist.
+
+        :param name: str, the name of the alert dashboard.
+        :return: list of dicts, alerts that haven't been completely configured have None values.
+        """
+        return dashboard_alerts(self.dashboards_service.get_dashboard('alert', name)['data'])
+
+    def get_alerts_batch(self, alerts, start, end, mode='points'):
+        """
+        Evaluates many alerts at once. Alerts on the same metric share a single query that selects all of their
+        measures, and the queries for every metric are sent to Cassandra concurrently.
+
+        :param alerts: list of dicts with environment, application, table, metric, measure, warning, and error keys.
+        :param start: datetime, the start of the time range.
+        :param end: datetime, the end of the time range.
+        :param mode: str, one of ALERT_MODES.
+        :return: list containing, for each alert in the same order, the result get_alert would have returned or the
+            exception raised while evaluating it.
+        """
+        if mode not in ALERT_MODES:
+            raise ValueError(f'Invalid alert mode "{mode}"')
+
+        results = [None] * len(alerts)
+        groups = OrderedDict()
+
+        for idx, alert in enumerate(alerts):
+            if any(alert.get(key) is None for key in ('environment', 'application', 'table', 'metric', 'measure',
+                                                       'warning', 'error')):
+                results[idx] = ValueError('Alert is not completely configured')
+                continue
+
+            key = (alert['environment'], alert['application'], alert['table'], alert['metric'])
+            groups.setdefault(key, []).append(idx)
+
+        pending = []
+
+        for (environment, application, table, metric), indexes in groups.items():
+            valid = []
+
+            for idx in indexes:
+                try:
+                    validate_columns(table, [alerts[idx]['measure']])
+                    valid.append(idx)
+                except NotFoundError as e:
+                    results[idx] = e
+
+            if len(valid) == 0:
+                continue
+
+            statement, columns = self.alert_query(table, [alerts[idx]['measure'] for idx in valid])
+            params = [environment, application, metric, start, end]
+            future = self.session.execute_async(statement, params, execution_profile=COLUMNAR_PROFILE)
+            pending.append((valid, columns, future))
+
+        for indexes, columns, future in pending:
+            try:
+                with stage('alert_query'):
+                    result = future.result()
+
+                rows = as_columnar(result.current_rows, columns)
+            except Exception as e:
+                # A failed query only fails the alerts on that metric.
+                for idx in indexes:
+                    results[idx] = e
+
+                continue
+
+            for idx in indexes:
+                alert = alerts[idx]
 
-            serialized = {measure: value, 'metric_timestamp': row['metric_timestamp']}
+                try:
+                    timestamps, values = measure_values(rows, alert['measure'])
 
-            if value >= error:
-                errors.append(serialized)
-            elif value >= warning:
-                warnings.append(serialized)
+                    with stage('alert_evaluate'):
+                        results[idx] = evaluate(timestamps, values, alert['measure'], alert['warning'],
+                                                alert['error'], mode)
+                except Exception as e:
+                    results[idx] = e
 
-        return warnings, errors
+        return results
@@ -2,14 +2,16 @@ from typing import Type
 
 from flask import Flask
 
+from metrics_server.alert_state_service import AlertStateService
 from metrics_server.alerts_controller import AlertsController
 from metrics_server.alerts_service import AlertsService
 from metrics_server.cassandra_service import CassandraService
 from metrics_server.dashboards_controller import DashboardsController
 from metrics_server.dashboards_service import DashboardsService
-from metrics_server.data_frame_encoder import DataFrameEncoder
+from metrics_server.data_frame_encoder import get_json_encoder
 from metrics_server.metrics_controller import MetricsController
 from metrics_server.metrics_service import MetricsService
+from metrics_server.stats_controller import StatsController
 
 
 class App:
@@ -21,7 +23,7 @@ class App:
         self.controllers = {}
         self.services = {}
         self.flask_app = Flask(__name__)
-        self.flask_app.json_encoder = DataFrameEncoder
+        self.flask_app.json_encoder = get_json_encoder(config.get('server', {}).get('json_backend', 'json'))
         self.flask_app.debug = config.get('debug', False)
         self._init_services()
         self._init_controllers()
@@ -45,6 +47,7 @@ class App:
         self.add_service(MetricsService)
         self.add_service(DashboardsService)
         self.add_service(AlertsService)
+        self.add_service(AlertStateService)
 
     def add_controller(self, controller_class: Type):
         """
@@ -64,3 +67,4 @@ class App:
         self.add_controller(MetricsController)
         self.add_controller(DashboardsController)
         self.add_controller(AlertsController)
+        self.add_controller(StatsController)
@@ -0,0 +1,369 @@
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from werkzeug.datastructures import Headers, MIMEAccept
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header
+from werkzeug.routing import Map, Rule
+from werkzeug.urls import url_decode
+
+from metrics_server.app import App
+from metrics_server.cassandra_service import COLUMNAR_PROFILE, as_asyncio_future
+from metrics_server.data_frame_encoder import (
+    COLUMNAR_BINARY_MIMETYPE, COLUMNAR_JSON_MIMETYPE, JSON_MIMETYPE, to_columnar_binary, to_columnar_json
+)
+from metrics_server.errors import NotFoundError
+from metrics_server.metrics_controller import METRIC_MIMETYPES, BatchSchema, parse_metric_args, to_utc
+from metrics_server.timing import end_request, record, server_timing, stage, start_request
+from metrics_server.run import read_config_from_env
+
+logger = logging.getLogger(__name__)
+
+
+class AsgiRequest:
+    """
+    The parts of an ASGI HTTP request our handlers need.
+    """
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = url_decode(scope.get('query_string', b''))
+        self.headers = Headers([(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers']])
+        self.body = body
+
+    @property
+    def accept_mimetypes(self) -> MIMEAccept:
+        return parse_accept_header(self.headers.get('Accept'), MIMEAccept)
+
+    def get_json(self):
+        if len(self.body) == 0:
+            return None
+
+        return json.loads(self.body)
+
+
+class AsgiApp:
+    """
+    AsgiApp serves an App from an asyncio event loop instead of a pool of threads. The metric data endpoints, which
+    are the ones a dashboard fans out to, are handled natively: the Cassandra queries are awaited, so a request only
+    holds a thread while its rows are being down sampled and encoded, which runs on a thread pool. Every other route
+    is handed to the Flask app on the same thread pool, so both modes serve exactly the same API.
+
+    Serve it with any ASGI server, e.g. uvicorn, see run.py.
+    """
+    def __init__(self, app: App, threads=4):
+        """
+        :param app: App, the app to serve.
+        :param threads: int, the size of the thread pool used for CPU bound work and for routes handled by Flask.
+        """
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        # The flights led by this event loop, see _fetch.
+        self._leading = {}
+        self.url_map = Map([
+            Rule('/api/v1/metrics/batch', endpoint=self.batch, methods=['POST']),
+            Rule('/api/v1/metrics/<table>/<env>/<app>/<metric>', endpoint=self.metric, methods=['GET']),
+        ])
+
+    @property
+    def metrics_service(self):
+        return self.app.services['MetricsService']
+
+    @property
+    def session(self):
+        return self.metrics_service.session
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Runs a blocking function on the thread pool, in the current context so its stages are timed with the request.
+
+        :return: asyncio.Future
+        """
+        context = contextvars.copy_context()
+
+        return asyncio.get_running_loop().run_in_executor(self.executor, partial(context.run, fn, *args, **kwargs))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        if scope['type'] != 'http':
+            return
+
+        body = bytearray()
+
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+
+            if not message.get('more_body', False):
+                break
+
+        request = AsgiRequest(scope, bytes(body))
+
+        try:
+            endpoint, values = self.url_map.bind('localhost').match(request.path, request.method)
+        except HTTPException:
+            status, headers, content = await self.run(self._call_flask, scope, request.body)
+        else:
+            # Requests handed to Flask are timed by StatsController, these are timed the same way here.
+            token = start_request()
+            started = time.perf_counter()
+
+            try:
+                status, headers, content = await endpoint(request, **values)
+            except Exception:
+                logger.exception('Exception on %s [%s]', request.path, request.method)
+                status, headers, content = await self.json_response({'error': 'Internal Server Error'}, 500)
+
+            timings = end_request(token)
+            timings['total'] = (time.perf_counter() - started) * 1000
+            record('total', timings['total'])
+            headers = headers + [('Server-Timing', server_timing(timings))]
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.metrics_service.stop_catalog_refresh()
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _call_flask(self, scope, body):
+        """
+        Calls the Flask app with a WSGI environ built from an ASGI scope, runs on the thread pool.
+
+        :return: tuple of (status, headers, body)
+        """
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = f'HTTP_{name}'
+
+            environ[name] = f'{environ[name]},{value}' if name in environ else value
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        iterable = self.app.flask_app.wsgi_app(environ, start_response)
+
+        try:
+            content = b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+        return response['status'], response['headers'], content
+
+    def _encode_json(self, payload):
+        return json.dumps(payload, cls=self.app.flask_app.json_encoder).encode('utf-8')
+
+    async def json_response(self, payload, status=200):
+        content = await self.run(self._encode_json, payload)
+
+        return status, [('Content-Type', JSON_MIMETYPE)], content
+
+    async def _fetch(self, query, rows):
+        """
+        Awaits the query planned by MetricsService.plan_metric_query, unless its rows were cached. With coalescing
+        enabled, identical queries in flight, in this process's event loop or any of its threads, share one fetch.
+        """
+        if rows is not None:
+            return rows
+
+        single_flight = self.metrics_service.single_flight
+
+        if single_flight is None:
+            return await self._execute(query)
+
+        flight, is_leader = single_flight.begin(query.key)
+
+        if not is_leader:
+            if flight in self._leading:
+                # The leader needs the thread pool to process its rows, so don't tie up a thread waiting for it.
+                return await asyncio.shield(self._leading[flight])
+
+            # Led by another thread, waiting blocks so it must not happen on the event loop thread.
+            return await self.run(single_flight.wait, flight)
+
+        leading = asyncio.get_running_loop().create_future()
+        self._leading[flight] = leading
+        result = None
+        # Only replaced if the fetch returns or raises an Exception, waiters must not hang if it is cancelled.
+        error = RuntimeError('The call in flight was interrupted')
+
+        try:
+            result = await self._execute(query)
+            error = None
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            del self._leading[flight]
+            single_flight.finish(flight, result, error)
+
+            if error is None:
+                leading.set_result(result)
+            else:
+                leading.set_exception(error)
+                # Mark the exception as retrieved, there may be no waiters.
+                leading.exception()
+
+        return result
+
+    async def _execute(self, query):
+        """
+        Executes every statement of a planned query concurrently and processes the results on the thread pool.
+        """
+        futures = [
+            as_asyncio_future(self.session.execute_async(statement, params, execution_profile=COLUMNAR_PROFILE))
+            for statement, params in query.statements
+        ]
+
+        with stage('metric_query'):
+            results = await asyncio.gather(*futures)
+
+        if len(results) == 1:
+            return await self.run(self.metrics_service.process_metric_result, query, results[0])
+
+        return await self.run(self.metrics_service.process_metric_results, query, results)
+
+    async def metric(self, request, table, env, app, metric):
+        """
+        The same as MetricsController.metric, except streamed responses aren't supported, stream=true is ignored.
+        """
+        try:
+            cols, size, start_ts, end_ts = parse_metric_args(request.args)
+        except ValueError as e:
+            return await self.json_response({'error': str(e)}, 400)
+
+        try:
+            # Planning may prepare the statement, a blocking round trip to Cassandra.
+            query, rows = await self.run(self.metrics_service.plan_metric_query, env, app, table, metric, cols,
+                                         start_ts, end_ts, size)
+        except NotFoundError as e:
+            return await self.json_response({'error': str(e)}, 404)
+
+        rows = await self._fetch(query, rows)
+        envelope = {
+            'environment': env,
+            'application': app,
+            'table': table,
+            'metric': metric,
+        }
+        mimetype = request.accept_mimetypes.best_match(METRIC_MIMETYPES, default=JSON_MIMETYPE)
+
+        # The format depends on the Accept header, caches must not serve one format to a client that asked for another.
+        vary = ('Vary', 'Accept')
+
+        if mimetype == COLUMNAR_JSON_MIMETYPE:
+            content = await self.run(to_columnar_json, envelope, rows)
+            return 200, [('Content-Type', mimetype), vary], f'{{"data": {content}}}'.encode('utf-8')
+
+        if mimetype == COLUMNAR_BINARY_MIMETYPE:
+            return 200, [('Content-Type', mimetype), vary], await self.run(to_columnar_binary, envelope, rows)
+
+        status, headers, content = await self.json_response({'data': {**envelope, 'rows': rows}})
+
+        return status, headers + [vary], content
+
+    async def batch(self, request):
+        """
+        The same as MetricsController.batch, every series is fetched concurrently.
+        """
+        try:
+            body = request.get_json()
+        except ValueError:
+            body = None
+
+        if body is None:
+            return await self.json_response({'error': 'Request body must be JSON'}, 400)
+
+        body, errors = BatchSchema().load(body)
+
+        if len(errors) > 0:
+            return await self.json_response({'errors': errors}, 400)
+
+        async def fetch(spec):
+            try:
+                query, rows = await self.run(
+                    self.metrics_service.plan_metric_query, spec['environment'], spec['application'], spec['table'],
+                    spec['metric'], spec['columns'], to_utc(spec['start_timestamp']), to_utc(spec['end_timestamp']),
+                    spec['size']
+                )
+                return await self._fetch(query, rows)
+            except Exception as e:
+                # A failed series should not fail the others, the error is reported for this series only.
+                return e
+
+        results = await asyncio.gather(*[fetch(spec) for spec in body['series']])
+        data = []
+
+        for spec, result in zip(body['series'], results):
+            entry = {key: spec[key] for key in ('environment', 'application', 'table', 'metric')}
+
+            if isinstance(result, Exception):
+                entry['error'] = str(result)
+            else:
+                entry['rows'] = result
+
+            data.append(entry)
+
+        return await self.json_response({'data': {'series': data}})
+
+
+def create_app():
+    """
+    Creates an AsgiApp configured from the environment, see run.read_config_from_env. Use it with an ASGI server that
+    supports app factories, e.g. uvicorn --factory metrics_server.asgi:create_app, or use server.mode asgi in run.py.
+
+    :return: AsgiApp
+    """
+    config = read_config_from_env()
+
+    return AsgiApp(App(config), config['server']['threads'])
@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A thread safe, size bounded, least recently used cache where every entry has its own time to live.
+
+    The size of the cache is the sum of the weights of its entries. By default every entry weighs 1, so max_size is the
+    maximum number of entries, pass a weigher to bound the cache by something else, like bytes.
+    """
+    def __init__(self, max_size, weigher=None, clock=time.monotonic):
+        """
+        :param max_size: The maximum total weight of all entries.
+        :param weigher: Optional function that takes a value and returns its weight.
+        :param clock: Function that returns the current time in seconds, only override this in tests.
+        """
+        self.max_size = max_size
+        self.weigher = weigher or (lambda value: 1)
+        self.clock = clock
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()  # key -> (value, weight, expires_at)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, weight, _ = self._entries.pop(key)
+        self.size -= weight
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored at key, or default if there is no value or it has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[2] <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+    def put(self, key, value, ttl):
+        """
+        Stores a value, evicting the least recently used entries until the cache fits within max_size. Values heavier
+        than max_size are not stored at all.
+
+        :param key: A hashable key.
+        :param value: The value to store.
+        :param ttl: The number of seconds the value is valid for.
+        :return: None
+        """
+        weight = self.weigher(value)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            if weight > self.max_size:
+                return
+
+            while self.size + weight > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+            self._entries[key] = (value, weight, self.clock() + ttl)
+            self.size += weight
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Returns the cache counters as a dict.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class _Flight:
+    def __init__(self, key):
+        self.key = key
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key. The first caller, the leader, does the work, and every caller that
+    arrives while it is in flight waits for and shares its result, or its exception. Once the leader finishes the next
+    call for the key starts a new flight, results are not kept around, that's what LRUCache is for.
+    """
+    def __init__(self, timeout=None):
+        """
+        :param timeout: The number of seconds callers wait for a leader before giving up with a TimeoutError, None
+            waits forever.
+        """
+        self.timeout = timeout
+        self.flights = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.timeouts = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """
+        Joins the flight for key, or starts one if there is none in flight. The leader must call finish, everyone else
+        calls wait.
+
+        :param key: A hashable key.
+        :return: tuple of (flight, bool), the bool is True if the caller is the leader.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+
+            flight = _Flight(key)
+            self._flights[key] = flight
+            self.flights += 1
+
+            return flight, True
+
+    def finish(self, flight, result=None, error=None):
+        """
+        Ends a flight and wakes up its waiters, with either the result or the exception the leader got.
+        """
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+            if error is not None:
+                self.errors += 1
+
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+    def wait(self, flight):
+        """
+        Waits for the leader of a flight and returns its result, or raises its exception.
+        """
+        if not flight.done.wait(self.timeout):
+            with self._lock:
+                self.timeouts += 1
+
+            raise TimeoutError(f'Timed out after {self.timeout} seconds waiting for an identical call in flight')
+
+        if flight.error is not None:
+            raise flight.error
+
+        return flight.result
+
+    def do(self, key, fn):
+        """
+        Calls fn, unless a call for the same key is already in flight, in which case that call's result is returned.
+
+        :param key: A hashable key.
+        :param fn: function that takes no arguments.
+        :return: The result of fn.
+        """
+        flight, is_leader = self.begin(key)
+
+        if not is_leader:
+            return self.wait(flight)
+
+        result = None
+        # Only replaced if fn returns or raises an Exception, waiters must not hang if the leader is interrupted.
+        error = RuntimeError('The call in flight was interrupted')
+
+        try:
+            result = fn()
+            error = None
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.finish(flight, result, error)
+
+        return result
+
+    def stats(self):
+        """
+        Returns the flight counters as a dict.
+        """
+        with self._lock:
+            return {
+                'flights': self.flights,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'in_flight': len(self._flights),
+            }
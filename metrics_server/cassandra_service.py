@@ -1,18 +1,223 @@
-from cassandra.cluster import Cluster, dict_factory
+import asyncio
+import threading
+from collections import deque
+
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT, dict_factory
+from cassandra.connection import locally_supported_compressions
+from cassandra.policies import (
+    ConstantSpeculativeExecutionPolicy, DCAwareRoundRobinPolicy, HostDistance, TokenAwarePolicy
+)
 
 from metrics_server.base_service import BaseService
+from metrics_server.columnar import columnar_factory
 from metrics_server.errors import ConfigurationError
 
 KEYSPACE = 'metric_data'
+# Queries executed with this profile return a ColumnarRows object (one NumPy array per column) instead of a list of
+# dicts, use it for queries that are going to end up in a DataFrame.
+COLUMNAR_PROFILE = 'columnar'
+COMPRESSIONS = ('lz4', 'snappy')
+# cassandra connects to a cluster, local uses an SQLite stand in for load testing without one, see local_store.py.
+BACKENDS = ('cassandra', 'local')
+
+
+def _number(config, key, cast, minimum, default=None, section='cassandra'):
+    """
+    Reads a number from a config section. Values may be strings (e.g. from environment variables) as long as
+    they can be converted.
+
+    :param config: dict, the config section.
+    :param key: str, the setting to read.
+    :param cast: int or float.
+    :param minimum: the smallest valid value.
+    :param default: returned when the setting is missing.
+    :param section: str, the name of the config section, used in error messages.
+    :return: int or float
+    """
+    value = config.get(key)
+
+    if value is None:
+        return default
+
+    try:
+        if isinstance(value, bool) or (cast is int and isinstance(value, float) and not value.is_integer()):
+            raise ValueError(value)
+
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ConfigurationError(f'{section}.{key} must be a number, got "{value}".')
+
+    if number < minimum:
+        raise ConfigurationError(f'{section}.{key} must be at least {minimum}, got {number}.')
+
+    return number
+
+
+def _contact_points(config):
+    """
+    Reads the hosts to connect to, either a list in hosts or a comma separated list in host.
+
+    :param config: dict, the cassandra config section.
+    :return: list of str
+    """
+    hosts = config.get('hosts', config.get('host'))
+
+    if hosts is None:
+        raise ConfigurationError('No host value found in cassandra section.')
+
+    if isinstance(hosts, str):
+        hosts = hosts.split(',')
+
+    if not isinstance(hosts, list) or not all(isinstance(host, str) for host in hosts):
+        raise ConfigurationError('cassandra.hosts must be a list of host names.')
+
+    hosts = [host.strip() for host in hosts if host.strip() != '']
+
+    if len(hosts) == 0:
+        raise ConfigurationError('No host value found in cassandra section.')
+
+    return hosts
+
+
+def _compression(config):
+    compression = config.get('compression')
+
+    if compression is None or compression is False or compression == 'none':
+        return False
+
+    if compression not in COMPRESSIONS:
+        raise ConfigurationError(f'cassandra.compression must be one of: none, {", ".join(COMPRESSIONS)}.')
+
+    if compression not in locally_supported_compressions:
+        raise ConfigurationError(f'cassandra.compression is {compression} but the {compression} package is not '
+                                 'installed.')
+
+    return compression
+
+
+def _load_balancing_policy(config):
+    """
+    Routes each query to a replica of its partition (this needs prepared statements, see CassandraService.prepare),
+    preferring hosts in the local data center.
+    """
+    local_dc = config.get('local_dc')
+
+    if local_dc is not None and not isinstance(local_dc, str):
+        raise ConfigurationError('cassandra.local_dc must be a string.')
+
+    remote_hosts = _number(config, 'used_hosts_per_remote_dc', int, 0, default=0)
+
+    return TokenAwarePolicy(DCAwareRoundRobinPolicy(local_dc=local_dc, used_hosts_per_remote_dc=remote_hosts))
+
+
+def _speculative_execution_policy(config):
+    """
+    When a metric read hasn't been answered after delay seconds, the same read is sent to another replica and the first
+    response wins. The driver only does this for statements marked as idempotent.
+    """
+    speculative = config.get('speculative_execution')
+
+    if speculative is None:
+        return None
+
+    if not isinstance(speculative, dict):
+        raise ConfigurationError('cassandra.speculative_execution must be an object with delay and max_attempts.')
+
+    section = 'cassandra.speculative_execution'
+    delay = _number(speculative, 'delay', float, 0.0, default=0.1, section=section)
+    max_attempts = _number(speculative, 'max_attempts', int, 1, default=2, section=section)
+
+    return ConstantSpeculativeExecutionPolicy(delay, max_attempts)
+
+
+def _future_result(future):
+    try:
+        return future.result()
+    except Exception as e:
+        return e
+
+
+def execute_concurrently(session, statement, params_list, concurrency=50, **kwargs):
+    """
+    Executes a statement once for every set of params, with at most concurrency queries in flight at a time. Unlike
+    cassandra.concurrent.execute_concurrent_with_args this only relies on execute_async and ResponseFuture.result.
+
+    :param session: The Cassandra session to execute with.
+    :param statement: The statement to execute, usually a prepared statement.
+    :param params_list: list of params, one per query.
+    :param concurrency: int, the maximum number of queries in flight.
+    :param kwargs: passed on to session.execute_async, e.g. execution_profile.
+    :return: list containing the result of each query in the same order as params_list, or the exception it raised.
+    """
+    results = []
+    in_flight = deque()
+
+    for params in params_list:
+        if len(in_flight) >= concurrency:
+            results.append(_future_result(in_flight.popleft()))
+
+        in_flight.append(session.execute_async(statement, params, **kwargs))
+
+    while len(in_flight) > 0:
+        results.append(_future_result(in_flight.popleft()))
+
+    return results
+
+
+def raise_first_error(results):
+    """
+    Raises the first exception in the results of execute_concurrently, if any query failed.
+
+    :param results: list returned by execute_concurrently.
+    :return: None
+    """
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+def as_asyncio_future(response_future, loop=None) -> asyncio.Future:
+    """
+    Wraps a ResponseFuture returned by Session.execute_async so it can be awaited. The driver calls us back on one of
+    its own threads, so the result is handed over to the event loop thread safely. Only the first page of a paged
+    result is awaited, fetching further pages blocks.
+
+    :param response_future: cassandra.cluster.ResponseFuture
+    :param loop: the event loop to resolve the future on, defaults to the running loop.
+    :return: asyncio.Future that resolves to the ResultSet, or raises the query's exception.
+    """
+    loop = loop or asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(result):
+        if not future.done():
+            future.set_result(result)
+
+    def reject(exception):
+        if not future.done():
+            future.set_exception(exception)
+
+    response_future.add_callbacks(
+        lambda _: loop.call_soon_threadsafe(resolve, response_future.result()),
+        lambda exception: loop.call_soon_threadsafe(reject, exception),
+    )
+
+    return future
 
 
 class CassandraService(BaseService):
     """
     This service just stores a cluster and connection configured for the metric_data keyspace. Use this in your other
     services if you don't need any special settings.
+
+    It also keeps a registry of prepared statements shared by every service, so each distinct query is only parsed by
+    Cassandra once and the driver can route it to a replica that owns the partition (token aware routing only works
+    with prepared statements).
     """
     def __init__(self, config, services):
         super().__init__(config, services)
+        self._prepared = {}
+        self._prepare_lock = threading.Lock()
         self._init_cassandra()
 
     def _init_cassandra(self):
@@ -26,16 +231,101 @@ class CassandraService(BaseService):
         if config is None:
             raise ConfigurationError('No cassandra section found in config.')
 
-        host = config.get('host')
+        backend = config.get('backend', 'cassandra')
 
-        if host is None:
-            raise ConfigurationError('No host value found in cassandra section.')
+        if backend not in BACKENDS:
+            raise ConfigurationError(f'cassandra.backend must be one of {", ".join(BACKENDS)}, not "{backend}".')
+
+        if backend == 'local':
+            # Imported here because local_store imports this module.
+            from metrics_server.local_store import LocalCluster
+
+            self.cluster = LocalCluster(config.get('local', {}))
+            self.session = self.cluster.connect(KEYSPACE)
+            return
+
+        hosts = _contact_points(config)
+        request_timeout = _number(config, 'request_timeout', float, 0.001, default=10.0)
+        metrics_request_timeout = _number(config, 'metrics_request_timeout', float, 0.001, default=request_timeout)
+        load_balancing_policy = _load_balancing_policy(config)
+        cluster_options = {
+            'port': _number(config, 'port', int, 1, default=9042),
+            'compression': _compression(config),
+        }
+        executor_threads = _number(config, 'executor_threads', int, 1)
+        protocol_version = _number(config, 'protocol_version', int, 1)
+        connections_per_host = _number(config, 'connections_per_host', int, 1)
+
+        if cluster_options['port'] > 65535:
+            raise ConfigurationError(f'cassandra.port must be at most 65535, got {cluster_options["port"]}.')
+
+        if executor_threads is not None:
+            cluster_options['executor_threads'] = executor_threads
+
+        if protocol_version is not None:
+            cluster_options['protocol_version'] = protocol_version
+
+        if connections_per_host is not None and (protocol_version is None or protocol_version > 2):
+            # Protocol version 3 and above multiplex thousands of requests over a single connection per host, the
+            # driver only supports connection pools for the older protocols.
+            raise ConfigurationError('cassandra.connections_per_host requires cassandra.protocol_version 1 or 2.')
+
+        profiles = {
+            EXEC_PROFILE_DEFAULT: ExecutionProfile(
+                load_balancing_policy=load_balancing_policy, request_timeout=request_timeout, row_factory=dict_factory
+            ),
+            COLUMNAR_PROFILE: ExecutionProfile(
+                load_balancing_policy=load_balancing_policy, request_timeout=metrics_request_timeout,
+                row_factory=columnar_factory, speculative_execution_policy=_speculative_execution_policy(config)
+            ),
+        }
+        self.cluster = Cluster(hosts, execution_profiles=profiles, **cluster_options)
+
+        if connections_per_host is not None:
+            self.cluster.set_max_connections_per_host(HostDistance.LOCAL, connections_per_host)
+            self.cluster.set_core_connections_per_host(HostDistance.LOCAL, connections_per_host)
 
-        self.cluster = Cluster([config['host']])
         self.session = self.cluster.connect(KEYSPACE)
-        self.session.row_factory = dict_factory
 
         # Note: we have to set the default fetch size to None in order for us to use pandas without taking a huge
         # performance hit. If we set the fetch_size then we need to page through results and append rows to the
-        # dataframe, which is bad because it has to copy the old dataframe, then append the new rows.
+        # dataframe, which is bad because it has to copy the old dataframe, then append the new rows. Queries that can
+        # process results one page at a time (see MetricsService.fetch_size) set a fetch size on the statement itself.
         self.session.default_fetch_size = None
+
+    def prepare(self, cql, fetch_size=None):
+        """
+        Returns a prepared statement for a query, preparing it the first time it is used. Queries are built from a
+        table name and a list of columns validated against COLUMN_MAP, so the number of distinct queries, and therefore
+        the size of the registry, is bounded.
+
+        :param cql: str, the query, using ? for bind markers.
+        :param fetch_size: int, optional page size of results, if not set results are not paged.
+        :return: PreparedStatement, SELECT statements are marked idempotent so they can be retried and speculatively
+            executed.
+        """
+        key = (cql, fetch_size)
+        statement = self._prepared.get(key)
+
+        if statement is None:
+            with self._prepare_lock:
+                statement = self._prepared.get(key)
+
+                if statement is None:
+                    statement = self.session.prepare(cql)
+
+                    if fetch_size is not None:
+                        statement.fetch_size = fetch_size
+
+                    statement.is_idempotent = cql.lstrip().upper().startswith('SELECT')
+
+                    self._prepared[key] = statement
+
+        return statement
+
+    @property
+    def prepared_count(self):
+        """
+        The number of statements in the registry.
+        """
+        return len(self._prepared)
@@ -0,0 +1,44 @@
+import logging
+import time
+
+from metrics_server.cassandra_service import CassandraService
+from metrics_server.metrics_service import MetricsService
+from metrics_server.run import read_config
+
+logger = logging.getLogger(__name__)
+
+
+def run():
+    """
+    Bootstraps the services needed to maintain the metric_catalog table, backfills it, and then reconciles it with the
+    raw tables forever, once every metrics.catalog.reconcile_interval seconds.
+
+    :return:
+    """
+    logging.basicConfig(level=logging.INFO)
+    config = read_config()
+    services = {}
+
+    for service_class in (CassandraService, MetricsService):
+        services[service_class.__name__] = service_class(config, services)
+
+    metrics_service = services['MetricsService']
+    interval = config.get('metrics', {}).get('catalog', {}).get('reconcile_interval', 5 * 60)
+
+    while True:
+        started = time.monotonic()
+
+        try:
+            written, deleted = metrics_service.reconcile_catalog()
+            elapsed = time.monotonic() - started
+            logger.info('Wrote %d and deleted %d catalog entries in %.2f seconds', written, deleted, elapsed)
+        except Exception:
+            # The catalog is left as it was, we'll try again on the next run.
+            logger.exception('Failed to reconcile the metric catalog')
+            elapsed = time.monotonic() - started
+
+        time.sleep(max(interval - elapsed, 0))
+
+
+if __name__ == '__main__':
+    run()
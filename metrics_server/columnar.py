@@ -0,0 +1,121 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+def _to_array(values) -> np.ndarray:
+    """
+    Converts a tuple of values from a single column into the most appropriate NumPy array. Timestamps become
+    datetime64, numbers become int64 or float64 (float64 if there are any nulls, so they can be stored as NaN), and
+    everything else is stored as an object array.
+
+    :param values: tuple of values from one column.
+    :return: np.ndarray
+    """
+    count = len(values)
+    first = next((value for value in values if value is not None), None)
+
+    if isinstance(first, datetime):
+        # Going through an object array and pandas is an order of magnitude faster than letting NumPy convert the
+        # datetime objects to datetime64 one at a time.
+        return pd.to_datetime(np.fromiter(values, dtype=object, count=count)).values
+
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        array = np.array(values)
+
+        if array.dtype == object:
+            # There were nulls in the column, NaN is the closest thing we have to null in a numeric array.
+            array = np.array(values, dtype=np.float64)
+
+        return array
+
+    return np.fromiter(values, dtype=object, count=count)
+
+
+def _to_list(array: np.ndarray) -> list:
+    if array.dtype.kind == 'M':
+        # tolist() on a datetime64[ns] array returns integers, so go through pandas to get datetime objects.
+        return list(pd.to_datetime(array).to_pydatetime())
+
+    return array.tolist()
+
+
+class ColumnarRows:
+    """
+    ColumnarRows stores the rows returned by a query as one NumPy array per column instead of one dict per row. This
+    lets us build DataFrames and do math on results without creating a Python object for every cell.
+    """
+    def __init__(self, column_names, arrays):
+        self.column_names = list(column_names)
+        self.arrays = arrays
+
+    def __len__(self):
+        if len(self.column_names) == 0:
+            return 0
+
+        return len(self.arrays[self.column_names[0]])
+
+    def __getitem__(self, column):
+        return self.arrays[column]
+
+    def __iter__(self):
+        """
+        Iterates over the rows as dicts, this exists so ColumnarRows can be used anywhere the driver expects a list of
+        rows. It is slow, so avoid it in code that cares about performance.
+        """
+        columns = [_to_list(self.arrays[name]) for name in self.column_names]
+
+        for values in zip(*columns):
+            yield dict(zip(self.column_names, values))
+
+    @classmethod
+    def empty(cls, column_names):
+        return cls(column_names, {name: np.empty(0) for name in column_names})
+
+    def to_data_frame(self, index=None) -> pd.DataFrame:
+        """
+        Converts the rows to a DataFrame without copying each value into a Python object first.
+
+        :param index: str, optional name of a column to use as the index of the DataFrame.
+        :return: pd.DataFrame
+        """
+        data = {name: self.arrays[name] for name in self.column_names if name != index}
+
+        if index is None:
+            return pd.DataFrame(data, columns=self.column_names)
+
+        columns = [name for name in self.column_names if name != index]
+
+        return pd.DataFrame(data, columns=columns, index=pd.Index(self.arrays[index], name=index))
+
+
+def columnar_factory(column_names, rows):
+    """
+    A Cassandra driver row factory that returns a ColumnarRows object instead of a list of rows.
+
+    :param column_names: list of column names in the result.
+    :param rows: list of tuples, each tuple is a row.
+    :return: ColumnarRows
+    """
+    if len(rows) == 0:
+        return ColumnarRows.empty(column_names)
+
+    columns = zip(*rows)
+
+    return ColumnarRows(column_names, {name: _to_array(values) for name, values in zip(column_names, columns)})
+
+
+def as_columnar(rows, column_names) -> ColumnarRows:
+    """
+    ResultSet.current_rows returns an empty list instead of our ColumnarRows object when a query returns no rows, this
+    function normalizes that so callers always get ColumnarRows.
+
+    :param rows: the current_rows of a ResultSet executed with the columnar execution profile.
+    :param column_names: list of column names that were selected.
+    :return: ColumnarRows
+    """
+    if isinstance(rows, ColumnarRows):
+        return rows
+
+    return ColumnarRows.empty(column_names)
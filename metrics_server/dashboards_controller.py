@@ -1,4 +1,4 @@
-from flask import jsonify, request
+from flask import Response, jsonify, request
 from marshmallow import Schema, fields
 
 from metrics_server.base_controller import BaseController, validate_with
@@ -12,6 +12,32 @@ class DashboardPostSchema(Schema):
     data = fields.Dict(required=True)
 
 
+class RenderSchema(Schema):
+    start_timestamp = fields.DateTime(missing=None)
+    end_timestamp = fields.DateTime(missing=None)
+    size = fields.Integer(missing=1000)
+
+
+def etag_response(etag, **kwargs):
+    """
+    Returns kwargs as JSON with an ETag header, or an empty 304 response if the client already has this version.
+
+    :param etag: str, the ETag of the response content.
+    :param kwargs: the JSON response.
+    :return: Response
+    """
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(**kwargs)
+
+    resp.set_etag(etag)
+    # Browsers must check with us before reusing a response, but they only download it again if it changed.
+    resp.headers['Cache-Control'] = 'no-cache'
+
+    return resp
+
+
 class DashboardsController(BaseController):
     @property
     def dashboards_service(self) -> DashboardsService:
@@ -23,7 +49,9 @@ class DashboardsController(BaseController):
 
         :return: JSON
         """
-        return jsonify(dashboards=self.dashboards_service.get_dashboards())
+        dashboards, etag = self.dashboards_service.get_dashboards_with_etag()
+
+        return etag_response(etag, dashboards=dashboards)
 
     @validate_with(DashboardPostSchema())
     def post_dashboards(self, body: dict):
@@ -48,10 +76,12 @@ class DashboardsController(BaseController):
         :return:
         """
         try:
-            return jsonify(dashboards=self.dashboards_service.get_dashboards(type_))
+            dashboards, etag = self.dashboards_service.get_dashboards_with_etag(type_)
         except ValueError as e:
             return jsonify(error=str(e)), 400
 
+        return etag_response(etag, dashboards=dashboards)
+
     def get_dashboard(self, type_: str, name: str):
         """
         Fetches dashboard from database given type and name.
@@ -61,10 +91,38 @@ class DashboardsController(BaseController):
         :return:
         """
         try:
-            return jsonify(dashboard=self.dashboards_service.get_dashboard(type_, name))
+            dashboard, etag = self.dashboards_service.get_dashboard_with_etag(type_, name)
+        except NotFoundError as e:
+            return jsonify(error=str(e)), 404
+
+        return etag_response(etag, dashboard=dashboard)
+
+    def render_dashboard(self, name: str):
+        """
+        Returns a time series dashboard together with the data of every series on it, so the frontend can draw the
+        whole dashboard after one request instead of one request per series. Each chart's series are in
+        charts[i].series in the same order as the chart's metrics, with the data in rows or the reason it failed in
+        error.
+
+        :param name: str, the name of the dashboard
+        :return: JSON
+        """
+        # GET requests have no body, so the query args are validated on their own.
+        body, errors = RenderSchema().load(request.args.to_dict())
+
+        if len(errors) > 0:
+            return jsonify(errors=errors), 400
+
+        try:
+            dashboard, charts = self.dashboards_service.render_time_series_dashboard(
+                name, body['start_timestamp'], body['end_timestamp'], body['size']
+            )
         except NotFoundError as e:
             return jsonify(error=str(e)), 404
 
+        # rows are DataFrames, to see how they are encoded take a look at data_frame_encoder.py
+        return jsonify(dashboard=dashboard, charts=[{'series': series} for series in charts])
+
     def put_dashboard(self, type_: str, name: str):
         """
         Allows a user to modify a dashboard. Currently only allows for updating the data attribute of a dashboard, and
@@ -111,5 +169,6 @@ class DashboardsController(BaseController):
         self.add_route('/api/v1/dashboards', self.post_dashboards, ['POST'])
         self.add_route('/api/v1/dashboards/<type_>', self.get_dashboards_by_type, ['GET'])
         self.add_route('/api/v1/dashboards/<type_>/<name>', self.get_dashboard, ['GET'])
+        self.add_route('/api/v1/dashboards/time_series/<name>/render', self.render_dashboard, ['GET'])
         self.add_route('/api/v1/dashboards/<type_>/<name>', self.put_dashboard, ['PUT'])
         self.add_route('/api/v1/dashboards/<type_>/<name>', self.delete_dashboard, ['DELETE'])
@@ -1,14 +1,93 @@
+import hashlib
 import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
 
+import pytz
 from cassandra.cluster import Session
+from dateutil.parser import parse
 
 from metrics_server.base_service import BaseService
+from metrics_server.cache import LRUCache
 from metrics_server.errors import NotFoundError
+from metrics_server.timing import stage
 
 DASHBOARD_TYPES = ('time_series', 'alert')
-INSERT_CQL = 'INSERT INTO dashboards (type, name, data) VALUES (%s, %s, %s) IF NOT EXISTS;'
-UPDATE_CQL = 'UPDATE dashboards SET data = %s WHERE type = %s AND name = %s;'
-DELETE_CQL = 'DELETE FROM dashboards WHERE type = %s and name = %s;'
+SELECT_ALL_CQL = 'SELECT * FROM dashboards'
+SELECT_TYPE_CQL = 'SELECT * FROM dashboards WHERE type = ?'
+SELECT_ONE_CQL = 'SELECT * FROM dashboards WHERE type = ? AND name = ?'
+INSERT_CQL = 'INSERT INTO dashboards (type, name, data) VALUES (?, ?, ?) IF NOT EXISTS;'
+UPDATE_CQL = 'UPDATE dashboards SET data = ? WHERE type = ? AND name = ?;'
+DELETE_CQL = 'DELETE FROM dashboards WHERE type = ? and name = ?;'
+# The units of the rangePeriod of dynamic charts and alert dashboards, in seconds.
+RANGE_UNITS = {'minutes': 60, 'hours': 60 * 60, 'days': 24 * 60 * 60}
+DEFAULT_RANGE = timedelta(hours=1)
+# The cache holds one entry per dashboard list and per dashboard read, there are only a handful of lists.
+CACHE_MAX_ENTRIES = 1000
+
+
+def content_etag(value) -> str:
+    """
+    Returns a hash of the JSON representation of value, equal values always have the same ETag.
+
+    :param value: anything json.dumps can encode.
+    :return: str
+    """
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _to_utc(timestamp):
+    if timestamp.tzinfo is None:
+        return pytz.utc.localize(timestamp)
+
+    return timestamp.astimezone(pytz.utc)
+
+
+def dashboard_range(data) -> timedelta:
+    """
+    Returns the length of a dynamic time range, e.g. rangeMultiplier 6 and rangePeriod hours is 6 hours. Alert
+    dashboards are created with the two swapped (rangePeriod 1 and rangeMultiplier hours) and only have them the right
+    way round once saved from the dashboard settings, so the unit is whichever of the two is one of RANGE_UNITS. The
+    amount may be a number or, when it was edited in the UI, a string.
+
+    :param data: dict, a chart or the data of an alert dashboard.
+    :return: timedelta
+    """
+    amount, unit = data.get('rangeMultiplier'), data.get('rangePeriod')
+
+    if isinstance(amount, str) and amount in RANGE_UNITS:
+        amount, unit = unit, amount
+
+    try:
+        return timedelta(seconds=float(amount) * RANGE_UNITS[unit])
+    except (KeyError, TypeError, ValueError):
+        return DEFAULT_RANGE
+
+
+def chart_window(chart, now):
+    """
+    Returns the time range a time series chart shows, either its fixed dates or its range up to now.
+
+    :param chart: dict, a chart of a time series dashboard.
+    :param now: timezone aware datetime.
+    :return: tuple of (start, end) timezone aware datetimes.
+    """
+    if chart.get('rangeType') == 'fixed':
+        try:
+            return _to_utc(parse(chart['startDate'])), _to_utc(parse(chart['endDate']))
+        except (KeyError, TypeError, ValueError):
+            # Fall back to the dynamic range below.
+            pass
+
+    return now - dashboard_range(chart), now
+
+
+def _to_dashboard(row):
+    return {
+        'type': row['type'],
+        'name': row['name'],
+        'data': json.loads(row['data']),
+    }
 
 
 class DashboardsService(BaseService):
@@ -18,11 +97,76 @@ class DashboardsService(BaseService):
     def __init__(self, config, services):
         super().__init__(config, services)
         self._session = self.services['CassandraService'].session
+        # Reads are cached for cache_ttl seconds. A write only clears the cache of the process that handled it, so with
+        # several server processes, including the workers of server.workers, the others can serve the old dashboard
+        # until it expires. That's why the cache is off unless cache_ttl is set.
+        self.cache_ttl = self.config.get('dashboards', {}).get('cache_ttl', 0)
+        self.cache = LRUCache(CACHE_MAX_ENTRIES) if self.cache_ttl > 0 else None
+        self._generation = 0
 
     @property
     def session(self) -> Session:
         return self._session
 
+    def _execute(self, cql, params=None):
+        with stage('dashboard_query'):
+            return self.session.execute(self.services['CassandraService'].prepare(cql), params)
+
+    def _cached(self, key, load):
+        """
+        Returns the cached (value, etag) stored at key, or calls load to read the value from the database and caches it.
+        Cached values are shared between callers and must not be modified.
+        """
+        if self.cache is not None:
+            entry = self.cache.get(key)
+
+            if entry is not None:
+                return entry
+
+        generation = self._generation
+        value = load()
+        entry = (value, content_etag(value))
+
+        # Don't cache a value that was read before a write finished, it may already be out of date.
+        if self.cache is not None and generation == self._generation:
+            self.cache.put(key, entry, self.cache_ttl)
+
+        return entry
+
+    def invalidate(self):
+        """
+        Clears the dashboard cache, called after every write.
+
+        :return: None
+        """
+        self._generation += 1
+
+        if self.cache is not None:
+            self.cache.clear()
+
+    @property
+    def metrics_service(self):
+        return self.services['MetricsService']
+
+    def get_dashboards_with_etag(self, type_=None):
+        """
+        Same as get_dashboards, but also returns the ETag of the dashboards.
+
+        :return: tuple of (list of dicts, str)
+        """
+        if type_ is not None and type_ not in DASHBOARD_TYPES:
+            raise ValueError(f'Invalid dashboard type "{type_}"')
+
+        def load():
+            if type_ is None:
+                rows = self._execute(SELECT_ALL_CQL)
+            else:
+                rows = self._execute(SELECT_TYPE_CQL, [type_])
+
+            return [_to_dashboard(row) for row in rows]
+
+        return self._cached(('list', type_), load)
+
     def get_dashboards(self, type_=None):
         """
         Retrieves dashboards from database by type, if type is not specified it retrieves all dashboards.
@@ -30,27 +174,23 @@ class DashboardsService(BaseService):
         :param type_:
         :return:
         """
-        if type_ is not None and type_ not in DASHBOARD_TYPES:
-            raise ValueError(f'Invalid dashboard type "{type_}"')
+        return self.get_dashboards_with_etag(type_)[0]
 
-        query = 'SELECT * FROM dashboards'
-        params = None
+    def get_dashboard_with_etag(self, type_, name):
+        """
+        Same as get_dashboard, but also returns the ETag of the dashboard.
 
-        if type_ is not None:
-            query += ' WHERE type = %s'
-            params = [type_]
+        :return: tuple of (dict, str)
+        """
+        return self._cached(('one', type_, name), lambda: self._load_dashboard(type_, name))
 
-        rows = self.session.execute(query, params)
-        dashboards = []
+    def _load_dashboard(self, type_, name):
+        rows = self._execute(SELECT_ONE_CQL, [type_, name]).current_rows
 
-        for row in rows:
-            dashboards.append({
-                'type': row['type'],
-                'name': row['name'],
-                'data': json.loads(row['data']),
-            })
+        if len(rows) == 0:
+            raise NotFoundError(f'No dashboard found with type = "{type_}" and name = "{name}"')
 
-        return dashboards
+        return _to_dashboard(rows[0])
 
     def get_dashboard(self, type_, name):
         """
@@ -60,19 +200,7 @@ class DashboardsService(BaseService):
         :param name: str, the name of the dashboard
         :return: dict representation of dashboard object
         """
-        query = 'SELECT * FROM dashboards WHERE type = %s AND name = %s'
-        rows = self.session.execute(query, [type_, name]).current_rows
-
-        if len(rows) == 0:
-            raise NotFoundError(f'No dashboard found with type = "{type_}" and name = "{name}"')
-
-        row = rows[0]
-
-        return {
-            'type': row['type'],
-            'name': row['name'],
-            'data': json.loads(row['data']),
-        }
+        return self.get_dashboard_with_etag(type_, name)[0]
 
     def create_dashboard(self, type_, name, data):
         """
@@ -88,7 +216,8 @@ class DashboardsService(BaseService):
             raise ValueError(f'Invalid dashboard type "{type_}"')
 
         data = json.dumps(data)
-        resp = self.session.execute(INSERT_CQL, [type_, name, data])[0]
+        resp = self._execute(INSERT_CQL, [type_, name, data])[0]
+        self.invalidate()
 
         if resp['[applied]'] is False:
             raise ValueError(f'Dashboard with type "{type_}" and name "{name}" already exists')
@@ -103,10 +232,11 @@ class DashboardsService(BaseService):
         :param data: dict, the data for the dashboard
         :return: None
         """
-        # Raise a not found error if the dashboard does not exist.
-        self.get_dashboard(type_, name)
+        # Raise a not found error if the dashboard does not exist, skipping the cache in case it was just deleted.
+        self._load_dashboard(type_, name)
         data = json.dumps(data)
-        self.session.execute(UPDATE_CQL, [data, type_, name])
+        self._execute(UPDATE_CQL, [data, type_, name])
+        self.invalidate()
 
     def delete_dashboard(self, type_, name):
         """
@@ -116,6 +246,68 @@ class DashboardsService(BaseService):
         :param name: str, the name of the dashboard
         :return: None
         """
-        # Raise a not found error if the dashboard does not exist.
-        self.get_dashboard(type_, name)
-        self.session.execute(DELETE_CQL, [type_, name])
+        # Raise a not found error if the dashboard does not exist, skipping the cache in case it was just deleted.
+        self._load_dashboard(type_, name)
+        self._execute(DELETE_CQL, [type_, name])
+        self.invalidate()
+
+    def render_time_series_dashboard(self, name, start_timestamp=None, end_timestamp=None, size=1000):
+        """
+        Loads a time series dashboard together with the data of every series on every chart. Series on the same metric
+        and time range share one query that selects all of their measures, and the queries run concurrently. Raises a
+        NotFoundError if the dashboard does not exist.
+
+        :param name: str, the name of the dashboard.
+        :param start_timestamp: datetime, overrides the start of every chart. Defaults to each chart's own range.
+        :param end_timestamp: datetime, overrides the end of every chart. Defaults to each chart's own range.
+        :param size: int, the desired number of rows per series, see MetricsService.get_metric_data.
+        :return: tuple of (dashboard dict, list with a list of series per chart). Each series is a dict with
+            environment, application, table, metric_name, and measure, plus either rows, a DataFrame with
+            metric_timestamp and the measure, or error.
+        """
+        dashboard = self.get_dashboard('time_series', name)
+        now = datetime.now(tz=pytz.utc)
+        charts = []
+        groups = OrderedDict()
+
+        for chart in dashboard['data'].get('charts', []):
+            start, end = chart_window(chart, now)
+            start = start if start_timestamp is None else _to_utc(start_timestamp)
+            end = end if end_timestamp is None else _to_utc(end_timestamp)
+            series = []
+
+            for metric in chart.get('metrics', []):
+                entry = {key: metric.get(key) for key in ('environment', 'application', 'table', 'metric_name')}
+                entry['measure'] = metric.get('measure') or None
+                series.append(entry)
+
+                if any(value is None for value in entry.values()):
+                    entry['error'] = 'Series is not completely configured'
+                    continue
+
+                # interval_count is calculated from count and previous_count, so it can't share a query with them.
+                key = (entry['table'], entry['environment'], entry['application'], entry['metric_name'], start, end,
+                       entry['measure'] == 'interval_count')
+                groups.setdefault(key, []).append(entry)
+
+            charts.append(series)
+
+        specs = []
+
+        for (table, environment, application, metric, start, end, _), entries in groups.items():
+            columns = list(OrderedDict.fromkeys(entry['measure'] for entry in entries))
+            specs.append({
+                'environment': environment, 'application': application, 'table': table, 'metric': metric,
+                'columns': columns, 'start_timestamp': start, 'end_timestamp': end, 'size': size,
+            })
+
+        results = self.metrics_service.get_metric_data_batch(specs)
+
+        for entries, result in zip(groups.values(), results):
+            for entry in entries:
+                if isinstance(result, Exception):
+                    entry['error'] = str(result)
+                else:
+                    entry['rows'] = result[['metric_timestamp', entry['measure']]]
+
+        return dashboard, charts
@@ -0,0 +1,215 @@
+import numpy as np
+import pandas as pd
+
+NS_PER_SECOND = 10 ** 9
+NS_PER_DAY = 24 * 60 * 60 * NS_PER_SECOND
+# Maps the aggregation functions used in AGGREGATOR_MAP to the running aggregate we keep for each bucket.
+AGGREGATIONS = {
+    np.max: 'max',
+    np.min: 'min',
+    np.sum: 'sum',
+    np.mean: 'mean',
+}
+
+
+def bucket_seconds(start_timestamp, end_timestamp, size):
+    """
+    Computes the bucket size (in seconds) used to down sample a time range to roughly size rows.
+
+    :param start_timestamp: datetime, start of the range.
+    :param end_timestamp: datetime, end of the range.
+    :param size: int, the desired number of rows.
+    :return: int, never less than one second.
+    """
+    seconds = (end_timestamp - start_timestamp).total_seconds()
+
+    return max(int(seconds // size), 1)
+
+
+def _to_ns(timestamps) -> np.ndarray:
+    if isinstance(timestamps, pd.DatetimeIndex):
+        timestamps = timestamps.tz_localize(None) if timestamps.tz is not None else timestamps
+
+    return np.asarray(timestamps, dtype='datetime64[ns]').view(np.int64)
+
+
+def _resize(array, before, after, fill):
+    return np.concatenate([np.full(before, fill, dtype=array.dtype), array, np.full(after, fill, dtype=array.dtype)])
+
+
+class BucketAggregator:
+    """
+    BucketAggregator folds rows into fixed size time buckets as they arrive, so we can down sample a query one page at
+    a time instead of loading every row into memory first. Memory use depends on the number of buckets, not the number
+    of rows.
+
+    The buckets and the output are the same as DataFrame.resample(f'{bucket_size}S').agg(aggregators): buckets are
+    anchored at midnight (UTC) of the day of the first row, labeled by their left edge, empty buckets between the first
+    and last row are kept, and sums of empty buckets are 0 while every other aggregate is NaN.
+    """
+    def __init__(self, bucket_size, aggregators, origin=None):
+        """
+        :param bucket_size: int, size of each bucket in seconds.
+        :param aggregators: dict of column name to aggregation function, see metrics_service.AGGREGATOR_MAP.
+        :param origin: optional datetime64 the buckets are anchored on. Defaults to midnight of the first row's day.
+        """
+        self.bucket_ns = int(bucket_size) * NS_PER_SECOND
+        self.kinds = {column: AGGREGATIONS[fn] for column, fn in aggregators.items()}
+        self.origin = None if origin is None else _to_ns([origin])[0]
+        self.offset = 0  # The bucket number of the first slot in our arrays.
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.values = {column: np.zeros(0) for column in self.kinds}
+        self.counts = {column: np.zeros(0) for column in self.kinds if self.kinds[column] == 'mean'}
+        self.dtypes = {}
+
+    def __len__(self):
+        """
+        The number of rows folded so far.
+        """
+        return int(self.rows.sum())
+
+    def _fill_value(self, column):
+        return 0.0 if self.kinds[column] in ('sum', 'mean') else np.nan
+
+    def _grow(self, first, last):
+        """
+        Makes sure our arrays have a slot for every bucket between first and last.
+        """
+        if len(self.rows) == 0:
+            self.offset = first
+            size = last - first + 1
+            self.rows = np.zeros(size, dtype=np.int64)
+
+            for column in self.kinds:
+                self.values[column] = np.full(size, self._fill_value(column))
+
+            for column in self.counts:
+                self.counts[column] = np.zeros(size)
+
+            return
+
+        before = max(self.offset - first, 0)
+        after = max(last - (self.offset + len(self.rows) - 1), 0)
+
+        if before == 0 and after == 0:
+            return
+
+        self.offset -= before
+        self.rows = _resize(self.rows, before, after, 0)
+
+        for column in self.kinds:
+            self.values[column] = _resize(self.values[column], before, after, self._fill_value(column))
+
+        for column in self.counts:
+            self.counts[column] = _resize(self.counts[column], before, after, 0.0)
+
+    def fold(self, timestamps, columns, weights=None):
+        """
+        Adds a batch of rows to the buckets.
+
+        :param timestamps: datetime64 array or DatetimeIndex, the timestamp of each row.
+        :param columns: dict of column name to array of values, must contain every column we are aggregating.
+        :param weights: optional array, the number of samples each row represents. Only used for mean columns, this is
+            needed when folding rows that are already aggregates of other rows.
+        :return: None
+        """
+        timestamps = _to_ns(timestamps)
+
+        if len(timestamps) == 0:
+            return
+
+        if self.origin is None:
+            self.origin = timestamps.min() - timestamps.min() % NS_PER_DAY
+
+        ids = (timestamps - self.origin) // self.bucket_ns
+        order = None
+
+        if np.any(ids[1:] < ids[:-1]):
+            order = np.argsort(ids, kind='mergesort')
+            ids = ids[order]
+
+        starts = np.flatnonzero(np.concatenate([[True], ids[1:] != ids[:-1]]))
+        bucket_ids = ids[starts]
+        self._grow(int(bucket_ids[0]), int(bucket_ids[-1]))
+        positions = bucket_ids - self.offset
+        self.rows[positions] += np.diff(np.append(starts, len(ids)))
+
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)
+
+            if order is not None:
+                weights = weights[order]
+
+        for column, kind in self.kinds.items():
+            values = np.asarray(columns[column])
+            self.dtypes.setdefault(column, values.dtype)
+            values = values.astype(np.float64)
+
+            if order is not None:
+                values = values[order]
+
+            nulls = np.isnan(values)
+            accumulator = self.values[column]
+
+            if kind == 'max':
+                accumulator[positions] = np.fmax(accumulator[positions], np.fmax.reduceat(values, starts))
+            elif kind == 'min':
+                accumulator[positions] = np.fmin(accumulator[positions], np.fmin.reduceat(values, starts))
+            elif kind == 'sum':
+                accumulator[positions] += np.add.reduceat(np.where(nulls, 0.0, values), starts)
+            else:
+                sample_weights = (~nulls).astype(np.float64) if weights is None else np.where(nulls, 0.0, weights)
+                accumulator[positions] += np.add.reduceat(np.where(nulls, 0.0, values) * sample_weights, starts)
+                self.counts[column][positions] += np.add.reduceat(sample_weights, starts)
+
+    def aggregates(self):
+        """
+        Returns the bucket start times, the number of rows in each bucket, and the aggregated values for every bucket
+        between the first and last non empty bucket.
+
+        :return: tuple of (datetime64[ns] array, int64 array of row counts, dict of column name to array)
+        """
+        filled = np.flatnonzero(self.rows)
+
+        if len(filled) == 0:
+            return np.zeros(0, dtype='datetime64[ns]'), np.zeros(0, dtype=np.int64), {
+                column: np.zeros(0) for column in self.kinds
+            }
+
+        first, last = filled[0], filled[-1] + 1
+        bucket_ids = np.arange(first, last) + self.offset
+        timestamps = (self.origin + bucket_ids * self.bucket_ns).astype('datetime64[ns]')
+        columns = {}
+
+        for column, kind in self.kinds.items():
+            values = self.values[column][first:last]
+
+            if kind == 'mean':
+                counts = self.counts[column][first:last]
+                values = np.divide(values, counts, out=np.full(len(values), np.nan), where=counts > 0)
+
+            if self.dtypes.get(column, np.dtype(np.float64)).kind in 'iu' and not np.isnan(values).any():
+                values = values.astype(np.int64)
+
+            columns[column] = values
+
+        return timestamps, self.rows[first:last], columns
+
+    def to_data_frame(self, index_name='metric_timestamp') -> pd.DataFrame:
+        """
+        Returns the aggregated buckets as a DataFrame indexed by the UTC bucket start time, in the same shape as
+        resample(...).agg(...) would have produced.
+
+        :param index_name: str, the name of the index.
+        :return: pd.DataFrame
+        """
+        timestamps, _, columns = self.aggregates()
+
+        if len(timestamps) == 0:
+            index = pd.DatetimeIndex([], name=index_name, tz='UTC')
+        else:
+            start = pd.Timestamp(timestamps[0]).tz_localize('UTC')
+            freq = f'{self.bucket_ns // NS_PER_SECOND}S'
+            index = pd.date_range(start, periods=len(timestamps), freq=freq, name=index_name)
+
+        return pd.DataFrame(columns, index=index, columns=list(self.kinds))
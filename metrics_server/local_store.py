@@ -0,0 +1,506 @@
+import heapq
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from metrics_server.cassandra_service import COLUMNAR_PROFILE
+from metrics_server.columnar import ColumnarRows, _to_array
+from metrics_server.errors import ConfigurationError
+from metrics_server.rollups import RESOLUTIONS, ROLLUP_TABLE_PREFIXES, WATERMARKS_TABLE
+
+EPOCH = datetime(1970, 1, 1)
+SQL_TYPES = {'text': 'TEXT', 'timestamp': 'INTEGER', 'int': 'INTEGER', 'bigint': 'INTEGER', 'double': 'REAL'}
+METRIC_KEY = [('environment', 'text'), ('application', 'text'), ('metric_name', 'text')]
+COUNTER_COLUMNS = [('count', 'bigint'), ('previous_count', 'bigint')]
+TIMER_MEASURES = [
+    'p75', 'p95', 'p98', 'p99', 'p999', 'max', 'mean', 'median', 'min', 'std_dev', 'one_min_rate', 'five_min_rate',
+    'fifteen_min_rate', 'mean_rate',
+]
+RAW_COLUMNS = METRIC_KEY + [('metric_timestamp', 'timestamp'), ('previous_metric_timestamp', 'timestamp')]
+ROLLUP_COLUMNS = METRIC_KEY + [('metric_timestamp', 'timestamp')] + COUNTER_COLUMNS + [('interval_count', 'bigint')]
+METRIC_PRIMARY_KEY = ['environment', 'application', 'metric_name', 'metric_timestamp']
+# The tables the services use, as the migrations and the metric writers create them in Cassandra: table name ->
+# (list of (column, CQL type), primary key columns).
+TABLES = OrderedDict([
+    ('raw_counter_with_interval', (RAW_COLUMNS + COUNTER_COLUMNS, METRIC_PRIMARY_KEY)),
+    ('raw_timer_with_interval', (
+        RAW_COLUMNS + COUNTER_COLUMNS + [(measure, 'double') for measure in TIMER_MEASURES] +
+        [('duration_unit', 'text'), ('rate_unit', 'text')],
+        METRIC_PRIMARY_KEY
+    )),
+    ('dashboards', ([('type', 'text'), ('name', 'text'), ('data', 'text')], ['type', 'name'])),
+    ('metric_catalog', (
+        [('metric_table', 'text')] + METRIC_KEY +
+        [('last_timestamp', 'timestamp'), ('duration_unit', 'text'), ('rate_unit', 'text')],
+        ['metric_table', 'environment', 'application', 'metric_name']
+    )),
+    (WATERMARKS_TABLE, (
+        [('source_table', 'text')] + METRIC_KEY + [('resolution', 'text'), ('last_bucket', 'timestamp')],
+        ['source_table', 'environment', 'application', 'metric_name', 'resolution']
+    )),
+    ('alert_state', ([('alert_id', 'text'), ('watermark', 'timestamp'), ('updated_at', 'timestamp')], ['alert_id'])),
+    ('alert_tallies', (
+        [('alert_id', 'text'), ('bucket', 'timestamp'), ('warnings', 'int'), ('errors', 'int'),
+         ('first_warning', 'timestamp'), ('last_warning', 'timestamp'), ('first_error', 'timestamp'),
+         ('last_error', 'timestamp')],
+        ['alert_id', 'bucket']
+    )),
+])
+
+for _resolution in RESOLUTIONS:
+    TABLES[f'{ROLLUP_TABLE_PREFIXES["raw_counter_with_interval"]}_{_resolution}'] = (
+        ROLLUP_COLUMNS + [('sample_count', 'int')], METRIC_PRIMARY_KEY
+    )
+    TABLES[f'{ROLLUP_TABLE_PREFIXES["raw_timer_with_interval"]}_{_resolution}'] = (
+        ROLLUP_COLUMNS + [(measure, 'double') for measure in TIMER_MEASURES] + [('sample_count', 'int')],
+        METRIC_PRIMARY_KEY
+    )
+
+SELECT_RE = re.compile(r'^SELECT (?P<distinct>DISTINCT )?(?P<columns>.+?) FROM (?P<table>\w+)(?P<rest>.*)$', re.I)
+INSERT_RE = re.compile(
+    r'^INSERT INTO (?P<table>\w+) \((?P<columns>[^)]*)\) VALUES \((?P<values>[^)]*)\)'
+    r'(?P<if_not_exists> IF NOT EXISTS)?(?: USING TTL \?)?$', re.I
+)
+UPDATE_RE = re.compile(r'^UPDATE (?P<table>\w+) SET (?P<assignments>.+?) WHERE (?P<where>.+)$', re.I)
+DELETE_RE = re.compile(r'^DELETE FROM (?P<table>\w+) WHERE (?P<where>.+)$', re.I)
+EQUALS_RE = re.compile(r'^(\w+) = \?$')
+
+
+def _split(text, separator):
+    return [part.strip() for part in re.split(separator, text, flags=re.I)]
+
+
+def _to_sql_value(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(pytz.utc).replace(tzinfo=None)
+
+        return (value - EPOCH) // timedelta(milliseconds=1)
+
+    return value
+
+
+def _from_sql_value(value, cql_type):
+    if cql_type == 'timestamp' and value is not None:
+        # The driver returns timestamps as naive UTC datetimes.
+        return EPOCH + timedelta(milliseconds=value)
+
+    return value
+
+
+def _column_array(values, cql_type) -> np.ndarray:
+    """
+    Converts the values of one column to the same array columnar_factory would create from the driver's values.
+    """
+    if cql_type == 'timestamp':
+        array = np.array(values, dtype=object)
+
+        if None in values:
+            return pd.to_datetime(array, unit='ms').values
+
+        return array.astype(np.int64).astype('datetime64[ms]').astype('datetime64[ns]')
+
+    return _to_array(values)
+
+
+class LocalStatement:
+    """
+    A CQL statement translated to SQLite, it has the attributes of a PreparedStatement the services use.
+    """
+    def __init__(self, query_string, sql, table, columns, param_count=None, lwt=False):
+        """
+        :param query_string: str, the CQL.
+        :param sql: str, the SQLite query.
+        :param table: str, the table the statement reads or writes.
+        :param columns: list of (column, CQL type) selected, empty for writes.
+        :param param_count: int, the number of CQL parameters passed on to SQLite, the rest (e.g. USING TTL) are
+            dropped. None passes all of them.
+        :param lwt: bool, True for INSERT ... IF NOT EXISTS, which returns a row with [applied].
+        """
+        self.query_string = query_string
+        self.sql = sql
+        self.table = table
+        self.columns = columns
+        self.param_count = param_count
+        self.lwt = lwt
+        self.fetch_size = None
+        self.is_idempotent = False
+
+
+def translate(cql) -> LocalStatement:
+    """
+    Translates the CQL the services send into SQLite. Only the statements the services use are supported: SELECT with
+    WHERE, ORDER BY and LIMIT, SELECT DISTINCT on the partition key, INSERT with IF NOT EXISTS or USING TTL (TTLs are
+    ignored), UPDATE of one row by its primary key, and DELETE. INSERT and UPDATE are upserts, like in Cassandra.
+
+    :param cql: str
+    :return: LocalStatement
+    """
+    query = ' '.join(cql.split()).rstrip(';').strip()
+    match = SELECT_RE.match(query)
+
+    if match is not None:
+        table = match.group('table')
+        schema = _table(table)
+        types = dict(schema[0])
+
+        if match.group('columns').strip() == '*':
+            names = [name for name, _ in schema[0]]
+        else:
+            names = _split(match.group('columns'), ',')
+
+        columns = [(name, types[name]) for name in names]
+        sql = f'SELECT {match.group("distinct") or ""}{", ".join(names)} FROM {table}{match.group("rest")}'
+
+        return LocalStatement(cql, sql, table, columns)
+
+    match = INSERT_RE.match(query)
+
+    if match is not None:
+        table = match.group('table')
+        columns = _split(match.group('columns'), ',')
+
+        if match.group('if_not_exists'):
+            sql = f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) VALUES ({match.group("values")})'
+        else:
+            sql = _upsert(table, columns)
+
+        return LocalStatement(cql, sql, table, [], len(columns), lwt=bool(match.group('if_not_exists')))
+
+    match = UPDATE_RE.match(query)
+
+    if match is not None:
+        table = match.group('table')
+        assignments = _split(match.group('assignments'), ',')
+        conditions = _split(match.group('where'), r'\s+AND\s+')
+        columns = [_equals_column(part, cql) for part in assignments + conditions]
+
+        return LocalStatement(cql, _upsert(table, columns), table, [])
+
+    match = DELETE_RE.match(query)
+
+    if match is not None:
+        table = match.group('table')
+        _table(table)
+
+        return LocalStatement(cql, f'DELETE FROM {table} WHERE {match.group("where")}', table, [])
+
+    raise ValueError(f'The local store does not support this query: {cql}')
+
+
+def _table(table):
+    if table not in TABLES:
+        raise ValueError(f'The local store has no table "{table}"')
+
+    return TABLES[table]
+
+
+def _equals_column(part, cql):
+    match = EQUALS_RE.match(part)
+
+    if match is None:
+        raise ValueError(f'The local store does not support this query: {cql}')
+
+    return match.group(1)
+
+
+def _upsert(table, columns):
+    _, primary_key = _table(table)
+    updates = [column for column in columns if column not in primary_key]
+    sql = f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})'
+
+    if len(updates) == 0:
+        return f'{sql} ON CONFLICT DO NOTHING'
+
+    assignments = ', '.join(f'{column} = excluded.{column}' for column in updates)
+
+    return f'{sql} ON CONFLICT ({", ".join(primary_key)}) DO UPDATE SET {assignments}'
+
+
+class LocalResultSet:
+    """
+    The parts of a ResultSet the services use. Rows are returned one page at a time if the statement has a fetch_size.
+    """
+    def __init__(self, rows, columns, columnar, fetch_size=None):
+        self._rows = rows
+        self._columns = columns
+        self._columnar = columnar
+        self._page_size = fetch_size or max(len(rows), 1)
+        self._start = 0
+        self.current_rows = self._page()
+
+    def _page(self):
+        rows = self._rows[self._start:self._start + self._page_size]
+
+        if self._columnar:
+            if len(rows) == 0:
+                return []
+
+            arrays = {
+                name: _column_array(values, cql_type) for (name, cql_type), values in zip(self._columns, zip(*rows))
+            }
+
+            return ColumnarRows([name for name, _ in self._columns], arrays)
+
+        return [
+            {name: _from_sql_value(value, cql_type) for (name, cql_type), value in zip(self._columns, row)}
+            for row in rows
+        ]
+
+    @property
+    def has_more_pages(self):
+        return self._start + self._page_size < len(self._rows)
+
+    def fetch_next_page(self):
+        self._start += self._page_size
+        self.current_rows = self._page()
+
+    def __iter__(self):
+        while True:
+            yield from self.current_rows
+
+            if not self.has_more_pages:
+                break
+
+            self.fetch_next_page()
+
+    def __getitem__(self, idx):
+        return self.current_rows[idx]
+
+    def one(self):
+        return self.current_rows[0] if len(self.current_rows) > 0 else None
+
+
+class LocalResponseFuture:
+    """
+    The parts of a ResponseFuture the services use.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def _set(self, result=None, exception=None):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback, errback in callbacks:
+            self._call(callback, errback)
+
+    def _call(self, callback, errback):
+        if self._exception is not None:
+            errback(self._exception)
+        else:
+            callback(self._result.current_rows)
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise TimeoutError('Timed out waiting for the local store')
+
+        if self._exception is not None:
+            raise self._exception
+
+        return self._result
+
+    def add_callbacks(self, callback, errback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append((callback, errback))
+                return
+
+        self._call(callback, errback)
+
+
+class _Scheduler:
+    """
+    Runs functions after a delay on a single thread, so injected latency doesn't hold a thread per query.
+    """
+    def __init__(self):
+        self._heap = []
+        self._counter = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name='local-store-scheduler')
+        self._thread.start()
+
+    def schedule(self, delay, fn):
+        with self._condition:
+            self._counter += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._counter, fn))
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (len(self._heap) == 0 or self._heap[0][0] > time.monotonic()):
+                    self._condition.wait(None if len(self._heap) == 0 else self._heap[0][0] - time.monotonic())
+
+                if self._stopped:
+                    return
+
+                _, _, fn = heapq.heappop(self._heap)
+
+            fn()
+
+
+class LocalSession:
+    """
+    Stands in for a Cassandra Session, backed by SQLite. Every query is delayed by latency seconds plus a random jitter
+    of up to jitter seconds, to mimic a cluster's response times. Queries are run on a pool of executor_threads threads,
+    like the driver's executor, but SQLite runs one query at a time.
+    """
+    def __init__(self, path=':memory:', latency=0.0, jitter=0.0, executor_threads=4, seed=None):
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+        self.default_fetch_size = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._executor = ThreadPoolExecutor(max_workers=executor_threads, thread_name_prefix='local-store')
+        self._scheduler = _Scheduler()
+        create_schema(self._connection)
+
+    def prepare(self, cql):
+        return translate(cql)
+
+    def _delay(self):
+        if self.jitter > 0:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+        return self.latency
+
+    def _params(self, statement, params):
+        params = list(params or [])
+
+        if statement.param_count is not None:
+            params = params[:statement.param_count]
+
+        return [_to_sql_value(value) for value in params]
+
+    def _run(self, statement, params, execution_profile):
+        with self._lock:
+            cursor = self._connection.execute(statement.sql, self._params(statement, params))
+
+            if len(statement.columns) > 0:
+                rows = cursor.fetchall()
+            else:
+                self._connection.commit()
+                rows = []
+
+        if statement.lwt:
+            return LocalResultSet([(cursor.rowcount == 1,)], [('[applied]', 'boolean')], False)
+
+        return LocalResultSet(rows, statement.columns, execution_profile == COLUMNAR_PROFILE, statement.fetch_size)
+
+    def execute(self, statement, params=None, execution_profile=None, **kwargs):
+        if isinstance(statement, str):
+            statement = translate(statement)
+
+        delay = self._delay()
+
+        if delay > 0:
+            time.sleep(delay)
+
+        return self._run(statement, params, execution_profile)
+
+    def execute_async(self, statement, params=None, execution_profile=None, **kwargs):
+        if isinstance(statement, str):
+            statement = translate(statement)
+
+        future = LocalResponseFuture()
+
+        def complete():
+            try:
+                future._set(self._run(statement, params, execution_profile))
+            except Exception as e:
+                future._set(exception=e)
+
+        def submit():
+            self._executor.submit(complete)
+
+        delay = self._delay()
+
+        if delay > 0:
+            self._scheduler.schedule(delay, submit)
+        else:
+            submit()
+
+        return future
+
+    def shutdown(self):
+        self._scheduler.stop()
+        self._executor.shutdown(wait=True)
+        self._connection.close()
+
+
+class LocalCluster:
+    """
+    Stands in for a Cassandra Cluster when cassandra.backend is local, see CassandraService.
+    """
+    def __init__(self, config):
+        """
+        :param config: dict, the cassandra.local config section.
+        """
+        latency = config.get('latency_ms', 0)
+        jitter = config.get('jitter_ms', 0)
+
+        if not isinstance(latency, (int, float)) or latency < 0:
+            raise ConfigurationError(f'cassandra.local.latency_ms must be a number of at least 0, got {latency!r}.')
+
+        if not isinstance(jitter, (int, float)) or jitter < 0:
+            raise ConfigurationError(f'cassandra.local.jitter_ms must be a number of at least 0, got {jitter!r}.')
+
+        self.path = config.get('path', ':memory:')
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.executor_threads = config.get('executor_threads', 4)
+        self.seed = config.get('seed')
+        self.sessions = []
+
+    def connect(self, keyspace=None):
+        session = LocalSession(self.path, self.latency, self.jitter, self.executor_threads, self.seed)
+        self.sessions.append(session)
+
+        return session
+
+    def shutdown(self):
+        for session in self.sessions:
+            session.shutdown()
+
+
+def create_schema(connection):
+    """
+    Creates every table in TABLES that doesn't exist yet.
+
+    :param connection: sqlite3.Connection
+    :return:
+    """
+    for table, (columns, primary_key) in TABLES.items():
+        definitions = ', '.join(f'"{name}" {SQL_TYPES[cql_type]}' for name, cql_type in columns)
+        connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ({definitions}, PRIMARY KEY ({", ".join(primary_key)})) '
+            # Rows are stored in primary key order, like a Cassandra partition, so range scans read them in order.
+            'WITHOUT ROWID'
+        )
+
+    connection.commit()
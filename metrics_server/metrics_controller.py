@@ -1,12 +1,85 @@
 import pytz
 from dateutil.parser import parse
-from flask import jsonify
+from flask import Response, jsonify
 from flask import request
+from marshmallow import Schema, fields
 
-from metrics_server.base_controller import BaseController
+from metrics_server.base_controller import BaseController, validate_with
+from metrics_server.data_frame_encoder import (
+    COLUMNAR_BINARY_MIMETYPE, COLUMNAR_JSON_MIMETYPE, JSON_MIMETYPE, iter_json_envelope, to_columnar_binary,
+    to_columnar_json
+)
 from metrics_server.errors import NotFoundError
 from metrics_server.metrics_service import MetricsService
 
+TRUTHY = {'true', '1', 'yes', 'on'}
+# The formats the metric endpoint can respond with, in order of preference when the client accepts any of them.
+METRIC_MIMETYPES = [JSON_MIMETYPE, COLUMNAR_JSON_MIMETYPE, COLUMNAR_BINARY_MIMETYPE]
+
+
+def to_utc(timestamp):
+    if timestamp is not None:
+        if timestamp.tzinfo is None:
+            timestamp = pytz.utc.localize(timestamp)
+        else:
+            timestamp = timestamp.astimezone(pytz.utc)
+
+    return timestamp
+
+
+def parse_timestamp(timestamp):
+    if timestamp is not None:
+        timestamp = to_utc(parse(timestamp))
+
+    return timestamp
+
+
+def parse_metric_args(args):
+    """
+    Parses the query args of the metric endpoint. Raises a ValueError with a message for the client if they are
+    invalid.
+
+    :param args: The query args, a werkzeug MultiDict.
+    :return: tuple of (columns, size, start_timestamp, end_timestamp)
+    """
+    cols = args.get('columns', '').split(',')
+    cols = [col.strip() for col in cols if col.strip() != '']
+
+    if len(cols) == 0:
+        raise ValueError('You must specify at least one column')
+
+    try:
+        size = int(args.get('size', ''))
+    except ValueError:
+        size = 1000
+
+    try:
+        start_ts = parse_timestamp(args.get('start_timestamp', None))
+    except ValueError:
+        raise ValueError('Invalid start_timestamp')
+
+    try:
+        end_ts = parse_timestamp(args.get('end_timestamp', None))
+    except ValueError:
+        raise ValueError('Invalid end_timestamp')
+
+    return cols, size, start_ts, end_ts
+
+
+class SeriesSchema(Schema):
+    table = fields.String(required=True)
+    environment = fields.String(required=True)
+    application = fields.String(required=True)
+    metric = fields.String(required=True)
+    columns = fields.List(fields.String(), required=True)
+    start_timestamp = fields.DateTime(missing=None)
+    end_timestamp = fields.DateTime(missing=None)
+    size = fields.Integer(missing=1000)
+
+
+class BatchSchema(Schema):
+    series = fields.Nested(SeriesSchema, many=True, required=True)
+
 
 class MetricsController(BaseController):
     @property
@@ -15,27 +88,28 @@ class MetricsController(BaseController):
 
     def distinct_metrics(self):
         """
-        Retrieves the list of distinct metrics from the database.
+        Retrieves the list of distinct metrics, see MetricsService.get_metric_catalog.
         :return:
         """
-        return jsonify(data={'metrics': self.metrics_service.get_all_distinct_metrics()})
+        return jsonify(data={'metrics': self.metrics_service.get_metric_catalog()})
 
-    @staticmethod
-    def _parse_timestamp(timestamp):
-        if timestamp is not None:
-            timestamp = parse(timestamp)
-
-            if timestamp.tzinfo is None:
-                timestamp = pytz.utc.localize(timestamp)
-            else:
-                timestamp = timestamp.astimezone(pytz.utc)
-
-        return timestamp
+    def cache_stats(self):
+        """
+        Returns the hit, miss, and eviction counters of the metric data cache, and how many metric queries were
+        coalesced with an identical query in flight.
+        :return:
+        """
+        return jsonify(cache=self.metrics_service.cache_stats(), coalesce=self.metrics_service.coalesce_stats())
 
     def metric(self, table, env, app, metric):
         """
         Returns all of the available data for a metric.
 
+        The format of the response is chosen with the Accept header:
+        - application/json (the default): rows as a list of lists with ISO 8601 timestamps.
+        - application/vnd.metrics.columnar+json: one list per column with timestamps in milliseconds since the epoch.
+        - application/vnd.metrics.columnar: typed binary columns, see data_frame_encoder.to_columnar_binary.
+
         :param env: The environment we want data from.
         :param app: The application we want data from.
         :param table: The table we want data from.
@@ -43,47 +117,99 @@ class MetricsController(BaseController):
         :return: JSON
         """
 
-        cols = request.args.get('columns', '').split(',')
-        cols = [col.strip() for col in cols if col.strip() != '']
-
-        if len(cols) == 0:
-            return jsonify(error='You must specify at least one column'), 400
-
-        try:
-            size = int(request.args.get('size', ''))
-        except ValueError:
-            size = 1000
-
-        try:
-            start_ts = self._parse_timestamp(request.args.get('start_timestamp', None))
-        except ValueError:
-            return jsonify(error='Invalid start_timestamp'), 400
-
         try:
-            end_ts = self._parse_timestamp(request.args.get('end_timestamp', None))
-        except ValueError:
-            return jsonify(error='Invalid end_timestamp'), 400
+            cols, size, start_ts, end_ts = parse_metric_args(request.args)
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
 
         try:
             rows = self.metrics_service.get_metric_data(env, app, table, metric, cols, start_ts, end_ts, size)
         except NotFoundError as e:
             return jsonify(error=str(e)), 404
 
-        # TODO: return a generator so we can stream the data to the client, this allows for us to quickly start sending
-        # the response.
-        # https://blog.al4.co.nz/2016/01/streaming-json-with-flask/
-        # http://flask.pocoo.org/docs/0.12/patterns/streaming/
-
-        return jsonify(
-            data={
-                'environment': env,
-                'application': app,
-                'table': table,
-                'metric': metric,
-                'rows': rows  # This is a DataFrame, to see how it's encoded take a look at data_frame_encoder.py
+        envelope = {
+            'environment': env,
+            'application': app,
+            'table': table,
+            'metric': metric,
+        }
+
+        mimetype = request.accept_mimetypes.best_match(METRIC_MIMETYPES, default=JSON_MIMETYPE)
+
+        if mimetype == COLUMNAR_JSON_MIMETYPE:
+            resp = Response(f'{{"data": {to_columnar_json(envelope, rows)}}}', mimetype=mimetype)
+        elif mimetype == COLUMNAR_BINARY_MIMETYPE:
+            resp = Response(to_columnar_binary(envelope, rows), mimetype=mimetype)
+        elif request.args.get('stream', '').lower() in TRUTHY:
+            resp = self._stream_rows(envelope, rows)
+        else:
+            # rows is a DataFrame, to see how it's encoded take a look at data_frame_encoder.py
+            resp = jsonify(data={**envelope, 'rows': rows})
+
+        # The format depends on the Accept header, caches must not serve one format to a client that asked for another.
+        resp.vary.add('Accept')
+
+        return resp
+
+    def _stream_rows(self, envelope, rows):
+        """
+        Streams the response, the envelope is sent right away and the rows are encoded and sent in batches. The JSON is
+        the same as the non streaming response.
+        """
+        batch_size = self.config.get('metrics', {}).get('stream_batch_size', 1000)
+
+        def generate():
+            yield '{"data": '
+            yield from iter_json_envelope(envelope, 'rows', rows, batch_size)
+            yield '}'
+
+        return Response(generate(), mimetype='application/json')
+
+    @validate_with(BatchSchema())
+    def batch(self, body: dict):
+        """
+        Returns the data for many metric series in one response. Each series in the request body has the same options
+        as the metric endpoint, if a series fails its entry in the response contains an error instead of rows.
+
+        :param body: A dict that has been validated against BatchSchema.
+        :return: JSON
+        """
+        series = []
+
+        for spec in body['series']:
+            series.append({
+                'environment': spec['environment'],
+                'application': spec['application'],
+                'table': spec['table'],
+                'metric': spec['metric'],
+                'columns': spec['columns'],
+                'start_timestamp': to_utc(spec['start_timestamp']),
+                'end_timestamp': to_utc(spec['end_timestamp']),
+                'size': spec['size'],
+            })
+
+        results = self.metrics_service.get_metric_data_batch(series)
+        data = []
+
+        for spec, result in zip(series, results):
+            entry = {
+                'environment': spec['environment'],
+                'application': spec['application'],
+                'table': spec['table'],
+                'metric': spec['metric'],
             }
-        )
+
+            if isinstance(result, Exception):
+                entry['error'] = str(result)
+            else:
+                entry['rows'] = result
+
+            data.append(entry)
+
+        return jsonify(data={'series': data})
 
     def add_routes(self):
         self.add_route('/api/v1/metrics', self.distinct_metrics, ['GET'])
+        self.add_route('/api/v1/metrics/cache', self.cache_stats, ['GET'])
+        self.add_route('/api/v1/metrics/batch', self.batch, ['POST'])
         self.add_route('/api/v1/metrics/<table>/<env>/<app>/<metric>', self.metric, ['GET'])
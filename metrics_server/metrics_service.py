@@ -1,3 +1,6 @@
+import itertools
+import logging
+import threading
 from datetime import datetime, timedelta
 
 import numpy as np
@@ -6,10 +9,38 @@ import pytz
 from cassandra.cluster import Session
 
 from metrics_server.base_service import BaseService
+from metrics_server.cache import LRUCache, SingleFlight
+from metrics_server.cassandra_service import COLUMNAR_PROFILE, _number, execute_concurrently
+from metrics_server.columnar import as_columnar
+from metrics_server.downsample import BucketAggregator, bucket_seconds
 from metrics_server.errors import NotFoundError
+from metrics_server.rollups import (
+    RESOLUTIONS, SAMPLE_COUNT_COLUMN, WATERMARKS_TABLE, ceil_timestamp, choose_resolution, floor_timestamp,
+    rollup_table_name
+)
+from metrics_server.timing import record_rows, stage
 
-
+logger = logging.getLogger(__name__)
 TABLE_NAMES = ['raw_counter_with_interval', 'raw_timer_with_interval']
+DAY_SECONDS = 24 * 60 * 60
+# See migrations/03_add_metric_catalog_schema.py
+CATALOG_TABLE = 'metric_catalog'
+CATALOG_SELECT_CQL = (
+    'SELECT environment, application, metric_name, last_timestamp, duration_unit, rate_unit '
+    f'FROM {CATALOG_TABLE} WHERE metric_table = ?;'
+)
+CATALOG_INSERT_CQL = (
+    f'INSERT INTO {CATALOG_TABLE} '
+    '(metric_table, environment, application, metric_name, last_timestamp, duration_unit, rate_unit) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?);'
+)
+CATALOG_DELETE_CQL = (
+    f'DELETE FROM {CATALOG_TABLE} WHERE metric_table = ? AND environment = ? AND application = ? AND metric_name = ?;'
+)
+WATERMARK_SELECT_CQL = (
+    f'SELECT last_bucket FROM {WATERMARKS_TABLE} '
+    'WHERE source_table = ? AND environment = ? AND application = ? AND metric_name = ? AND resolution = ?;'
+)
 TIMESTAMP_COLUMNS = ['metric_timestamp', 'previous_metric_timestamp']
 COUNTER_COLUMNS = {'count', 'previous_count', 'interval_count'}
 TIMER_COLUMNS = {
@@ -56,7 +87,7 @@ def validate_columns(table, columns):
         raise NotFoundError(f'table "{table}" does not exist')
 
     if not columns_set.issubset(table_columns):
-        bad_columns = columns_set.difference(table_columns)
+        bad_columns = [column for column in columns if column not in table_columns]
         raise NotFoundError(f'column(s) ({", ".join(bad_columns)}) not found in table "{table}"')
 
     is_interval_count = False
@@ -76,6 +107,88 @@ def interval_count(df: pd.DataFrame):
     return df.assign(interval_count=df['count'] - df['previous_count']).drop(['count', 'previous_count'], axis=1)
 
 
+def bucket_origin(start_timestamp) -> pd.Timestamp:
+    """
+    Returns the time down sampled buckets are anchored on, midnight UTC of the day a window starts. It's passed to
+    DataFrame.resample and BucketAggregator explicitly, they would otherwise anchor on the day of the first row.
+
+    :param start_timestamp: datetime, the start of the window, naive datetimes are treated as UTC.
+    :return: pd.Timestamp in UTC.
+    """
+    origin = pd.Timestamp(floor_timestamp(start_timestamp, DAY_SECONDS))
+
+    return origin.tz_localize('UTC') if origin.tzinfo is None else origin.tz_convert('UTC')
+
+
+def data_frame_size(df: pd.DataFrame):
+    return int(df.memory_usage(index=True, deep=False).sum())
+
+
+def get_aggregators(table, columns):
+    """
+    Returns the aggregation function for each column, used when down sampling.
+
+    :param table: str, the table the columns came from.
+    :param columns: list of column names, after interval_count has been calculated.
+    :return: dict of column name to aggregation function.
+    """
+    return {column: AGGREGATOR_MAP[table][column] for column in columns}
+
+
+class MetricQuery:
+    """
+    MetricQuery describes a request for a single metric series, once planned by MetricsService it also holds the
+    statement used to fetch it.
+    """
+    def __init__(self, environment, application, table, metric, columns, start_timestamp, end_timestamp, size,
+                 bucket_size=None):
+        self.environment = environment
+        self.application = application
+        self.table = table
+        self.metric = metric
+        self.columns = columns
+        self.start_timestamp = start_timestamp
+        self.end_timestamp = end_timestamp
+        self.size = size
+        self.bucket_size = bucket_seconds(start_timestamp, end_timestamp, size) if bucket_size is None else bucket_size
+        self.origin = bucket_origin(start_timestamp)
+        # The attributes below are set by MetricsService._plan_query
+        self.resolution = None
+        self.is_interval_count = False
+        self.query_columns = None
+        self.statement = None
+        self.params = None
+        self.source_table = None
+        # Set by MetricsService._plan_query when a rollup table is read but the window ends after the last rolled up
+        # bucket, the (statement, params) that reads the newer rows from the raw table.
+        self.tail = None
+        self.tail_columns = None
+        self.tail_is_interval_count = False
+        # Set by MetricsService._plan_slices for long windows, a list of (statement, params) per slice in time order.
+        self.slices = None
+        # Set by MetricsService._process_result, the number of rows read from Cassandra.
+        self.fetched_rows = 0
+
+    @property
+    def statements(self):
+        """
+        The (statement, params) of every query needed to fetch the series, in time order.
+        """
+        statements = self.slices if self.slices is not None else [(self.statement, self.params)]
+
+        if self.tail is not None:
+            statements = statements + [self.tail]
+
+        return statements
+
+    @property
+    def key(self):
+        return (
+            self.environment, self.application, self.table, self.metric, tuple(self.columns), self.size,
+            self.start_timestamp, self.end_timestamp, self.bucket_size
+        )
+
+
 class MetricsService(BaseService):
     """
     MetricsService is used to retrieve metrics data and metadata from a Cassandra database.
@@ -83,19 +196,65 @@ class MetricsService(BaseService):
     def __init__(self, config, services):
         super().__init__(config, services)
         self._session = self.services['CassandraService'].session
+        metrics_config = self.config.get('metrics', {})
+        # When fetch_size is set we page through metric data and down sample each page as it arrives instead of
+        # loading every row into memory at once.
+        self.fetch_size = metrics_config.get('fetch_size')
+        # Only query the rollup tables if they have been created (see migrations/02_add_rollup_schema.py) and are being
+        # kept up to date by the rollup worker.
+        self.use_rollups = self.config.get('rollups', {}).get('enabled', False)
+        self.cache = None
+        cache_config = metrics_config.get('cache')
+
+        if cache_config is not None:
+            max_size = cache_config.get('max_megabytes', 256) * 1024 * 1024
+            self.cache = LRUCache(max_size, weigher=data_frame_size)
+            # Windows ending within settle_seconds of now can still change as new data arrives, so they are only cached
+            # for live_ttl seconds. Anything older won't change and is cached for historical_ttl seconds.
+            self.cache_live_ttl = cache_config.get('live_ttl', 10)
+            self.cache_historical_ttl = cache_config.get('historical_ttl', 60 * 60)
+            self.cache_settle_time = timedelta(seconds=cache_config.get('settle_seconds', 60))
+
+        self.split_min_span = None
+        split_config = metrics_config.get('split')
+
+        if split_config is not None:
+            # Windows of at least min_span_hours are fetched as up to this many queries over consecutive slices of the
+            # window, which run concurrently.
+            min_span_hours = _number(split_config, 'min_span_hours', float, 0, default=24, section='metrics.split')
+            self.split_min_span = timedelta(hours=min_span_hours)
+            self.split_slices = _number(split_config, 'slices', int, 1, default=8, section='metrics.split')
+
+        self.single_flight = None
+        coalesce_config = metrics_config.get('coalesce')
+
+        if coalesce_config is not None:
+            # Identical metric queries running at the same time share one fetch, callers give up waiting for it after
+            # timeout seconds.
+            self.single_flight = SingleFlight(coalesce_config.get('timeout', 30))
+
+        catalog_config = metrics_config.get('catalog', {})
+        # The maximum number of metric metadata queries in flight while building the catalog.
+        self.catalog_concurrency = catalog_config.get('concurrency', 50)
+        # Only read the metric_catalog table if it has been created (see migrations/03_add_metric_catalog_schema.py)
+        # and is kept up to date with reconcile_catalog, otherwise every table is scanned for its distinct metrics.
+        self.use_catalog_table = catalog_config.get('use_table', False)
+        # The catalog of metrics is built on first use and then rebuilt in the background every refresh_interval
+        # seconds. If refresh_interval is 0 the catalog is rebuilt on every request.
+        self.catalog_refresh_interval = catalog_config.get('refresh_interval', 5 * 60)
+        self._catalog = None
+        self._catalog_lock = threading.Lock()
+        self._catalog_refresher = None
+        self._stop_catalog_refresh = threading.Event()
 
     @property
     def session(self) -> Session:
         return self._session
 
-    def get_distinct_metrics_for_table(self, table):
-        """
-        Queries for and returns all of the distinct metrics in a table.
+    def _prepare(self, cql, fetch_size=None):
+        return self.services['CassandraService'].prepare(cql, fetch_size)
 
-        :param table: str, the table to query against.
-        :return: list of dicts representing the environment, application, metric_name, and table.
-        """
-        all_rows = []
+    def _metadata_statement(self, table):
         metadata_cols = ['metric_timestamp']
 
         if 'timer' in table:
@@ -104,17 +263,54 @@ class MetricsService(BaseService):
         metadata_query = (
             f'SELECT {", ".join(metadata_cols)} '
             f'FROM {table} '
-            'WHERE environment = %s '
-            'AND application = %s '
-            'AND metric_name = %s '
+            'WHERE environment = ? '
+            'AND application = ? '
+            'AND metric_name = ? '
             'ORDER BY metric_timestamp DESC '
             'LIMIT 1;'
         )
-        rows = self.session.execute(f'SELECT DISTINCT environment, application, metric_name FROM {table};')
 
-        for row in rows:
-            query_args = [row['environment'], row['application'], row['metric_name']]
-            metadata = self.session.execute(metadata_query, query_args)[0]
+        return self._prepare(metadata_query)
+
+    def _scan_metrics(self, table):
+        """
+        Scans a table for its distinct metrics and queries the latest row of each one, the metadata of each metric is
+        queried concurrently with at most catalog_concurrency queries in flight.
+
+        :param table: str, the table to scan.
+        :return: list of (row, metadata) tuples, metadata is a dict, None if the metric has no rows left, or the
+            exception raised while querying it.
+        """
+        distinct_query = f'SELECT DISTINCT environment, application, metric_name FROM {table};'
+        rows = list(self.session.execute(self._prepare(distinct_query)))
+        query_args = [[row['environment'], row['application'], row['metric_name']] for row in rows]
+        results = execute_concurrently(self.session, self._metadata_statement(table), query_args,
+                                       self.catalog_concurrency)
+
+        return [
+            (row, result if isinstance(result, Exception) else next(iter(result), None))
+            for row, result in zip(rows, results)
+        ]
+
+    def get_distinct_metrics_for_table(self, table):
+        """
+        Queries for and returns all of the distinct metrics in a table.
+
+        :param table: str, the table to query against.
+        :return: list of dicts representing the environment, application, metric_name, and table.
+        """
+        all_rows = []
+
+        for row, metadata in self._scan_metrics(table):
+            if isinstance(metadata, Exception):
+                # Leave the metric out rather than failing the whole catalog, it will be back on the next refresh.
+                logger.error('Failed to query metadata for %s: %s', row, metadata)
+                continue
+
+            if metadata is None:
+                # Every row of the metric was deleted after the DISTINCT query ran.
+                continue
+
             row['table'] = table
             row['last_timestamp'] = pytz.utc.localize(metadata['metric_timestamp']).isoformat()
             row['duration_unit'] = metadata.get('duration_unit')
@@ -123,19 +319,288 @@ class MetricsService(BaseService):
 
         return all_rows
 
+    def get_catalog_metrics_for_table(self, table):
+        """
+        Reads the metrics in a table from the metric_catalog table, this is a single partition query.
+
+        :param table: str, the raw table the metrics are stored in.
+        :return: list of dicts in the same format as get_distinct_metrics_for_table.
+        """
+        all_rows = []
+
+        for row in self.session.execute(self._prepare(CATALOG_SELECT_CQL), [table]):
+            last_timestamp = row.pop('last_timestamp')
+            row['table'] = table
+            row['last_timestamp'] = None if last_timestamp is None else pytz.utc.localize(last_timestamp).isoformat()
+            all_rows.append(row)
+
+        return all_rows
+
     def get_all_distinct_metrics(self):
         """
-        Retrieve all of the unique metrics available from the DB.
+        Retrieve all of the unique metrics available from the DB. If use_catalog_table is set they are read from the
+        metric_catalog table, otherwise every table is scanned.
 
         :return:
         """
         all_rows = []
 
         for table in TABLE_NAMES:
-            all_rows = all_rows + self.get_distinct_metrics_for_table(table)
+            if self.use_catalog_table:
+                all_rows = all_rows + self.get_catalog_metrics_for_table(table)
+            else:
+                all_rows = all_rows + self.get_distinct_metrics_for_table(table)
 
         return all_rows
 
+    def _execute_all(self, cql, params_list):
+        results = execute_concurrently(self.session, self._prepare(cql), params_list, self.catalog_concurrency)
+
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    def reconcile_catalog(self):
+        """
+        Brings the metric_catalog table in line with the raw tables: every metric found by scanning the raw tables is
+        written with its latest timestamp and units, and catalog entries for metrics that no longer exist are deleted.
+        Use this to backfill the catalog, and run it periodically to pick up new metrics.
+
+        :return: tuple of (number of metrics written, number of metrics deleted)
+        """
+        written = 0
+        deleted = 0
+
+        for table in TABLE_NAMES:
+            inserts = []
+            found = set()
+
+            for row, metadata in self._scan_metrics(table):
+                if isinstance(metadata, Exception):
+                    # Don't risk deleting a metric we failed to look at.
+                    raise metadata
+
+                if metadata is None:
+                    continue
+
+                key = (row['environment'], row['application'], row['metric_name'])
+                found.add(key)
+                inserts.append([
+                    table, *key, metadata['metric_timestamp'], metadata.get('duration_unit'), metadata.get('rate_unit')
+                ])
+
+            deletes = [
+                [table, row['environment'], row['application'], row['metric_name']]
+                for row in self.session.execute(self._prepare(CATALOG_SELECT_CQL), [table])
+                if (row['environment'], row['application'], row['metric_name']) not in found
+            ]
+            self._execute_all(CATALOG_INSERT_CQL, inserts)
+            self._execute_all(CATALOG_DELETE_CQL, deletes)
+            written += len(inserts)
+            deleted += len(deletes)
+
+        return written, deleted
+
+    def get_metric_catalog(self):
+        """
+        Returns the same list as get_all_distinct_metrics, but from memory. The first call builds the catalog and starts
+        a background thread that rebuilds it every catalog_refresh_interval seconds, so the list can be up to that many
+        seconds old.
+
+        :return: list of dicts, shared between callers so do not modify it.
+        """
+        if not self.catalog_refresh_interval:
+            return self.get_all_distinct_metrics()
+
+        if self._catalog is None:
+            with self._catalog_lock:
+                if self._catalog is None:
+                    self._catalog = self.get_all_distinct_metrics()
+                    self._catalog_refresher = threading.Thread(target=self._refresh_catalog, daemon=True,
+                                                               name='metric-catalog-refresh')
+                    self._catalog_refresher.start()
+
+        return self._catalog
+
+    def _refresh_catalog(self):
+        while not self._stop_catalog_refresh.wait(self.catalog_refresh_interval):
+            try:
+                self._catalog = self.get_all_distinct_metrics()
+            except Exception:
+                # Keep serving the old catalog, we'll try again on the next interval.
+                logger.exception('Failed to refresh the metric catalog')
+
+    def stop_catalog_refresh(self):
+        """
+        Stops the background catalog refresh thread, if it is running.
+        """
+        self._stop_catalog_refresh.set()
+
+        if self._catalog_refresher is not None:
+            self._catalog_refresher.join()
+
+    def _new_query(self, environment, application, table, metric, columns, start_timestamp=None,
+                   end_timestamp=None, size=1000):
+        if end_timestamp is None:
+            end_timestamp = datetime.now(tz=pytz.utc)
+
+        if start_timestamp is None:
+            start_timestamp = end_timestamp - timedelta(hours=24)
+
+        bucket_size = bucket_seconds(start_timestamp, end_timestamp, size)
+
+        if self.cache is not None or self.single_flight is not None:
+            # Snap the window to the edges of the buckets it is down sampled into, that way requests for nearly the same
+            # window (e.g. dashboards refreshed a few seconds apart) share a cache entry or a query in flight. The
+            # wider window would give a larger bucket size, so keep the one of the requested window.
+            origin = floor_timestamp(start_timestamp, DAY_SECONDS)
+            start_timestamp = floor_timestamp(start_timestamp, bucket_size, origin)
+            end_timestamp = ceil_timestamp(end_timestamp, bucket_size, origin)
+
+        return MetricQuery(environment, application, table, metric, columns, start_timestamp, end_timestamp, size,
+                           bucket_size)
+
+    def _rollup_watermark(self, query, resolution):
+        """
+        Returns the end of the last bucket the rollup worker has aggregated for a metric at a resolution, rollup rows
+        after it are missing or incomplete.
+
+        :return: datetime, in the same timezone as query.end_timestamp, or None if nothing has been rolled up yet.
+        """
+        params = [query.table, query.environment, query.application, query.metric, resolution]
+
+        with stage('metric_query'):
+            rows = self.session.execute(self._prepare(WATERMARK_SELECT_CQL), params).current_rows
+
+        if len(rows) == 0 or rows[0]['last_bucket'] is None:
+            return None
+
+        watermark = rows[0]['last_bucket']
+
+        if query.end_timestamp.tzinfo is not None and watermark.tzinfo is None:
+            watermark = pytz.utc.localize(watermark)
+
+        return watermark
+
+    def _plan_query(self, query):
+        """
+        Validates a MetricQuery, picks the table to read from, and builds the statement to execute. Rollup tables lag
+        behind the raw tables, so when the window ends after the last rolled up bucket the rest of the window is read
+        from the raw table as query.tail.
+
+        :param query: MetricQuery
+        :return: MetricQuery
+        """
+        columns, is_interval_count = validate_columns(query.table, query.columns)
+        query.resolution = choose_resolution(query.bucket_size) if self.use_rollups else None
+        start_timestamp = query.start_timestamp
+        end_timestamp = query.end_timestamp
+        watermark = None
+
+        if query.resolution is not None:
+            watermark = self._rollup_watermark(query, query.resolution)
+
+            # Nothing in the window has been rolled up yet.
+            if watermark is None or watermark <= floor_timestamp(start_timestamp, RESOLUTIONS[query.resolution]):
+                query.resolution = None
+
+        if query.resolution is None:
+            table = query.table
+            query.is_interval_count = is_interval_count
+            query.query_columns = ['metric_timestamp'] + columns
+        else:
+            table = rollup_table_name(query.table, query.resolution)
+            # Rollup tables store interval_count, so unlike the raw tables we can select it directly. It goes last so
+            # the columns are in the same order as when we calculate it from the raw tables.
+            data_columns = [column for column in query.columns if column != 'interval_count']
+
+            if 'interval_count' in query.columns:
+                data_columns.append('interval_count')
+
+            query.query_columns = ['metric_timestamp'] + data_columns + [SAMPLE_COUNT_COLUMN]
+            # Rollup rows are labeled with the start of their bucket, so include the bucket start_timestamp falls in.
+            start_timestamp = floor_timestamp(start_timestamp, RESOLUTIONS[query.resolution])
+
+        select = (
+            f'SELECT {", ".join(query.query_columns)} FROM {table} '
+            'WHERE environment=? AND application=? AND metric_name=? AND metric_timestamp >= ? '
+        )
+        end_condition = 'AND metric_timestamp <= ? ORDER BY metric_timestamp ASC;'
+        key = [query.environment, query.application, query.metric]
+
+        if query.resolution is not None and watermark < end_timestamp:
+            # The watermark is the end of the last rolled up bucket, newer rows come from the raw table.
+            end_timestamp = watermark
+            end_condition = 'AND metric_timestamp < ? ORDER BY metric_timestamp ASC;'
+            query.tail_is_interval_count = is_interval_count
+            query.tail_columns = ['metric_timestamp'] + columns
+            tail_select = (
+                f'SELECT {", ".join(query.tail_columns)} FROM {query.table} '
+                'WHERE environment=? AND application=? AND metric_name=? AND metric_timestamp >= ? '
+                'AND metric_timestamp <= ? ORDER BY metric_timestamp ASC;'
+            )
+            query.tail = (self._prepare(tail_select, self.fetch_size), key + [watermark, query.end_timestamp])
+
+        query.source_table = table
+        query.statement = self._prepare(select + end_condition, self.fetch_size)
+        query.params = key + [start_timestamp, end_timestamp]
+
+        if self.split_min_span is not None and end_timestamp - start_timestamp >= self.split_min_span:
+            self._plan_slices(query, select)
+
+        return query
+
+    def _plan_slices(self, query, select):
+        """
+        Cuts the window of a planned query into split_slices consecutive slices, each a whole number of down sampling
+        buckets long, so they can be queried concurrently. The edges between slices are edges of the buckets, which are
+        anchored on query.origin. Every slice but the last excludes its end, which is where the next slice starts.
+
+        :param query: MetricQuery, after _plan_query built its statement.
+        :param select: str, the CQL of the statement up to the condition on the end of the window.
+        :return: None
+        """
+        start_timestamp, end_timestamp = query.params[3], query.params[4]
+        span = (end_timestamp - start_timestamp).total_seconds()
+        slice_seconds = max(int(np.ceil(span / self.split_slices / query.bucket_size)), 1) * query.bucket_size
+        origin = floor_timestamp(query.start_timestamp, DAY_SECONDS)
+        edge = floor_timestamp(start_timestamp, query.bucket_size, origin) + timedelta(seconds=slice_seconds)
+        edges = [start_timestamp]
+
+        while edge < end_timestamp:
+            edges.append(edge)
+            edge += timedelta(seconds=slice_seconds)
+
+        if len(edges) < 2:
+            return
+
+        statement = self._prepare(select + 'AND metric_timestamp < ? ORDER BY metric_timestamp ASC;', self.fetch_size)
+        key = query.params[:3]
+        query.slices = [(statement, key + [start, end]) for start, end in zip(edges[:-1], edges[1:])]
+        query.slices.append((query.statement, key + [edges[-1], end_timestamp]))
+
+    def _get_cached(self, query):
+        if self.cache is None:
+            return None
+
+        return self.cache.get(query.key)
+
+    def _cache(self, query, rows):
+        if self.cache is None:
+            return
+
+        end_timestamp = query.end_timestamp
+
+        if end_timestamp.tzinfo is None:
+            end_timestamp = pytz.utc.localize(end_timestamp)
+
+        if end_timestamp < datetime.now(tz=pytz.utc) - self.cache_settle_time:
+            ttl = self.cache_historical_ttl
+        else:
+            ttl = self.cache_live_ttl
+
+        self.cache.put(query.key, rows, ttl)
+
     def get_metric_data(self, environment, application, table, metric, columns, start_timestamp=None,
                         end_timestamp=None, size=1000) -> pd.DataFrame:
         """
@@ -151,41 +616,291 @@ class MetricsService(BaseService):
         :param size: The desired number of rows to return. We will do what we can to return as close to as many rows as
             requested, however when down sampling we cannot always get exactly the desired amount. Also, sometimes there
             just isn't enough data in the database.
-        :return: list of rows.
+        :return: list of rows. If caching or coalescing is enabled the DataFrame may be shared with other callers, so
+            do not modify it.
         """
-        if end_timestamp is None:
-            end_timestamp = datetime.now(tz=pytz.utc)
+        query, rows = self.plan_metric_query(environment, application, table, metric, columns, start_timestamp,
+                                             end_timestamp, size)
 
-        if start_timestamp is None:
-            start_timestamp = end_timestamp - timedelta(hours=24)
+        if rows is not None:
+            return rows
 
-        columns, is_interval_count = validate_columns(table, columns)
-        query_columns = ['metric_timestamp'] + columns
-        column_str = ', '.join(query_columns)
-        query = (
-            f'SELECT {column_str} FROM {table} WHERE environment=%s AND application=%s AND metric_name=%s '
-            'AND metric_timestamp >= %s AND metric_timestamp <= %s;'
-        )
-        params = [environment, application, metric, start_timestamp, end_timestamp]
-        rows = self.session.execute(query, params).current_rows
+        if self.single_flight is None:
+            return self._fetch_metric_data(query)
+
+        return self.single_flight.do(query.key, lambda: self._fetch_metric_data(query))
+
+    def _fetch_metric_data(self, query):
+        if len(query.statements) > 1:
+            return self._receive_metric_data(query, self._send_metric_query(query))
+
+        with stage('metric_query'):
+            result = self.session.execute(query.statement, query.params, execution_profile=COLUMNAR_PROFILE)
+
+        return self.process_metric_result(query, result)
+
+    def _send_metric_query(self, query):
+        """
+        Executes a planned query asynchronously, as one query per slice if its window was split, plus one for its raw
+        tail.
+
+        :return: list of ResponseFutures, one per query.statements.
+        """
+        return [
+            self.session.execute_async(statement, params, execution_profile=COLUMNAR_PROFILE)
+            for statement, params in query.statements
+        ]
+
+    def _receive_metric_data(self, query, futures):
+        """
+        Waits for the futures of _send_metric_query and returns the DataFrame get_metric_data returns.
+        """
+        if len(futures) == 1:
+            with stage('metric_query'):
+                result = futures[0].result()
+
+            return self.process_metric_result(query, result)
+
+        def results():
+            for future in futures:
+                with stage('metric_query'):
+                    yield future.result()
+
+        return self.process_metric_results(query, results())
+
+    def plan_metric_query(self, environment, application, table, metric, columns, start_timestamp=None,
+                          end_timestamp=None, size=1000):
+        """
+        The first half of get_metric_data, it validates the request and either finds the rows in the cache or plans the
+        query to fetch them. Callers that want to execute the query themselves (e.g. asynchronously) execute
+        query.statement with query.params and the columnar execution profile, and pass the result to
+        process_metric_result. If query.statements holds more than one statement they execute every one of them and
+        pass the results to process_metric_results instead.
+
+        :return: tuple of (MetricQuery, DataFrame or None if the rows aren't cached)
+        """
+        query = self._new_query(environment, application, table, metric, columns, start_timestamp, end_timestamp,
+                                size)
+        rows = self._get_cached(query)
+
+        if rows is None:
+            self._plan_query(query)
+
+        return query, rows
+
+    def process_metric_result(self, query, result) -> pd.DataFrame:
+        """
+        The second half of get_metric_data, it turns the result of a planned query into the returned DataFrame and
+        caches it.
+        """
+        rows = self._process_result(query, result)
+        record_rows(query.source_table, query.fetched_rows, len(rows))
+        self._cache(query, rows)
+
+        return rows
+
+    def process_metric_results(self, query, results) -> pd.DataFrame:
+        """
+        The same as process_metric_result, for a query with more than one statement. The results of a split window and
+        of the raw tail are down sampled one after the other as they arrive, into the same buckets as the whole window.
+
+        :param query: MetricQuery
+        :param results: iterable of the result of each of query.statements, in the same order.
+        :return: pd.DataFrame
+        """
+        results = iter(results)
+
+        def pages(count):
+            for _ in range(count):
+                yield from self._iter_pages(next(results))
+
+        tail_count = 0 if query.tail is None else 1
+        rows = self._fold_pages(query, pages(len(query.statements) - tail_count), pages(tail_count)).reset_index()
+        record_rows(query.source_table, query.fetched_rows, len(rows))
+        self._cache(query, rows)
+
+        return rows
+
+    def get_metric_data_batch(self, series):
+        """
+        Retrieves many metric series at once. The queries for every series are sent to Cassandra concurrently, so this
+        takes about as long as the slowest series instead of the sum of all of them. With coalescing enabled, series
+        that are already being fetched, by this batch or any other request, wait for that fetch instead.
+
+        :param series: list of dicts, each dict has the same keys as the arguments of get_metric_data.
+        :return: list containing, for each series in the same order, the DataFrame get_metric_data would have returned
+            or the exception raised while retrieving it.
+        """
+        results = [None] * len(series)
+        pending = []
+        waiting = []
+
+        for idx, spec in enumerate(series):
+            flight = None
+
+            try:
+                query, rows = self.plan_metric_query(**spec)
+
+                if rows is not None:
+                    results[idx] = rows
+                    continue
+
+                if self.single_flight is not None:
+                    flight, is_leader = self.single_flight.begin(query.key)
+
+                    if not is_leader:
+                        waiting.append((idx, flight))
+                        continue
+
+                pending.append((idx, query, flight, self._send_metric_query(query)))
+            except Exception as e:
+                results[idx] = e
+
+                if flight is not None:
+                    self.single_flight.finish(flight, error=e)
+
+        for idx, query, flight, futures in pending:
+            try:
+                results[idx] = self._receive_metric_data(query, futures)
+            except Exception as e:
+                # A failed series should not fail the others, the error is reported for this series only.
+                results[idx] = e
+
+            if flight is not None and isinstance(results[idx], Exception):
+                self.single_flight.finish(flight, error=results[idx])
+            elif flight is not None:
+                self.single_flight.finish(flight, results[idx])
+
+        # Only wait once every flight this batch leads is finished, otherwise two batches waiting on each other's
+        # flights would deadlock.
+        for idx, flight in waiting:
+            try:
+                results[idx] = self.single_flight.wait(flight)
+            except Exception as e:
+                results[idx] = e
+
+        return results
+
+    def cache_stats(self):
+        """
+        Returns the metric data cache counters, or None if caching is disabled.
+        """
+        if self.cache is None:
+            return None
+
+        return self.cache.stats()
+
+    def coalesce_stats(self):
+        """
+        Returns the counters of coalesced metric queries, or None if coalescing is disabled.
+        """
+        if self.single_flight is None:
+            return None
+
+        return self.single_flight.stats()
+
+    def _page_to_data_frame(self, query, page, tail=False):
+        """
+        Converts a page of results to a DataFrame indexed by metric_timestamp.
+
+        :param tail: bool, whether the page was read by query.tail.
+        :return: tuple of (pd.DataFrame, weights), weights is the sample count of each row when reading from a rollup
+            table and None otherwise.
+        """
+        query_columns = query.tail_columns if tail else query.query_columns
+        rows = as_columnar(page, query_columns)
+        query.fetched_rows += len(rows)
+        weights = None
 
         if len(rows) == 0:
-            rows = pd.DataFrame([], columns=query_columns)
+            columns = [column for column in query_columns if column != SAMPLE_COUNT_COLUMN]
+            rows = pd.DataFrame([], columns=columns)
         else:
-            rows = pd.DataFrame(rows).set_index(['metric_timestamp']).tz_localize('UTC')
+            rows = rows.to_data_frame(index='metric_timestamp').tz_localize('UTC')
 
-        if is_interval_count:
+            if query.resolution is not None and not tail:
+                weights = rows.pop(SAMPLE_COUNT_COLUMN).values
+
+        if query.tail_is_interval_count if tail else query.is_interval_count:
             rows = interval_count(rows)
 
-        if len(rows) > size:
-            # If we got more rows from the database than we want, then we resample.
-            seconds = (end_timestamp - start_timestamp).total_seconds()
-            bucket_size = int(seconds // size)
-            aggregators = {}
+        return rows, weights
+
+    def _process_result(self, query, result) -> pd.DataFrame:
+        """
+        Turns the result of a planned MetricQuery into the DataFrame returned by get_metric_data, down sampling it if
+        there are more than query.size rows.
+        """
+        if self.fetch_size is None and query.resolution is None:
+            with stage('frame'):
+                rows, _ = self._page_to_data_frame(query, result.current_rows)
+
+            if len(rows) > query.size:
+                # If we got more rows from the database than we want, then we resample.
+                with stage('resample'):
+                    aggregators = get_aggregators(query.table, rows.columns)
+                    rows = rows.resample(f'{query.bucket_size}S', origin=query.origin).agg(aggregators)
+
+            return rows.reset_index()
+
+        return self._fold_pages(query, self._iter_pages(result)).reset_index()
+
+    def _iter_pages(self, result):
+        """
+        Yields the rows of each page of a result, fetching the next page once the previous one has been used.
+        """
+        yield result.current_rows
+
+        while result.has_more_pages:
+            with stage('metric_query'):
+                result.fetch_next_page()
+
+            yield result.current_rows
+
+    def _fold_pages(self, query, pages, tail=()) -> pd.DataFrame:
+        """
+        Folds pages of rows into down sampled buckets as soon as they arrive. We hold on to at most query.size rows,
+        because if the query returns that many rows or less we return them untouched. The result is the same as
+        resampling every row at once, except averages of rollup rows are weighted by their sample count.
+
+        :param query: MetricQuery
+        :param pages: iterable of the rows of each page, in time order, see _iter_pages.
+        :param tail: iterable of the rows of each page read by query.tail, they come after pages.
+        :return: pd.DataFrame indexed by metric_timestamp.
+        """
+        buffered = []
+        buffered_rows = 0
+        aggregator = None
+        all_pages = itertools.chain(zip(pages, itertools.repeat(False)), zip(tail, itertools.repeat(True)))
+
+        for page_rows, is_tail in all_pages:
+            with stage('frame'):
+                page, weights = self._page_to_data_frame(query, page_rows, is_tail)
+
+            if aggregator is None:
+                buffered.append((page, weights))
+                buffered_rows += len(page)
+
+                if buffered_rows > query.size:
+                    aggregator = BucketAggregator(query.bucket_size, get_aggregators(query.table, page.columns),
+                                                  origin=query.origin.tz_localize(None).to_datetime64())
+
+                    with stage('resample'):
+                        for buffered_page, buffered_weights in buffered:
+                            aggregator.fold(buffered_page.index, buffered_page, weights=buffered_weights)
+
+                    buffered = []
+            elif len(page) > 0:
+                with stage('resample'):
+                    aggregator.fold(page.index, page, weights=weights)
+
+        if aggregator is not None:
+            with stage('resample'):
+                return aggregator.to_data_frame()
 
-            for column in columns:
-                aggregators[column] = AGGREGATOR_MAP[table][column]
+        frames = [page for page, _ in buffered if len(page) > 0]
 
-            rows = rows.resample(f'{bucket_size}S').agg(aggregators)
+        if len(frames) == 0:
+            return buffered[0][0]
 
-        return rows.reset_index()
+        return pd.concat(frames)
@@ -0,0 +1,172 @@
+import errno
+import logging
+import os
+import signal
+import socket
+import time
+
+from metrics_server.errors import ConfigurationError
+
+logger = logging.getLogger(__name__)
+# Workers that die sooner than this after starting are probably failing on start up (e.g. Cassandra is down), so we
+# wait this long before starting a replacement instead of restarting them in a tight loop.
+MIN_WORKER_LIFETIME = 1.0
+
+
+def listen(host, port, backlog=1024):
+    """
+    Creates the listening socket shared by every worker.
+
+    :return: socket.socket
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+
+    return sock
+
+
+class Arbiter:
+    """
+    Arbiter pre-forks worker processes that accept connections from one shared listening socket, so CPU bound work like
+    down sampling and JSON encoding can use more than one core. Workers that die are replaced, and on SIGTERM or SIGINT
+    every worker is asked to finish its in flight requests and exit.
+
+    The Cassandra driver is not fork safe, so the arbiter must not create a Cluster. Each worker builds its own App,
+    and with it its own Cluster, after the fork.
+    """
+    def __init__(self, sock, workers, serve_worker, graceful_timeout=30):
+        """
+        :param sock: socket.socket, the listening socket, see listen.
+        :param workers: int, the number of worker processes.
+        :param serve_worker: function that takes the socket and serves requests from it until the worker receives
+            SIGTERM. It is called in the worker process.
+        :param graceful_timeout: float, how long workers get to exit after SIGTERM before they are killed.
+        """
+        if not hasattr(os, 'fork'):
+            raise ConfigurationError('server.workers requires a platform that supports fork.')
+
+        self.sock = sock
+        self.workers = workers
+        self.serve_worker = serve_worker
+        self.graceful_timeout = graceful_timeout
+        self.children = {}  # pid -> start time
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+
+        if pid != 0:
+            self.children[pid] = time.monotonic()
+            return pid
+
+        # In the worker: forget the arbiter's signal handlers, serve_worker installs its own.
+        exit_code = 0
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        try:
+            self.serve_worker(self.sock)
+        except Exception:
+            logger.exception('Worker %d failed', os.getpid())
+            exit_code = 1
+        finally:
+            # Never return into the arbiter's code.
+            os._exit(exit_code)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        """
+        Starts the workers and keeps them running until the arbiter receives SIGTERM or SIGINT.
+
+        :return: None
+        """
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for _ in range(self.workers):
+            self.spawn()
+
+        logger.info('Started %d workers on %s', self.workers, self.sock.getsockname())
+
+        while not self.stopping:
+            self.reap()
+
+            for _ in range(self.workers - len(self.children)):
+                self.spawn()
+
+            time.sleep(0.1)
+
+        self.shutdown()
+
+    def reap(self):
+        """
+        Collects workers that exited, waiting before replacing workers that died right after starting.
+
+        :return: int, the number of workers that exited.
+        """
+        reaped = 0
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid == 0:
+                break
+
+            started = self.children.pop(pid, None)
+            reaped += 1
+
+            if started is None:
+                continue
+
+            if not self.stopping:
+                logger.warning('Worker %d exited with status %d, starting a replacement', pid, status)
+
+                if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                    time.sleep(MIN_WORKER_LIFETIME)
+
+        return reaped
+
+    def shutdown(self):
+        """
+        Asks every worker to exit, and kills the ones still running after graceful_timeout.
+
+        :return: None
+        """
+        for pid in list(self.children):
+            self._signal(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout
+
+        while len(self.children) > 0 and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        for pid in list(self.children):
+            logger.warning('Worker %d did not exit in time, killing it', pid)
+            self._signal(pid, signal.SIGKILL)
+
+        while len(self.children) > 0:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+
+            self.children.pop(pid, None)
+
+        self.sock.close()
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
@@ -0,0 +1,189 @@
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+from cassandra.cluster import Session
+
+from metrics_server.base_service import BaseService
+from metrics_server.cassandra_service import COLUMNAR_PROFILE, execute_concurrently, raise_first_error
+from metrics_server.columnar import as_columnar
+from metrics_server.downsample import BucketAggregator
+from metrics_server.metrics_service import AGGREGATOR_MAP, MetricsService
+from metrics_server.rollups import (
+    RESOLUTIONS, SAMPLE_COUNT_COLUMN, WATERMARKS_TABLE, floor_timestamp, rollup_table_name
+)
+
+logger = logging.getLogger(__name__)
+EPOCH = np.datetime64(0, 'ns')
+INTEGER_COLUMNS = {'count', 'previous_count', 'interval_count', SAMPLE_COUNT_COLUMN}
+WATERMARKS_SELECT_CQL = (
+    f'SELECT resolution, last_bucket FROM {WATERMARKS_TABLE} '
+    'WHERE source_table = ? AND environment = ? AND application = ? AND metric_name = ?;'
+)
+WATERMARKS_UPDATE_CQL = (
+    f'INSERT INTO {WATERMARKS_TABLE} (source_table, environment, application, metric_name, resolution, last_bucket) '
+    'VALUES (?, ?, ?, ?, ?, ?);'
+)
+
+
+def _to_cql_value(column, value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+
+    if column in INTEGER_COLUMNS:
+        return int(value)
+
+    return float(value)
+
+
+class RollupService(BaseService):
+    """
+    RollupService keeps the rollup tables up to date. For each metric it reads the raw rows that arrived since the
+    last run and aggregates them into every resolution with the same per column aggregations get_metric_data uses.
+    Progress is tracked per metric and resolution in the rollup_watermarks table, so each run only reads new rows.
+    """
+    def __init__(self, config, services):
+        super().__init__(config, services)
+        self._session = self.services['CassandraService'].session
+        rollups_config = self.config.get('rollups', {})
+        # How far back to aggregate the first time we see a metric.
+        self.backfill = timedelta(hours=rollups_config.get('backfill_hours', 24))
+        # Data points can arrive late, so we wait this long after a bucket ends before aggregating it.
+        self.lag = timedelta(seconds=rollups_config.get('lag_seconds', 60))
+        self.fetch_size = rollups_config.get('fetch_size', 5000)
+        self.concurrency = rollups_config.get('concurrency', 50)
+
+    @property
+    def session(self) -> Session:
+        return self._session
+
+    @property
+    def metrics_service(self) -> MetricsService:
+        return self.services['MetricsService']
+
+    def _prepare(self, cql, fetch_size=None):
+        return self.services['CassandraService'].prepare(cql, fetch_size)
+
+    def _insert_statement(self, table, resolution, columns):
+        all_columns = ['environment', 'application', 'metric_name', 'metric_timestamp'] + columns
+        cql = (
+            f'INSERT INTO {rollup_table_name(table, resolution)} ({", ".join(all_columns)}) '
+            f'VALUES ({", ".join("?" for _ in all_columns)});'
+        )
+
+        return self._prepare(cql)
+
+    def get_watermarks(self, table, environment, application, metric):
+        """
+        Returns the end of the last bucket aggregated for each resolution of a metric.
+
+        :return: dict of resolution to naive UTC datetime.
+        """
+        rows = self.session.execute(self._prepare(WATERMARKS_SELECT_CQL), [table, environment, application, metric])
+
+        return {row['resolution']: row['last_bucket'] for row in rows}
+
+    def roll_up_metric(self, table, environment, application, metric, now=None):
+        """
+        Aggregates all complete buckets since the last run for every resolution of a single metric.
+
+        :param table: str, the raw table the metric is stored in.
+        :param environment: str
+        :param application: str
+        :param metric: str
+        :param now: naive UTC datetime, defaults to the current time.
+        :return: int, the number of raw rows read.
+        """
+        if now is None:
+            now = datetime.utcnow()
+
+        watermarks = self.get_watermarks(table, environment, application, metric)
+        windows = {}
+
+        for resolution, seconds in RESOLUTIONS.items():
+            start = watermarks.get(resolution) or floor_timestamp(now - self.backfill, seconds)
+            end = floor_timestamp(now - self.lag, seconds)
+
+            if start < end:
+                windows[resolution] = (start, end)
+
+        if len(windows) == 0:
+            return 0
+
+        read_start = min(window[0] for window in windows.values())
+        read_end = max(window[1] for window in windows.values())
+        raw_columns = [column for column in AGGREGATOR_MAP[table] if column != 'interval_count']
+        query_columns = ['metric_timestamp'] + raw_columns
+        query = (
+            f'SELECT {", ".join(query_columns)} FROM {table} '
+            'WHERE environment = ? AND application = ? AND metric_name = ? '
+            'AND metric_timestamp >= ? AND metric_timestamp < ? ORDER BY metric_timestamp ASC;'
+        )
+        params = [environment, application, metric, read_start, read_end]
+        statement = self._prepare(query, self.fetch_size)
+        result = self.session.execute(statement, params, execution_profile=COLUMNAR_PROFILE)
+        aggregators = {
+            resolution: BucketAggregator(RESOLUTIONS[resolution], AGGREGATOR_MAP[table], origin=EPOCH)
+            for resolution in windows
+        }
+        rows_read = 0
+
+        while True:
+            page = as_columnar(result.current_rows, query_columns)
+
+            if len(page) > 0:
+                rows_read += len(page)
+                page = page.to_data_frame(index='metric_timestamp')
+                page = page.assign(interval_count=page['count'] - page['previous_count'])
+                timestamps = page.index.values
+
+                for resolution, (start, end) in windows.items():
+                    mask = (timestamps >= np.datetime64(start, 'ns')) & (timestamps < np.datetime64(end, 'ns'))
+                    aggregators[resolution].fold(timestamps[mask], page[mask])
+
+            if not result.has_more_pages:
+                break
+
+            result.fetch_next_page()
+
+        for resolution, aggregator in aggregators.items():
+            self._write_rollups(table, resolution, environment, application, metric, aggregator)
+            params = [table, environment, application, metric, resolution, windows[resolution][1]]
+            self.session.execute(self._prepare(WATERMARKS_UPDATE_CQL), params)
+
+        return rows_read
+
+    def _write_rollups(self, table, resolution, environment, application, metric, aggregator):
+        timestamps, sample_counts, columns = aggregator.aggregates()
+        column_names = list(columns) + [SAMPLE_COUNT_COLUMN]
+        columns[SAMPLE_COUNT_COLUMN] = sample_counts
+        statement = self._insert_statement(table, resolution, column_names)
+        filled = np.flatnonzero(sample_counts)
+        values = [columns[column][filled].tolist() for column in column_names]
+        params = []
+
+        for timestamp, row in zip(timestamps[filled].astype('datetime64[ms]').astype(object), zip(*values)):
+            row_values = [_to_cql_value(column, value) for column, value in zip(column_names, row)]
+            params.append([environment, application, metric, timestamp] + row_values)
+
+        if len(params) > 0:
+            raise_first_error(execute_concurrently(self.session, statement, params, self.concurrency))
+
+    def run_once(self, now=None):
+        """
+        Rolls up every metric we know about.
+
+        :param now: naive UTC datetime, defaults to the current time.
+        :return: int, the number of raw rows read.
+        """
+        rows_read = 0
+
+        for metric in self.metrics_service.get_all_distinct_metrics():
+            try:
+                rows_read += self.roll_up_metric(metric['table'], metric['environment'], metric['application'],
+                                                 metric['metric_name'], now)
+            except Exception:
+                # One bad metric shouldn't stop the others from being rolled up, it will be retried on the next run.
+                logger.exception('Failed to roll up %s', metric)
+
+        return rows_read
@@ -0,0 +1,38 @@
+import logging
+import time
+
+from metrics_server.cassandra_service import CassandraService
+from metrics_server.metrics_service import MetricsService
+from metrics_server.rollup_service import RollupService
+from metrics_server.run import read_config
+
+logger = logging.getLogger(__name__)
+
+
+def run():
+    """
+    Bootstraps the services needed to maintain the rollup tables and rolls up new data forever, once every
+    rollups.interval seconds.
+
+    :return:
+    """
+    logging.basicConfig(level=logging.INFO)
+    config = read_config()
+    services = {}
+
+    for service_class in (CassandraService, MetricsService, RollupService):
+        services[service_class.__name__] = service_class(config, services)
+
+    rollup_service = services['RollupService']
+    interval = config.get('rollups', {}).get('interval', 60)
+
+    while True:
+        started = time.monotonic()
+        rows_read = rollup_service.run_once()
+        elapsed = time.monotonic() - started
+        logger.info('Rolled up %d rows in %.2f seconds', rows_read, elapsed)
+        time.sleep(max(interval - elapsed, 0))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,85 @@
+import calendar
+from collections import OrderedDict
+from datetime import timedelta
+
+# Rollup tables store metric data pre-aggregated into fixed size buckets, so queries over long time ranges don't have
+# to read every raw data point. Resolutions are ordered from finest to coarsest, all of them divide a day evenly so
+# buckets line up with the ones used by DataFrame.resample.
+RESOLUTIONS = OrderedDict([
+    ('1m', 60),
+    ('5m', 5 * 60),
+    ('1h', 60 * 60),
+])
+ROLLUP_TABLE_PREFIXES = {
+    'raw_counter_with_interval': 'rollup_counter',
+    'raw_timer_with_interval': 'rollup_timer',
+}
+# The number of raw rows aggregated into a rollup row, used to weight averages when rollup rows are aggregated again.
+SAMPLE_COUNT_COLUMN = 'sample_count'
+WATERMARKS_TABLE = 'rollup_watermarks'
+
+
+def rollup_table_name(table, resolution):
+    """
+    Returns the name of the rollup table for a raw table at the given resolution.
+
+    :param table: str, the raw table name, e.g. raw_timer_with_interval.
+    :param resolution: str, a key of RESOLUTIONS.
+    :return: str
+    """
+    return f'{ROLLUP_TABLE_PREFIXES[table]}_{resolution}'
+
+
+def choose_resolution(bucket_size):
+    """
+    Picks the coarsest rollup resolution that still has at least one row per bucket, that way we read as few rows as
+    possible while still returning the number of rows requested.
+
+    :param bucket_size: int, the size in seconds of the buckets we are going to down sample to.
+    :return: str, a key of RESOLUTIONS, or None if the raw data should be used.
+    """
+    chosen = None
+
+    for resolution, seconds in RESOLUTIONS.items():
+        if seconds <= bucket_size:
+            chosen = resolution
+
+    return chosen
+
+
+def floor_timestamp(timestamp, seconds, origin=None):
+    """
+    Rounds a datetime down to the start of the bucket it falls in. Naive datetimes are treated as UTC.
+
+    :param timestamp: datetime
+    :param seconds: int, the bucket size in seconds.
+    :param origin: optional datetime the buckets are anchored on, defaults to the epoch. Bucket sizes that divide a day
+        evenly, like every resolution in RESOLUTIONS, have the same buckets for any midnight origin.
+    :return: datetime
+    """
+    timestamp = timestamp.replace(microsecond=0)
+
+    if origin is None:
+        offset = calendar.timegm(timestamp.utctimetuple())
+    else:
+        offset = int((timestamp - origin).total_seconds())
+
+    return timestamp - timedelta(seconds=offset % seconds)
+
+
+def ceil_timestamp(timestamp, seconds, origin=None):
+    """
+    Rounds a datetime up to the end of the bucket it falls in, timestamps already on a bucket boundary are unchanged.
+    Naive datetimes are treated as UTC.
+
+    :param timestamp: datetime
+    :param seconds: int, the bucket size in seconds.
+    :param origin: optional datetime the buckets are anchored on, see floor_timestamp.
+    :return: datetime
+    """
+    floored = floor_timestamp(timestamp, seconds, origin)
+
+    if floored == timestamp:
+        return floored
+
+    return floored + timedelta(seconds=seconds)
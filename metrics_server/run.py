@@ -1,12 +1,30 @@
+import logging
 import os
+import signal
+import time
 from argparse import ArgumentParser
 import json
 
-from waitress import serve
+from waitress import create_server, serve, wasyncore
 
 from metrics_server.app import App
+from metrics_server.errors import ConfigurationError
+from metrics_server.prefork import Arbiter, listen
 
 TRUTHY = {'true', '1', 'yes', 'on'}
+SERVER_MODES = ('waitress', 'asgi')
+# Optional cassandra settings that can be set from the environment, validated by CassandraService.
+CASSANDRA_ENV = {
+    'METRICS_SERVER_CASSANDRA_PORT': 'port',
+    'METRICS_SERVER_CASSANDRA_LOCAL_DC': 'local_dc',
+    'METRICS_SERVER_CASSANDRA_USED_HOSTS_PER_REMOTE_DC': 'used_hosts_per_remote_dc',
+    'METRICS_SERVER_CASSANDRA_PROTOCOL_VERSION': 'protocol_version',
+    'METRICS_SERVER_CASSANDRA_CONNECTIONS_PER_HOST': 'connections_per_host',
+    'METRICS_SERVER_CASSANDRA_EXECUTOR_THREADS': 'executor_threads',
+    'METRICS_SERVER_CASSANDRA_COMPRESSION': 'compression',
+    'METRICS_SERVER_CASSANDRA_REQUEST_TIMEOUT': 'request_timeout',
+    'METRICS_SERVER_CASSANDRA_METRICS_REQUEST_TIMEOUT': 'metrics_request_timeout',
+}
 
 
 def read_config_from_env():
@@ -18,6 +36,9 @@ def read_config_from_env():
             'host': env.get('METRICS_SERVER_HOST', '0.0.0.0'),
             'port': int(env.get('METRICS_SERVER_PORT', '8080')),
             'threads': int(env.get('METRICS_SERVER_THREADS', '4')),
+            'json_backend': env.get('METRICS_SERVER_JSON_BACKEND', 'json'),
+            'mode': env.get('METRICS_SERVER_MODE', 'waitress'),
+            'workers': int(env.get('METRICS_SERVER_WORKERS', '1')),
         }
     }
 
@@ -26,6 +47,25 @@ def read_config_from_env():
         # on App.__init__
         config['cassandra'] = {'host': cassandra}
 
+        for name, key in CASSANDRA_ENV.items():
+            if env.get(name):
+                config['cassandra'][key] = env[name]
+
+        if env.get('METRICS_SERVER_CASSANDRA_SPECULATIVE_DELAY'):
+            config['cassandra']['speculative_execution'] = {
+                'delay': env['METRICS_SERVER_CASSANDRA_SPECULATIVE_DELAY'],
+                'max_attempts': env.get('METRICS_SERVER_CASSANDRA_SPECULATIVE_MAX_ATTEMPTS', '2'),
+            }
+    elif env.get('METRICS_SERVER_LOCAL_STORE'):
+        config['cassandra'] = {
+            'backend': 'local',
+            'local': {
+                'path': env['METRICS_SERVER_LOCAL_STORE'],
+                'latency_ms': float(env.get('METRICS_SERVER_LOCAL_STORE_LATENCY_MS', '0')),
+                'jitter_ms': float(env.get('METRICS_SERVER_LOCAL_STORE_JITTER_MS', '0')),
+            },
+        }
+
     return config
 
 
@@ -48,24 +88,118 @@ def read_config():
     )
     parser = ArgumentParser(description='Start a metrics web server')
     parser.add_argument('--config', help=help_text, default=None)
-    args = parser.parse_args()
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes, overrides server.workers')
+    args, _ = parser.parse_known_args()
 
     if args.config is not None:
-        return read_config_from_file(args.config)
+        config = read_config_from_file(args.config)
+    else:
+        config = read_config_from_env()
+
+    if args.workers is not None:
+        config.setdefault('server', {})['workers'] = args.workers
+
+    return config
+
+
+def _shutdown_app(app):
+    app.services['MetricsService'].stop_catalog_refresh()
+    app.services['CassandraService'].cluster.shutdown()
+
+
+def _serve_waitress_worker(app, sock, threads, graceful_timeout):
+    """
+    Serves an app with waitress from a shared listening socket until SIGTERM. Then it stops accepting connections and
+    returns once in flight requests are answered, or after graceful_timeout seconds.
+    """
+    server = create_server(app.flask_app, sockets=[sock], threads=threads)
+    deadline = []
+
+    def stop(signum, frame):
+        server.accepting = False
+        server.del_channel()
+        deadline.append(time.monotonic() + graceful_timeout)
+
+    def busy():
+        return any(getattr(channel, 'requests', None) or getattr(channel, 'total_outbufs_len', 0)
+                   for channel in list(server._map.values()))
+
+    signal.signal(signal.SIGTERM, stop)
 
-    return read_config_from_env()
+    # The same loop as server.run, one poll at a time so we notice when the worker is drained.
+    while len(deadline) == 0 or (busy() and time.monotonic() < deadline[0]):
+        wasyncore.loop(timeout=server.adj.asyncore_loop_timeout, map=server._map,
+                       use_poll=server.adj.asyncore_use_poll, count=1)
+
+    server.task_dispatcher.shutdown(timeout=max(deadline[0] - time.monotonic(), 0))
+
+
+def serve_app(config, sock=None):
+    """
+    Bootstraps an App and serves it with waitress, or with uvicorn if server.mode is asgi, see asgi.AsgiApp.
+
+    :param config: dict, the configuration.
+    :param sock: optional listening socket shared with other worker processes, see prefork.Arbiter. If not given the
+        server listens on server.host and server.port.
+    :return:
+    """
+    server_config = config['server']
+    app = App(config)
+
+    if server_config.get('mode', 'waitress') == 'asgi':
+        import uvicorn
+        from metrics_server.asgi import AsgiApp
+
+        asgi_app = AsgiApp(app, server_config['threads'])
+
+        if sock is None:
+            uvicorn.run(asgi_app, host=server_config['host'], port=server_config['port'], lifespan='on')
+        else:
+            # uvicorn finishes in flight requests on SIGTERM by itself.
+            uvicorn.run(asgi_app, fd=sock.fileno(), lifespan='on',
+                        timeout_graceful_shutdown=server_config.get('graceful_timeout', 30))
+    elif sock is None:
+        serve(app.flask_app, host=server_config['host'], port=server_config['port'], threads=server_config['threads'])
+    else:
+        _serve_waitress_worker(app, sock, server_config['threads'], server_config.get('graceful_timeout', 30))
+
+    _shutdown_app(app)
 
 
 def run():
     """
-    Bootstraps an App and serves it with waitress.
+    Serves the metrics server. With more than one server.workers (or --workers) it pre-forks that many worker
+    processes which share the listening socket, each with its own App and Cassandra connection.
 
     :return:
     """
     config = read_config()
-    app = App(config)
     server_config = config['server']
-    serve(app.flask_app, host=server_config['host'], port=server_config['port'], threads=server_config['threads'])
+    mode = server_config.get('mode', 'waitress')
+    workers = int(server_config.get('workers', 1))
+
+    if mode not in SERVER_MODES:
+        raise ConfigurationError(f'server.mode must be one of {", ".join(SERVER_MODES)}, not "{mode}".')
+
+    if mode == 'asgi':
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            raise ConfigurationError('server.mode asgi requires uvicorn, install it with "pip install uvicorn".')
+
+    if workers < 1:
+        raise ConfigurationError(f'server.workers must be at least 1, got {workers}.')
+
+    if workers == 1:
+        serve_app(config)
+        return
+
+    logging.basicConfig(level=logging.INFO)
+    sock = listen(server_config['host'], server_config['port'])
+    arbiter = Arbiter(sock, workers, lambda worker_sock: serve_app(config, worker_sock),
+                      server_config.get('graceful_timeout', 30))
+    arbiter.run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+import logging
+import sqlite3
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+
+import numpy as np
+
+from metrics_server.local_store import EPOCH, TABLES, TIMER_MEASURES, create_schema
+
+logger = logging.getLogger(__name__)
+# Rows are inserted in batches of this size, each batch is a transaction.
+BATCH_SIZE = 50000
+
+
+def metric_rows(random, table, environment, application, metric, timestamps, interval):
+    """
+    Generates the rows of one metric: counts that only go up, log normal latencies with the odd spike, and rates that
+    wander around a mean.
+
+    :param random: np.random.RandomState
+    :param timestamps: np.ndarray of int64 milliseconds since the epoch.
+    :param interval: int, seconds between rows.
+    :return: iterator of tuples in the column order of the table.
+    """
+    count = len(timestamps)
+    interval_counts = random.poisson(interval * 20, count)
+    counts = np.cumsum(interval_counts)
+    data = {
+        'environment': [environment] * count,
+        'application': [application] * count,
+        'metric_name': [metric] * count,
+        'metric_timestamp': timestamps.tolist(),
+        'previous_metric_timestamp': (timestamps - interval * 1000).tolist(),
+        'count': counts.tolist(),
+        'previous_count': (counts - interval_counts).tolist(),
+    }
+
+    if table == 'raw_timer_with_interval':
+        scale = random.uniform(5, 200)
+
+        for measure in TIMER_MEASURES:
+            if measure.endswith('_rate'):
+                values = 20 + np.cumsum(random.normal(0, 0.05, count))
+            else:
+                values = random.lognormal(np.log(scale), 0.4, count)
+                values[random.random_sample(count) < 0.001] *= 20
+
+            data[measure] = values.tolist()
+
+        data['duration_unit'] = ['milliseconds'] * count
+        data['rate_unit'] = ['seconds'] * count
+
+    columns = [name for name, _ in TABLES[table][0]]
+
+    return zip(*[data[name] for name in columns])
+
+
+def seed(path, environments, applications, metrics, days, interval, seed=42):
+    """
+    Fills a local store with synthetic counter and timer metrics ending now, see local_store.py.
+
+    :param path: str, the SQLite database file.
+    :param environments: list of str.
+    :param applications: int, the number of applications in each environment.
+    :param metrics: int, the number of metrics of each application in each table.
+    :param days: float, how many days of data to generate.
+    :param interval: int, seconds between the rows of a metric.
+    :param seed: int, seed of the random number generator.
+    :return: int, the number of rows inserted.
+    """
+    random = np.random.RandomState(seed)
+    end = int((datetime.utcnow() - EPOCH).total_seconds()) // interval * interval
+    timestamps = (end - np.arange(int(days * 24 * 60 * 60 / interval))[::-1] * interval) * 1000
+    connection = sqlite3.connect(path)
+    create_schema(connection)
+    inserted = 0
+
+    for table in ('raw_counter_with_interval', 'raw_timer_with_interval'):
+        columns = [name for name, _ in TABLES[table][0]]
+        sql = f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})'
+        kind = 'counter' if 'counter' in table else 'timer'
+
+        for environment in environments:
+            for app_idx in range(applications):
+                application = f'app-{app_idx}'
+
+                for metric_idx in range(metrics):
+                    metric = f'{application}.{kind}.metric-{metric_idx}'
+                    rows = list(metric_rows(random, table, environment, application, metric, timestamps, interval))
+
+                    for start in range(0, len(rows), BATCH_SIZE):
+                        with connection:
+                            connection.executemany(sql, rows[start:start + BATCH_SIZE])
+
+                    inserted += len(rows)
+                    logger.info('Seeded %s %s %s with %d rows', table, environment, metric, len(rows))
+
+    connection.close()
+
+    return inserted
+
+
+def run():
+    parser = ArgumentParser(description='Seed a local store with synthetic metrics, see cassandra.backend local.')
+    parser.add_argument('path', help='The SQLite database file to create or add to.')
+    parser.add_argument('--environments', default='dev', help='Comma separated environment names.')
+    parser.add_argument('--applications', type=int, default=4, help='Applications per environment.')
+    parser.add_argument('--metrics', type=int, default=5, help='Metrics per application in each table.')
+    parser.add_argument('--days', type=float, default=7, help='Days of data per metric, ending now.')
+    parser.add_argument('--interval', type=int, default=5, help='Seconds between the rows of a metric.')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the random number generator.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    started = time.monotonic()
+    inserted = seed(args.path, args.environments.split(','), args.applications, args.metrics, args.days, args.interval,
+                    args.seed)
+    logger.info('Inserted %d rows in %.1f seconds', inserted, time.monotonic() - started)
+
+
+if __name__ == '__main__':
+    run()
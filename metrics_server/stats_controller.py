@@ -0,0 +1,42 @@
+import time
+
+from flask import g, jsonify
+
+from metrics_server.base_controller import BaseController
+from metrics_server.timing import STATS, end_request, record, server_timing, start_request
+
+
+class StatsController(BaseController):
+    """
+    Times every request by stage, see timing.stage. The stages of each request are sent back in a Server-Timing header,
+    so they show up in the browser's dev tools, and are aggregated into histograms served by /api/v1/_stats.
+    """
+    def start_timing(self):
+        g.timing_token = start_request()
+        g.timing_started = time.perf_counter()
+
+    def finish_timing(self, response):
+        token = g.pop('timing_token', None)
+
+        if token is None:
+            return response
+
+        timings = end_request(token)
+        timings['total'] = (time.perf_counter() - g.pop('timing_started')) * 1000
+        record('total', timings['total'])
+        # Streamed responses are encoded after this, so their encode stage isn't included.
+        response.headers['Server-Timing'] = server_timing(timings)
+
+        return response
+
+    def stats(self):
+        """
+        Returns a latency histogram for each stage, and the number of rows fetched from and returned for each table.
+        :return:
+        """
+        return jsonify(**STATS.to_dict())
+
+    def add_routes(self):
+        self.flask_app.before_request(self.start_timing)
+        self.flask_app.after_request(self.finish_timing)
+        self.add_route('/api/v1/_stats', self.stats, ['GET'])
@@ -0,0 +1,163 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds, in milliseconds, of the latency histogram buckets. The last bucket has no upper bound.
+HISTOGRAM_BOUNDS = [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+# The stage timings of the request being handled, see start_request. None outside of a request.
+_request_timings = ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """
+    A latency histogram with fixed buckets, cheap enough to update on every request.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, milliseconds):
+        self.counts[bisect.bisect_left(HISTOGRAM_BOUNDS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def percentile(self, q):
+        """
+        Estimates a percentile as the upper bound of the bucket it falls in, or the maximum for the last bucket.
+
+        :param q: float, between 0 and 100.
+        :return: float, milliseconds.
+        """
+        if self.count == 0:
+            return None
+
+        rank = q / 100 * self.count
+        seen = 0
+
+        for idx, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= rank and count > 0:
+                return HISTOGRAM_BOUNDS[idx] if idx < len(HISTOGRAM_BOUNDS) else self.max
+
+        return self.max
+
+    def to_dict(self):
+        bounds = HISTOGRAM_BOUNDS + ['+Inf']
+
+        return {
+            'count': self.count,
+            'total_ms': self.total,
+            'mean_ms': self.total / self.count if self.count > 0 else None,
+            'max_ms': self.max,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'buckets': [[bound, count] for bound, count in zip(bounds, self.counts)],
+        }
+
+
+class Stats:
+    """
+    Stats aggregates stage timings into a latency histogram per stage, and counts the rows fetched from each table
+    versus the rows returned after down sampling. The numbers are per process, so with server.workers each worker
+    reports its own.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.tables = {}
+
+    def observe(self, name, milliseconds):
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = Histogram()
+
+            self.stages[name].observe(milliseconds)
+
+    def record_rows(self, table, fetched, returned):
+        with self._lock:
+            counts = self.tables.setdefault(table, {'queries': 0, 'fetched_rows': 0, 'returned_rows': 0})
+            counts['queries'] += 1
+            counts['fetched_rows'] += fetched
+            counts['returned_rows'] += returned
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'stages': {name: histogram.to_dict() for name, histogram in sorted(self.stages.items())},
+                'tables': {table: dict(counts) for table, counts in sorted(self.tables.items())},
+            }
+
+
+STATS = Stats()
+
+
+def start_request():
+    """
+    Starts collecting the stage timings of a request in the current context.
+
+    :return: a token to pass to end_request.
+    """
+    return _request_timings.set({})
+
+
+def end_request(token):
+    """
+    Stops collecting stage timings started with start_request.
+
+    :return: dict of stage name to milliseconds.
+    """
+    timings = _request_timings.get()
+    _request_timings.reset(token)
+
+    return timings or {}
+
+
+def record(name, milliseconds):
+    """
+    Adds time spent in a stage to the current request, if any, and to the stage's histogram.
+    """
+    timings = _request_timings.get()
+
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + milliseconds
+
+    STATS.observe(name, milliseconds)
+
+
+@contextmanager
+def stage(name):
+    """
+    Times the body of a with statement as a stage, see record. A stage entered more than once in a request, e.g. once
+    per series of a batch, adds up.
+    """
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - started) * 1000)
+
+
+def record_rows(table, fetched, returned):
+    STATS.record_rows(table, fetched, returned)
+
+
+def server_timing(timings):
+    """
+    Formats stage timings as a Server-Timing header value, e.g. "metric_query;dur=12.3, encode;dur=1.2".
+
+    :param timings: dict of stage name to milliseconds.
+    :return: str
+    """
+    return ', '.join(f'{name};dur={milliseconds:.1f}' for name, milliseconds in timings.items())
@@ -0,0 +1,94 @@
+import json
+from argparse import ArgumentParser
+
+from cassandra.cluster import Cluster, dict_factory
+
+COUNTER_COLUMNS = """
+    count bigint,
+    previous_count bigint,
+    interval_count bigint,
+"""
+TIMER_COLUMNS = COUNTER_COLUMNS + """
+    p75 double,
+    p95 double,
+    p98 double,
+    p99 double,
+    p999 double,
+    max double,
+    mean double,
+    median double,
+    min double,
+    std_dev double,
+    one_min_rate double,
+    five_min_rate double,
+    fifteen_min_rate double,
+    mean_rate double,
+"""
+ROLLUP_TABLE = """
+CREATE TABLE {name} (
+    environment text,
+    application text,
+    metric_name text,
+    metric_timestamp timestamp,{columns}
+    sample_count int,
+    PRIMARY KEY ((environment, application, metric_name), metric_timestamp)
+) WITH CLUSTERING ORDER BY (metric_timestamp ASC);
+"""
+ROLLUP_TABLES = {
+    'rollup_counter': COUNTER_COLUMNS,
+    'rollup_timer': TIMER_COLUMNS,
+}
+RESOLUTIONS = ('1m', '5m', '1h')
+WATERMARKS_TABLE = """
+CREATE TABLE rollup_watermarks (
+    source_table text,
+    environment text,
+    application text,
+    metric_name text,
+    resolution text,
+    last_bucket timestamp,
+    PRIMARY KEY ((source_table, environment, application, metric_name), resolution)
+);
+"""
+
+
+def read_config():
+    parser = ArgumentParser(description='Run migrations on Cassandra cluster')
+    parser.add_argument('config', default=None)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+
+    return config
+
+
+def init_session(config):
+    print('connecting to cassandra...')
+    cluster = Cluster([config['cassandra']['host']], port=9042)
+    keyspace = config['cassandra'].get('keyspace', 'metric_data')  # Allow optional keyspace in config for testing.
+    session = cluster.connect(keyspace)
+    session.row_factory = dict_factory
+
+    return session
+
+
+def perform_migration(session):
+    print('running migration...')
+
+    for prefix, columns in ROLLUP_TABLES.items():
+        for resolution in RESOLUTIONS:
+            session.execute(ROLLUP_TABLE.format(name=f'{prefix}_{resolution}', columns=columns.rstrip()))
+
+    session.execute(WATERMARKS_TABLE)
+    print('migration complete!')
+
+
+def main():
+    config = read_config()
+    session = init_session(config)
+    perform_migration(session)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import json
+from argparse import ArgumentParser
+
+from cassandra.cluster import Cluster, dict_factory
+
+# The newest data point evaluated for each alert, alert_id identifies an alert by its metric, measure and thresholds.
+ALERT_STATE_TABLE = """
+CREATE TABLE alert_state (
+    alert_id text PRIMARY KEY,
+    watermark timestamp,
+    updated_at timestamp
+);
+"""
+# The number of warnings and errors of each alert in fixed size time buckets, rows expire once they are older than
+# the longest time range of any dashboard the alert is on.
+ALERT_TALLIES_TABLE = """
+CREATE TABLE alert_tallies (
+    alert_id text,
+    bucket timestamp,
+    warnings int,
+    errors int,
+    first_warning timestamp,
+    last_warning timestamp,
+    first_error timestamp,
+    last_error timestamp,
+    PRIMARY KEY ((alert_id), bucket)
+) WITH CLUSTERING ORDER BY (bucket ASC);
+"""
+
+
+def read_config():
+    parser = ArgumentParser(description='Run migrations on Cassandra cluster')
+    parser.add_argument('config', default=None)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+
+    return config
+
+
+def init_session(config):
+    print('connecting to cassandra...')
+    cluster = Cluster([config['cassandra']['host']], port=9042)
+    keyspace = config['cassandra'].get('keyspace', 'metric_data')  # Allow optional keyspace in config for testing.
+    session = cluster.connect(keyspace)
+    session.row_factory = dict_factory
+
+    return session
+
+
+def perform_migration(session):
+    print('running migration...')
+    session.execute(ALERT_STATE_TABLE)
+    session.execute(ALERT_TALLIES_TABLE)
+    print('migration complete!')
+
+
+def main():
+    config = read_config()
+    session = init_session(config)
+    perform_migration(session)
+
+
+if __name__ == '__main__':
+    main()
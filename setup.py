@@ -21,7 +21,7 @@ setup(
         'Intended Audience :: Developers',
         'Programming Language :: Python :: 3.6',
     ],
-    packages=find_packages(exclude=['docs', 'tests', 'frontend', 'docker', 'migrations']),
+    packages=find_packages(exclude=['docs', 'tests', 'frontend', 'docker', 'migrations', 'benchmarks']),
     install_requires=[
         'cassandra-driver',
         'Flask',
@@ -34,6 +34,10 @@ setup(
     entry_points={
         'console_scripts': [
             'run=metrics_server.run:run',
+            'rollup=metrics_server.rollup_worker:run',
+            'catalog=metrics_server.catalog_worker:run',
+            'alerts=metrics_server.alert_worker:run',
+            'seed-local-store=metrics_server.seed_local_store:run',
         ],
     },
 )
@@ -0,0 +1,211 @@
+import gc
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from metrics_server.app import App
+from tests.benchmarks.synthetic import SyntheticSession
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# The benchmarks are slow, they only run when METRICS_BENCHMARKS is set.
+ENABLED = os.environ.get('METRICS_BENCHMARKS', '').lower() in {'true', '1', 'yes', 'on'}
+# Set to write the results of this run to baseline.json instead of comparing against it.
+UPDATE_BASELINE = os.environ.get('METRICS_BENCHMARK_UPDATE', '').lower() in {'true', '1', 'yes', 'on'}
+# How much slower, or how much more memory, than the baseline a benchmark may be before it fails, 0.5 is 50%.
+TOLERANCE = float(os.environ.get('METRICS_BENCHMARK_TOLERANCE', '0.5'))
+# Each benchmark is repeated until it has run for MIN_TIME seconds, at least once and at most MAX_REPEAT times.
+MIN_TIME = float(os.environ.get('METRICS_BENCHMARK_MIN_TIME', '1'))
+MAX_REPEAT = 20
+_results = {}
+_not_compared = []
+
+
+def benchmark_rows():
+    """
+    The row counts each benchmark runs at, METRICS_BENCHMARK_ROWS is a comma separated list.
+    """
+    return [int(rows) for rows in os.environ.get('METRICS_BENCHMARK_ROWS', '10000,100000,1000000').split(',')]
+
+
+def pytest_collection_modifyitems(config, items):
+    if ENABLED:
+        return
+
+    skip = pytest.mark.skip(reason='set METRICS_BENCHMARKS=1 to run the benchmarks')
+
+    # Only the benchmarks themselves are slow, the smoke tests of the load tools always run.
+    for item in items:
+        if 'benchmark' in getattr(item, 'fixturenames', ()):
+            item.add_marker(skip)
+
+
+def host_details():
+    """
+    Describes the machine and libraries the benchmarks run on. Timings and memory use are only comparable to a baseline
+    recorded with the same details.
+
+    :return: dict
+    """
+    cpu = platform.processor()
+
+    if os.path.exists('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as cpuinfo:
+            models = [line.split(':', 1)[1].strip() for line in cpuinfo if line.startswith('model name')]
+
+        cpu = models[0] if len(models) > 0 else cpu
+
+    return {
+        'system': platform.system(),
+        'machine': platform.machine(),
+        'cpu': cpu,
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def _load_baseline():
+    """
+    Returns the baseline as a dict with the host it was recorded on and the results of each benchmark.
+    """
+    if not os.path.exists(BASELINE_PATH):
+        return {'host': None, 'results': {}}
+
+    with open(BASELINE_PATH) as baseline_file:
+        return json.load(baseline_file)
+
+
+def measure(fn, rows):
+    """
+    Runs fn once to warm up, then times it, then runs it once more with tracemalloc on to find its peak memory. The
+    memory run is separate because tracemalloc slows down allocations.
+
+    :param fn: function that takes no arguments.
+    :param rows: int, the number of rows fn processes, used for the throughput.
+    :return: dict with the median latency in milliseconds, throughput in rows per second, and peak memory in bytes.
+    """
+    fn()
+    latencies = []
+    started = time.perf_counter()
+
+    while len(latencies) < MAX_REPEAT and (len(latencies) == 0 or time.perf_counter() - started < MIN_TIME):
+        run_started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - run_started)
+
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latency = statistics.median(latencies)
+
+    return {
+        'rows': rows,
+        'repeat': len(latencies),
+        'latency_ms': latency * 1000,
+        'rows_per_second': rows / latency,
+        'peak_memory_bytes': peak,
+    }
+
+
+@pytest.fixture(scope='session')
+def baseline():
+    return _load_baseline()
+
+
+@pytest.fixture()
+def benchmark(request, baseline):
+    """
+    Returns a function that measures a benchmark, records the result, and fails if it regressed past the baseline by
+    more than METRICS_BENCHMARK_TOLERANCE. Benchmarks without a baseline, or whose baseline was recorded on a different
+    host (see host_details), are only recorded.
+    """
+    def run(fn, rows):
+        name = request.node.name
+        result = measure(fn, rows)
+        _results[name] = result
+        expected = baseline['results'].get(name)
+
+        if UPDATE_BASELINE or expected is None:
+            return result
+
+        if baseline['host'] != host_details():
+            _not_compared.append(name)
+            return result
+
+        limit = 1 + TOLERANCE
+
+        assert result['latency_ms'] <= expected['latency_ms'] * limit, (
+            f'{name} took {result["latency_ms"]:.1f} ms, the baseline is {expected["latency_ms"]:.1f} ms'
+        )
+        assert result['peak_memory_bytes'] <= expected['peak_memory_bytes'] * limit, (
+            f'{name} used {result["peak_memory_bytes"]} bytes, the baseline is {expected["peak_memory_bytes"]} bytes'
+        )
+
+        return result
+
+    return run
+
+
+@pytest.fixture()
+def synthetic_app(mocker):
+    """
+    Returns a function that creates an App whose Cassandra session is a SyntheticSession.
+
+    :param mocker: pytest.mock fixture.
+    :return: function that takes the arguments of SyntheticSession and returns an App.
+    """
+    def create(rows, metrics=100):
+        cluster = mocker.patch('metrics_server.cassandra_service.Cluster')
+        cluster.return_value.connect.return_value = SyntheticSession(rows, metrics)
+
+        return App({'cassandra': {'host': '0.0.0.0'}})
+
+    return create
+
+
+def pytest_terminal_summary(terminalreporter):
+    if len(_results) == 0:
+        return
+
+    terminalreporter.section('benchmarks')
+    terminalreporter.write_line(f'{"benchmark":<60}{"ms":>12}{"rows/s":>14}{"peak MiB":>10}')
+
+    for name, result in _results.items():
+        terminalreporter.write_line(
+            f'{name:<60}{result["latency_ms"]:>12.2f}{result["rows_per_second"]:>14,.0f}'
+            f'{result["peak_memory_bytes"] / 2 ** 20:>10.1f}'
+        )
+
+    if len(_not_compared) > 0:
+        terminalreporter.write_line(f'Not compared with the baseline, it was recorded on a different host: '
+                                    f'{", ".join(_not_compared)}')
+
+    if UPDATE_BASELINE:
+        baseline = _load_baseline()
+        host = host_details()
+
+        # Results from another host aren't comparable with the new ones, so they are replaced rather than kept.
+        if baseline['host'] != host:
+            baseline = {'host': host, 'results': {}}
+
+        baseline['results'].update(_results)
+
+        with open(BASELINE_PATH, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+
+        terminalreporter.write_line(f'Wrote {len(_results)} results to {BASELINE_PATH}')
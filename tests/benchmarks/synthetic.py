@@ -0,0 +1,98 @@
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+from metrics_server.columnar import ColumnarRows
+from tests.utils import MockPreparedStatement, MockResponseFuture, MockResultSet
+
+SELECT_RE = re.compile(r'SELECT (?P<columns>.+?) FROM (?P<table>\w+)', re.IGNORECASE)
+# Seconds between the rows of a metric, the usual reporting interval.
+ROW_INTERVAL = 15
+RATE_COLUMNS = {'one_min_rate', 'five_min_rate', 'fifteen_min_rate', 'mean_rate'}
+
+
+def _naive_utc(timestamp):
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(pytz.utc).replace(tzinfo=None)
+
+    return timestamp
+
+
+class SyntheticSession:
+    """
+    Stands in for a Cassandra Session, answering the queries the metrics server sends with generated counter and timer
+    rows. Every metric data query returns `rows` rows spread evenly over the requested time range, in the columnar
+    format of the COLUMNAR_PROFILE execution profile. The DISTINCT query used to build the catalog returns `metrics`
+    metrics.
+
+    Generated results are kept, so only the first query for a set of columns and time range pays for generating them
+    and benchmarks measure the metrics server rather than the generator.
+    """
+    def __init__(self, rows, metrics=100, seed=42):
+        self.rows = rows
+        self.metrics = metrics
+        self.seed = seed
+        self.default_fetch_size = None
+        self._results = {}
+        self._latest = datetime(2017, 1, 1)
+
+    def prepare(self, cql):
+        return MockPreparedStatement(cql)
+
+    def execute(self, statement, params=None, **kwargs):
+        return MockResultSet(self._rows(statement.query_string, params))
+
+    def execute_async(self, statement, params=None, **kwargs):
+        return MockResponseFuture(self.execute(statement, params, **kwargs))
+
+    def _rows(self, cql, params):
+        if cql.startswith('SELECT DISTINCT'):
+            return [
+                {'environment': 'dev', 'application': f'app-{idx % 10}', 'metric_name': f'metric-{idx}'}
+                for idx in range(self.metrics)
+            ]
+
+        if 'LIMIT 1' in cql:
+            return [{'metric_timestamp': self._latest, 'duration_unit': 'milliseconds', 'rate_unit': 'seconds'}]
+
+        match = SELECT_RE.match(cql)
+        columns = tuple(column.strip() for column in match.group('columns').split(','))
+        key = (columns, _naive_utc(params[3]), _naive_utc(params[4]))
+
+        if key not in self._results:
+            self._results[key] = self.generate(columns, key[1], key[2])
+
+        return self._results[key]
+
+    def generate(self, columns, start, end) -> ColumnarRows:
+        """
+        Generates self.rows rows between start and end. Counts only go up, latencies are log normal with the odd spike,
+        and rates wander around a mean.
+        """
+        random = np.random.RandomState(self.seed)
+        span = max((end - start) / timedelta(seconds=1), 1)
+        offsets = np.linspace(0, span, self.rows, dtype=np.float64).astype('timedelta64[s]')
+        arrays = {'metric_timestamp': np.datetime64(start, 's') + offsets}
+        interval_counts = random.poisson(ROW_INTERVAL * 20, self.rows).astype(np.int64)
+        counts = np.cumsum(interval_counts)
+
+        for column in columns[1:]:
+            if column == 'count':
+                arrays[column] = counts
+            elif column == 'previous_count':
+                arrays[column] = counts - interval_counts
+            elif column == 'interval_count':
+                arrays[column] = interval_counts
+            elif column in RATE_COLUMNS:
+                arrays[column] = 20 + np.cumsum(random.normal(0, 0.1, self.rows))
+            else:
+                values = random.lognormal(3, 0.5, self.rows)
+                spikes = random.random_sample(self.rows) < 0.001
+                values[spikes] *= 20
+                arrays[column] = values
+
+        arrays['metric_timestamp'] = arrays['metric_timestamp'].astype('datetime64[ns]')
+
+        return ColumnarRows(list(columns), arrays)
@@ -0,0 +1,109 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from tests.benchmarks.conftest import benchmark_rows
+from metrics_server.data_frame_encoder import DataFrameEncoder
+
+START = datetime(2017, 1, 1, tzinfo=pytz.utc)
+ENVELOPE = {'environment': 'dev', 'application': 'app', 'table': 'raw_timer_with_interval', 'metric': 'metric'}
+
+
+def end_timestamp(rows):
+    # The synthetic rows are spread over whatever range is requested, this keeps them at the usual 15 second interval.
+    return START + timedelta(seconds=15 * rows)
+
+
+@pytest.mark.parametrize('rows', benchmark_rows())
+def test_get_metric_data_resampled(synthetic_app, benchmark, rows):
+    """
+    A dashboard chart, several timer measures down sampled to 1000 rows.
+    """
+    metrics_service = synthetic_app(rows).services['MetricsService']
+    columns = ['p99', 'p75', 'mean', 'max']
+
+    def run():
+        return metrics_service.get_metric_data('dev', 'app', 'raw_timer_with_interval', 'metric', columns, START,
+                                               end_timestamp(rows), 1000)
+
+    assert len(run()) < rows
+    benchmark(run, rows)
+
+
+@pytest.mark.parametrize('rows', benchmark_rows())
+def test_get_metric_data_interval_count(synthetic_app, benchmark, rows):
+    """
+    A counter chart, interval_count is calculated from count and previous_count and then down sampled.
+    """
+    metrics_service = synthetic_app(rows).services['MetricsService']
+
+    def run():
+        return metrics_service.get_metric_data('dev', 'app', 'raw_counter_with_interval', 'metric',
+                                               ['interval_count'], START, end_timestamp(rows), 1000)
+
+    assert list(run().columns) == ['metric_timestamp', 'interval_count']
+    benchmark(run, rows)
+
+
+@pytest.mark.parametrize('rows', benchmark_rows())
+def test_get_metric_data_raw(synthetic_app, benchmark, rows):
+    """
+    Every row is returned, nothing is down sampled.
+    """
+    metrics_service = synthetic_app(rows).services['MetricsService']
+
+    def run():
+        return metrics_service.get_metric_data('dev', 'app', 'raw_timer_with_interval', 'metric', ['p99'], START,
+                                               end_timestamp(rows), rows)
+
+    assert len(run()) == rows
+    benchmark(run, rows)
+
+
+@pytest.mark.parametrize('rows', benchmark_rows())
+def test_data_frame_encoder(synthetic_app, benchmark, rows):
+    """
+    Encoding rows for the default JSON response of the metric endpoint.
+    """
+    metrics_service = synthetic_app(rows).services['MetricsService']
+    df = metrics_service.get_metric_data('dev', 'app', 'raw_timer_with_interval', 'metric', ['p99', 'p75', 'mean'],
+                                         START, end_timestamp(rows), rows)
+
+    def run():
+        return json.dumps({'data': {**ENVELOPE, 'rows': df}}, cls=DataFrameEncoder)
+
+    benchmark(run, rows)
+
+
+@pytest.mark.parametrize('rows', benchmark_rows())
+def test_get_distinct_metrics_for_table(synthetic_app, benchmark, rows):
+    """
+    Scanning a table for its metrics, with one metric per 100 rows.
+    """
+    metrics = max(rows // 100, 1)
+    metrics_service = synthetic_app(rows, metrics).services['MetricsService']
+
+    def run():
+        return metrics_service.get_distinct_metrics_for_table('raw_timer_with_interval')
+
+    assert len(run()) == metrics
+    benchmark(run, metrics)
+
+
+@pytest.mark.parametrize('rows', benchmark_rows())
+def test_get_alert_data(synthetic_app, benchmark, rows):
+    """
+    Finding every breaching data point of an alert.
+    """
+    alerts_service = synthetic_app(rows).services['AlertsService']
+
+    def run():
+        return alerts_service.get_alert_data('dev', 'app', 'raw_timer_with_interval', 'metric', 'p99', 40, 80,
+                                             START, end_timestamp(rows))
+
+    warnings, errors = run()
+
+    assert len(errors) > 0
+    benchmark(run, rows)
@@ -0,0 +1,33 @@
+import logging
+import random
+
+from benchmarks.load import run_rate
+from benchmarks.replay import (
+    DEFAULT_MIX, InProcessServer, create_dashboards, list_metrics, parse_mix, request_factory, server_config
+)
+from metrics_server.seed_local_store import seed
+
+
+def test_replay(tmp_path, caplog):
+    """
+    Smoke tests the replay harness on a small local store: every kind of request succeeds and the server shuts down
+    without logging errors.
+
+    :param tmp_path: pytest fixture.
+    :param caplog: pytest fixture.
+    :return:
+    """
+    store = str(tmp_path / 'metrics.db')
+    seed(store, ['dev'], applications=1, metrics=2, days=1, interval=60)
+    config = server_config('METRICS_SERVER_THREADS=2', store, 1, 1)
+    caplog.set_level(logging.ERROR)
+
+    with InProcessServer(config) as server:
+        metrics = list_metrics(server.app)
+        create_dashboards(server.app, metrics, random.Random(42))
+        results = run_rate('127.0.0.1', server.port, request_factory(parse_mix(DEFAULT_MIX), metrics), 40, 1)
+
+    assert len(metrics) == 4
+    assert {name for name, _, _ in results} == {'dashboard', 'metric', 'alert', 'catalog'}
+    assert not any(error for _, _, error in results)
+    assert [record.getMessage() for record in caplog.records] == []
@@ -1,7 +1,9 @@
 import pytest
 
+from metrics_server.app import App
 from metrics_server.cassandra_service import CassandraService
 from metrics_server.metrics_service import MetricsService
+from tests.utils import MockPreparedStatement
 
 
 @pytest.fixture()
@@ -16,7 +18,10 @@ def patched_cs(mocker):
     """
     mocker.patch('metrics_server.cassandra_service.Cluster')
     config = {'cassandra': {'host': '0.0.0.0'}}
-    return CassandraService(config, {})
+    cs = CassandraService(config, {})
+    cs.session.prepare.side_effect = MockPreparedStatement
+
+    return cs
 
 
 @pytest.fixture()
@@ -30,3 +35,19 @@ def patched_ms(patched_cs):
     :return: MetricsService with patched Cassandra Cluster class.
     """
     return MetricsService({}, {'CassandraService': patched_cs})
+
+
+@pytest.fixture()
+def patched_app(mocker):
+    """
+    This fixture creates an App with the Cluster class patched, use its services to set return values on the mocked
+    session and its flask_app to make requests.
+
+    :param mocker: pytest.mock fixture.
+    :return: App with patched Cassandra Cluster class.
+    """
+    mocker.patch('metrics_server.cassandra_service.Cluster')
+    app = App({'cassandra': {'host': '0.0.0.0'}})
+    app.services['CassandraService'].session.prepare.side_effect = MockPreparedStatement
+
+    return app
@@ -0,0 +1,181 @@
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from metrics_server.alert_state_service import (
+    STATE_SELECT_CQL, STATE_UPDATE_CQL, TALLIES_INSERT_CQL, TALLIES_SELECT_CQL, AlertStateService, alert_id, tally
+)
+from metrics_server.alerts_service import AlertsService
+from metrics_server.dashboards_service import dashboard_range
+from tests.utils import columnar_result_set
+
+START = datetime(2017, 1, 1)
+METRIC = {'environment': 'dev', 'application': 'app', 'table': 'raw_timer_with_interval', 'metric_name': 'timer'}
+DASHBOARD = {
+    'name': 'alerts',
+    'data': {
+        'rangeMultiplier': 1,
+        'rangePeriod': 'hours',
+        'alerts': [
+            {'metric': dict(METRIC, measure='p99'), 'warning': 5, 'error': 10},
+            {'metric': dict(METRIC, measure=''), 'warning': 5, 'error': 10},
+        ],
+    },
+}
+
+
+class FakeTables:
+    """
+    Keeps the alert_state and alert_tallies tables in memory and answers the queries AlertStateService sends to them,
+    any other query returns data_rows.
+    """
+    def __init__(self):
+        self.watermarks = {}
+        self.tallies = {}
+        self.data_rows = []
+        self.data_queries = []
+
+    def execute(self, statement, params=None, **kwargs):
+        query = statement.query_string
+
+        if query == STATE_SELECT_CQL:
+            watermark = self.watermarks.get(params[0])
+            return [] if watermark is None else [{'watermark': watermark}]
+
+        if query == STATE_UPDATE_CQL:
+            self.watermarks[params[0]] = params[1]
+            return []
+
+        if query == TALLIES_SELECT_CQL:
+            rows = self.tallies.get(params[0], {})
+            return [dict(row, bucket=bucket) for bucket, row in sorted(rows.items()) if bucket >= params[1]]
+
+        if query == TALLIES_INSERT_CQL:
+            names = ['warnings', 'errors', 'first_warning', 'last_warning', 'first_error', 'last_error']
+            self.tallies.setdefault(params[0], {})[params[1]] = dict(zip(names, params[2:8]))
+            return []
+
+        self.data_queries.append((query, params))
+        return columnar_result_set([row for row in self.data_rows if params[3] <= row['metric_timestamp'] <= params[4]])
+
+    def execute_async(self, statement, params=None, **kwargs):
+        future = MagicMock()
+        future.result.return_value = self.execute(statement, params)
+
+        return future
+
+
+@pytest.fixture()
+def tables(patched_cs):
+    tables = FakeTables()
+    patched_cs.session.execute.side_effect = tables.execute
+    patched_cs.session.execute_async.side_effect = tables.execute_async
+
+    return tables
+
+
+@pytest.fixture()
+def alert_state_service(patched_cs, tables):
+    dashboards_service = MagicMock()
+    dashboards_service.get_dashboards.return_value = [DASHBOARD]
+    dashboards_service.get_dashboard.return_value = DASHBOARD
+    services = {'CassandraService': patched_cs, 'DashboardsService': dashboards_service}
+    services['AlertsService'] = AlertsService({}, services)
+
+    return AlertStateService({'alerts': {'lag_seconds': 0}}, services)
+
+
+def add_rows(tables, values, offset=0):
+    tables.data_rows += [
+        {'metric_timestamp': START + timedelta(seconds=30 * (offset + i)), 'p99': float(value)}
+        for i, value in enumerate(values)
+    ]
+
+
+def test_tally():
+    """
+    Tests that breaches are counted per bucket with the first and last breach of each level.
+
+    :return:
+    """
+    timestamps = np.array([START + timedelta(seconds=s) for s in (0, 20, 40, 70, 130)], dtype='datetime64[ns]')
+    tallies = tally(timestamps, np.array([1, 2, 1, 0, 2], dtype=np.int8), 60)
+
+    assert sorted(tallies) == [START, START + timedelta(minutes=2)]
+    assert tallies[START]['warnings'] == 2
+    assert tallies[START]['last_warning'] == START + timedelta(seconds=40)
+    assert tallies[START]['first_error'] == START + timedelta(seconds=20)
+    assert tallies[START + timedelta(minutes=2)]['warnings'] == 0
+    assert tallies[START + timedelta(minutes=2)]['errors'] == 1
+
+
+def test_dashboard_range():
+    """
+    Tests that the range of a dashboard is read whichever way round its range fields are saved.
+
+    :return:
+    """
+    # As created by createAlertDashboard.
+    assert dashboard_range({'rangePeriod': 1, 'rangeMultiplier': 'hours'}) == timedelta(hours=1)
+    assert dashboard_range({'rangePeriod': 3, 'rangeMultiplier': 'days'}) == timedelta(days=3)
+    # As saved by AlertDashboardDialog.
+    assert dashboard_range({'rangeMultiplier': 3, 'rangePeriod': 'days'}) == timedelta(days=3)
+    assert dashboard_range({'rangeMultiplier': 6, 'rangePeriod': 'hours'}) == timedelta(hours=6)
+    assert dashboard_range({'rangeMultiplier': 'days', 'rangePeriod': '2'}) == timedelta(days=2)
+    assert dashboard_range({'rangeMultiplier': '6', 'rangePeriod': 'hours'}) == timedelta(hours=6)
+    assert dashboard_range({'rangeMultiplier': '1.5', 'rangePeriod': 'days'}) == timedelta(days=1.5)
+    assert dashboard_range({}) == timedelta(hours=1)
+
+
+def test_run_once(alert_state_service, tables):
+    """
+    Tests that each run only evaluates new data points and adds them to the existing tallies.
+
+    :param alert_state_service: fixture
+    :param tables: fixture
+    :return:
+    """
+    add_rows(tables, [1, 6, 12, 7])
+    assert alert_state_service.run_once(now=START + timedelta(minutes=1, seconds=15)) == 1
+
+    key = alert_id(dict(METRIC, metric=METRIC['metric_name'], measure='p99', warning=5.0, error=10.0))
+    assert tables.watermarks[key] == START + timedelta(minutes=1, seconds=15)
+    assert tables.data_queries[0][1][3] == START - timedelta(minutes=59)
+    assert tables.tallies[key][START]['warnings'] == 1
+    assert tables.tallies[key][START + timedelta(minutes=1)] == {
+        'warnings': 0, 'errors': 1, 'first_warning': None, 'last_warning': None,
+        'first_error': START + timedelta(minutes=1), 'last_error': START + timedelta(minutes=1)
+    }
+
+    # The query starts at the watermark, the warning at 1:30 is added to the error already counted in its bucket.
+    add_rows(tables, [8, 20], offset=5)
+    alert_state_service.run_once(now=START + timedelta(minutes=3))
+
+    assert tables.data_queries[1][1][3] == START + timedelta(minutes=1, seconds=15)
+    assert tables.tallies[key][START + timedelta(minutes=1)]['warnings'] == 1
+    assert tables.tallies[key][START + timedelta(minutes=1)]['errors'] == 1
+    assert tables.tallies[key][START + timedelta(minutes=2)]['warnings'] == 1
+    assert tables.tallies[key][START + timedelta(minutes=3)]['errors'] == 1
+
+    state = alert_state_service.get_dashboard_state('alerts', now=START + timedelta(minutes=3))
+
+    assert state[0]['warnings'] == {
+        'count': 3, 'first': START + timedelta(seconds=30), 'last': START + timedelta(minutes=2, seconds=30)
+    }
+    assert state[0]['errors']['count'] == 2
+    assert state[0]['watermark'] == START + timedelta(minutes=3)
+    assert isinstance(state[1], ValueError)
+
+
+def test_get_dashboard_state_not_evaluated(alert_state_service):
+    """
+    Tests that alerts the worker hasn't evaluated yet are reported as errors instead of as having no breaches.
+
+    :param alert_state_service: fixture
+    :return:
+    """
+    state = alert_state_service.get_dashboard_state('alerts', now=START)
+
+    assert 'not been evaluated' in str(state[0])
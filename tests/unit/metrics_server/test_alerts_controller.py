@@ -0,0 +1,81 @@
+import json
+from datetime import datetime
+
+from metrics_server.app import App
+from tests.utils import MockResultSet, columnar_result_set
+
+
+def test_batch_dashboard(patched_app: App):
+    """
+    Tests that the alerts of a saved dashboard are evaluated in one request.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    metric = {
+        'environment': 'dev', 'application': 'app', 'table': 'raw_counter_with_interval', 'metric_name': 'metric',
+        'measure': 'count'
+    }
+    dashboard = {'alerts': [{'metric': metric, 'warning': 5, 'error': 10}, {'metric': None}]}
+    session.execute.return_value = MockResultSet([{'type': 'alert', 'name': 'ops', 'data': json.dumps(dashboard)}])
+    rows = [{'metric_timestamp': datetime(2017, 1, 1), 'count': 12}]
+    session.execute_async.return_value.result.return_value = columnar_result_set(rows)
+    body = {'dashboard': 'ops', 'start': '2017-01-01T00:00:00Z', 'end': '2017-01-02T00:00:00Z', 'mode': 'summary'}
+    resp = patched_app.flask_app.test_client().post('/api/v1/alerts/batch', json=body)
+    alerts = resp.get_json()['alerts']
+
+    assert resp.status_code == 200
+    assert alerts[0]['metric'] == 'metric'
+    assert alerts[0]['data']['errors']['count'] == 1
+    assert 'load_error' in alerts[1]
+
+
+def test_batch_missing_thresholds(patched_app: App):
+    """
+    Tests that an alert without thresholds fails on its own instead of failing the whole batch.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    rows = [{'metric_timestamp': datetime(2017, 1, 1), 'count': 12}]
+    session.execute_async.return_value.result.return_value = columnar_result_set(rows)
+    alert = {'environment': 'dev', 'application': 'app', 'table': 'raw_counter_with_interval', 'metric': 'metric',
+             'measure': 'count'}
+    body = {
+        'alerts': [{**alert, 'warning': 5, 'error': 10}, {**alert, 'warning': None, 'error': None}],
+        'start': '2017-01-01T00:00:00Z', 'end': '2017-01-02T00:00:00Z', 'mode': 'summary',
+    }
+    resp = patched_app.flask_app.test_client().post('/api/v1/alerts/batch', json=body)
+    alerts = resp.get_json()['alerts']
+
+    assert resp.status_code == 200
+    assert alerts[0]['data']['errors']['count'] == 1
+    assert alerts[1]['load_error'] == 'Alert is not completely configured'
+
+
+def test_batch_invalid(patched_app: App):
+    """
+    Tests that exactly one of dashboard or alerts must be given.
+
+    :param patched_app: fixture
+    :return:
+    """
+    body = {'start': '2017-01-01T00:00:00Z', 'end': '2017-01-02T00:00:00Z'}
+    resp = patched_app.flask_app.test_client().post('/api/v1/alerts/batch', json=body)
+
+    assert resp.status_code == 400
+
+
+def test_dashboard_state_not_found(patched_app: App):
+    """
+    Tests that asking for the state of a dashboard that doesn't exist is a 404.
+
+    :param patched_app: fixture
+    :return:
+    """
+    patched_app.services['CassandraService'].session.execute.return_value = MockResultSet([])
+    resp = patched_app.flask_app.test_client().get('/api/v1/alerts/dashboards/missing/state')
+
+    assert resp.status_code == 404
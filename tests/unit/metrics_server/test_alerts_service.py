@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from metrics_server.alerts_service import AlertsService, alert_episodes, classify
+from tests.utils import columnar_result_set
+
+START = datetime(2017, 1, 1)
+
+
+@pytest.fixture()
+def alerts_service(patched_cs):
+    return AlertsService({}, {'CassandraService': patched_cs})
+
+
+def set_rows(alerts_service, values):
+    rows = [
+        {'metric_timestamp': START + timedelta(minutes=i), 'count': value, 'previous_count': 0}
+        for i, value in enumerate(values)
+    ]
+    alerts_service.session.execute.return_value = columnar_result_set(rows)
+
+
+def get_alert(alerts_service, mode):
+    return alerts_service.get_alert('dev', 'app', 'raw_counter_with_interval', 'metric', 'interval_count', 5, 10,
+                                    START, START + timedelta(hours=1), mode)
+
+
+def test_classify():
+    """
+    Tests that values are classified against both thresholds and that NaN never breaches.
+
+    :return:
+    """
+    levels = classify(np.array([1.0, 5.0, 9.9, 10.0, 50.0, np.nan]), 5, 10)
+
+    assert levels.tolist() == [0, 1, 1, 2, 2, 0]
+
+
+def test_get_alert_points(alerts_service):
+    """
+    Tests that the points mode returns every breaching data point.
+
+    :param alerts_service: fixture
+    :return:
+    """
+    set_rows(alerts_service, [1, 6, 12, 1])
+    result = get_alert(alerts_service, 'points')
+
+    assert result['warnings'] == [{'interval_count': 6, 'metric_timestamp': START + timedelta(minutes=1)}]
+    assert result['errors'] == [{'interval_count': 12, 'metric_timestamp': START + timedelta(minutes=2)}]
+
+
+def test_get_alert_summary(alerts_service):
+    """
+    Tests that the summary mode only returns counts and the first and last breach times.
+
+    :param alerts_service: fixture
+    :return:
+    """
+    set_rows(alerts_service, [6, 1, 12, 7, 11, 1])
+    result = get_alert(alerts_service, 'summary')
+
+    assert result['warnings'] == {'count': 2, 'first': START, 'last': START + timedelta(minutes=3)}
+    assert result['errors'] == {
+        'count': 2, 'first': START + timedelta(minutes=2), 'last': START + timedelta(minutes=4)
+    }
+
+    set_rows(alerts_service, [])
+    result = get_alert(alerts_service, 'summary')
+    assert result['errors'] == {'count': 0, 'first': None, 'last': None}
+
+
+def test_get_alert_episodes(alerts_service):
+    """
+    Tests that consecutive breaches are merged into episodes, including runs at the start and end of the range.
+
+    :param alerts_service: fixture
+    :return:
+    """
+    set_rows(alerts_service, [6, 1, 6, 12, 7, 1, 8])
+    episodes = get_alert(alerts_service, 'episodes')['episodes']
+
+    assert [(episode['level'], episode['count'], episode['peak']) for episode in episodes] == [
+        ('warning', 1, 6), ('error', 3, 12), ('warning', 1, 8)
+    ]
+    assert episodes[1]['start'] == START + timedelta(minutes=2)
+    assert episodes[1]['end'] == START + timedelta(minutes=4)
+    assert episodes[1]['peak_timestamp'] == START + timedelta(minutes=3)
+    assert alert_episodes(np.zeros(0, dtype='datetime64[ns]'), np.zeros(0), np.zeros(0, dtype=np.int8)) == []
+
+
+def test_get_alerts_batch(alerts_service):
+    """
+    Tests that alerts on the same metric share one query and that bad alerts don't fail the others.
+
+    :param alerts_service: fixture
+    :return:
+    """
+    rows = [
+        {'metric_timestamp': START + timedelta(minutes=i), 'count': 10 * i, 'previous_count': 0, 'p99': float(i)}
+        for i in range(3)
+    ]
+    alerts_service.session.execute_async.return_value.result.return_value = columnar_result_set(rows)
+    timer = {'environment': 'dev', 'application': 'app', 'table': 'raw_timer_with_interval', 'metric': 'timer'}
+    alerts = [
+        dict(timer, measure='interval_count', warning=5, error=15),
+        dict(timer, measure='p99', warning=1, error=2),
+        dict(timer, metric='other', measure='p99', warning=1, error=2),
+        dict(timer, measure='not_a_column', warning=1, error=2),
+        dict(timer, measure=None, warning=1, error=2),
+    ]
+    results = alerts_service.get_alerts_batch(alerts, START, START + timedelta(hours=1), 'summary')
+    queries = [call[0][0].query_string for call in alerts_service.session.execute_async.call_args_list]
+
+    assert len(queries) == 2
+    assert queries[0].startswith('SELECT metric_timestamp, count, previous_count, p99 FROM raw_timer_with_interval')
+    assert results[0]['warnings']['count'] == 1
+    assert results[0]['errors']['count'] == 1
+    assert results[1]['errors']['count'] == 1
+    assert results[2] == results[1]
+    assert 'not_a_column' in str(results[3])
+    assert isinstance(results[4], ValueError)
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import threading
+from datetime import datetime
+
+from metrics_server.app import App
+from metrics_server.asgi import AsgiApp
+from metrics_server.cache import SingleFlight
+from tests.utils import MockPreparedStatement, MockResponseFuture, MockResultSet, columnar_result_set
+
+
+async def call_async(asgi_app, method, path, query_string=b'', body=b'', headers=()):
+    """
+    Sends a single HTTP request to an ASGI app from a running event loop.
+
+    :return: tuple of (status, headers dict, body)
+    """
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query_string, 'http_version': '1.1',
+        'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi_app(scope, receive, send)
+    start, content = messages
+
+    return start['status'], {k.decode(): v.decode() for k, v in start['headers']}, content['body']
+
+
+def call(asgi_app, method, path, query_string=b'', body=b'', headers=()):
+    """
+    Sends a single HTTP request to an ASGI app.
+
+    :return: tuple of (status, headers dict, body)
+    """
+    return asyncio.run(call_async(asgi_app, method, path, query_string, body, headers))
+
+
+def test_metric(patched_app: App):
+    """
+    Tests that natively handled routes await the query and return the same JSON as the Flask app.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    rows = [{'metric_timestamp': datetime(2017, 1, 1, 0, 0, i), 'p99': float(i)} for i in range(3)]
+    session.execute.side_effect = lambda *args, **kwargs: columnar_result_set(rows)
+    session.execute_async.side_effect = lambda *args, **kwargs: MockResponseFuture(columnar_result_set(rows))
+    asgi_app = AsgiApp(patched_app)
+    path = '/api/v1/metrics/raw_timer_with_interval/dev/app/metric'
+    expected = patched_app.flask_app.test_client().get(path + '?columns=p99').get_json()
+    status, headers, content = call(asgi_app, 'GET', path, b'columns=p99')
+
+    assert status == 200
+    assert headers['content-type'] == 'application/json'
+    assert headers['vary'] == 'Accept'
+    assert json.loads(content) == expected
+    assert session.execute_async.call_count == 1
+
+    status, _, content = call(asgi_app, 'GET', path)
+    assert status == 400
+    assert json.loads(content) == {'error': 'You must specify at least one column'}
+
+    status, _, _ = call(asgi_app, 'GET', path, b'columns=not_a_column')
+    assert status == 404
+
+
+def test_metric_prepares_off_the_event_loop(patched_app: App):
+    """
+    Tests that statements are prepared on the thread pool, preparing blocks on a round trip to Cassandra.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    rows = [{'metric_timestamp': datetime(2017, 1, 1), 'p99': 1.0}]
+    session.execute_async.side_effect = lambda *args, **kwargs: MockResponseFuture(columnar_result_set(rows))
+    threads = []
+
+    def prepare(cql):
+        threads.append(threading.current_thread())
+        return MockPreparedStatement(cql)
+
+    session.prepare.side_effect = prepare
+    asgi_app = AsgiApp(patched_app)
+    body = json.dumps({'series': [{'environment': 'dev', 'application': 'app', 'table': 'raw_timer_with_interval',
+                                   'metric': 'other', 'columns': ['p75']}]}).encode('utf-8')
+    status, _, _ = call(asgi_app, 'GET', '/api/v1/metrics/raw_timer_with_interval/dev/app/metric', b'columns=p99')
+    assert status == 200
+    status, _, _ = call(asgi_app, 'POST', '/api/v1/metrics/batch', body=body,
+                        headers=[('content-type', 'application/json')])
+    assert status == 200
+
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+
+
+class PendingResponseFuture(MockResponseFuture):
+    """
+    A ResponseFuture that only completes when complete() is called.
+    """
+    def __init__(self, result):
+        super().__init__(result)
+        self.callbacks = []
+
+    def add_callbacks(self, callback, errback):
+        self.callbacks.append((callback, errback))
+
+    def complete(self):
+        for callback, errback in self.callbacks:
+            super().add_callbacks(callback, errback)
+
+
+def test_metric_coalesced(patched_app: App):
+    """
+    Tests that identical metric requests in flight at the same time share one query, more of them than there are
+    threads in the pool.
+
+    :param patched_app: fixture
+    :return:
+    """
+    metrics_service = patched_app.services['MetricsService']
+    metrics_service.single_flight = SingleFlight(5)
+    rows = [{'metric_timestamp': datetime(2017, 1, 1, 0, 0, i), 'p99': float(i)} for i in range(3)]
+    futures = []
+
+    def execute_async(*args, **kwargs):
+        futures.append(PendingResponseFuture(columnar_result_set(rows)))
+        return futures[-1]
+
+    metrics_service.session.execute_async.side_effect = execute_async
+    asgi_app = AsgiApp(patched_app, threads=2)
+    path = '/api/v1/metrics/raw_timer_with_interval/dev/app/metric'
+    query_string = b'columns=p99&start_timestamp=2017-01-01T00:00:00Z&end_timestamp=2017-01-01T01:00:00Z'
+
+    async def requests():
+        calls = asyncio.gather(*[call_async(asgi_app, 'GET', path, query_string) for _ in range(5)])
+
+        while metrics_service.single_flight.stats()['coalesced'] < 4:
+            await asyncio.sleep(0.01)
+
+        futures[0].complete()
+
+        return await calls
+
+    responses = asyncio.run(requests())
+
+    assert len(futures) == 1
+    assert [status for status, _, _ in responses] == [200] * 5
+    assert len({content for _, _, content in responses}) == 1
+    assert json.loads(responses[0][2])['data']['rows'][2][1] == 2.0
+    assert metrics_service.coalesce_stats()['flights'] == 1
+
+
+def test_batch(patched_app: App):
+    """
+    Tests that a failed series doesn't fail the others.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    results = [
+        MockResponseFuture(columnar_result_set([{'metric_timestamp': datetime(2017, 1, 1), 'count': 100}])),
+        MockResponseFuture(RuntimeError('timed out')),
+    ]
+    session.execute_async.side_effect = results
+    spec = {'environment': 'dev', 'application': 'app', 'table': 'raw_counter_with_interval', 'metric': 'metric'}
+    body = {'series': [{**spec, 'columns': ['count']}, {**spec, 'metric': 'other', 'columns': ['count']}]}
+    status, _, content = call(AsgiApp(patched_app), 'POST', '/api/v1/metrics/batch', body=json.dumps(body).encode())
+    series = json.loads(content)['data']['series']
+
+    assert status == 200
+    assert series[0]['rows'][0][1] == 100
+    assert series[1]['error'] == 'timed out'
+
+
+def test_flask_routes(patched_app: App):
+    """
+    Tests that every other route is served by the Flask app.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    session.execute.return_value = MockResultSet([{'type': 'time_series', 'name': 'ops', 'data': '{}'}])
+    status, headers, content = call(AsgiApp(patched_app), 'GET', '/api/v1/dashboards/time_series/ops')
+
+    assert status == 200
+    assert 'etag' in headers
+    assert json.loads(content)['dashboard']['name'] == 'ops'
+
+    status, _, _ = call(AsgiApp(patched_app), 'GET', '/api/v1/not_a_route')
+    assert status == 404
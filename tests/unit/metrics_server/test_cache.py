@@ -0,0 +1,184 @@
+import threading
+import time
+
+import pytest
+
+from metrics_server.cache import LRUCache, SingleFlight
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction():
+    """
+    Tests that the least recently used entry is evicted when the cache is full.
+
+    :return:
+    """
+    cache = LRUCache(2)
+    cache.put('a', 1, 60)
+    cache.put('b', 2, 60)
+    cache.get('a')
+    cache.put('c', 3, 60)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_weigher():
+    """
+    Tests that entries are evicted based on their weight, and that entries bigger than the cache are not stored.
+
+    :return:
+    """
+    cache = LRUCache(10, weigher=len)
+    cache.put('a', 'aaaaaa', 60)
+    cache.put('b', 'bbbbbb', 60)
+
+    assert cache.get('a') is None
+    assert cache.size == 6
+
+    cache.put('c', 'c' * 11, 60)
+
+    assert cache.get('c') is None
+    assert cache.get('b') == 'bbbbbb'
+
+
+def test_ttl():
+    """
+    Tests that entries expire after their ttl, and that hits, misses and expirations are counted.
+
+    :return:
+    """
+    clock = FakeClock()
+    cache = LRUCache(10, clock=clock)
+    cache.put('short', 1, 5)
+    cache.put('long', 2, 500)
+    clock.now = 10
+
+    assert cache.get('short') is None
+    assert cache.get('long') == 2
+
+    stats = cache.stats()
+
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['expirations'] == 1
+    assert stats['entries'] == 1
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out waiting for condition'
+        time.sleep(0.001)
+
+
+def run_concurrently(fn, count):
+    """
+    Calls fn from count threads, returns what each call returned or raised.
+    """
+    results = [None] * count
+
+    def run(idx):
+        try:
+            results[idx] = fn()
+        except Exception as e:
+            results[idx] = e
+
+    threads = [threading.Thread(target=run, args=(idx,)) for idx in range(count)]
+
+    for thread in threads:
+        thread.start()
+
+    return threads, results
+
+
+def test_single_flight_coalesces():
+    """
+    Tests that concurrent calls for the same key run the function once and share its result, and that the next call
+    after the flight lands runs it again.
+
+    :return:
+    """
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return object()
+
+    threads, results = run_concurrently(lambda: single_flight.do('key', fn), 5)
+    wait_for(lambda: single_flight.stats()['coalesced'] == 4)
+    release.set()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert single_flight.stats() == {'flights': 1, 'coalesced': 4, 'errors': 0, 'timeouts': 0, 'in_flight': 0}
+
+    assert single_flight.do('key', fn) is not results[0]
+    assert len(calls) == 2
+
+
+def test_single_flight_error():
+    """
+    Tests that the leader's exception is raised to every waiter and that the key can be retried afterwards.
+
+    :return:
+    """
+    single_flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError('Query failed')
+
+    threads, results = run_concurrently(lambda: single_flight.do('key', fn), 3)
+    wait_for(lambda: single_flight.stats()['coalesced'] == 2)
+    release.set()
+
+    for thread in threads:
+        thread.join()
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert single_flight.stats()['errors'] == 1
+    assert single_flight.do('key', lambda: 1) == 1
+
+
+def test_single_flight_timeout():
+    """
+    Tests that waiters give up after the timeout without affecting the leader.
+
+    :return:
+    """
+    single_flight = SingleFlight(timeout=0.01)
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        return 1
+
+    threads, results = run_concurrently(lambda: single_flight.do('key', fn), 1)
+    wait_for(lambda: single_flight.stats()['in_flight'] == 1)
+
+    with pytest.raises(TimeoutError):
+        single_flight.do('key', fn)
+
+    release.set()
+    threads[0].join()
+
+    assert results == [1]
+    assert single_flight.stats()['timeouts'] == 1
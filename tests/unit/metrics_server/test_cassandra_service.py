@@ -1,6 +1,9 @@
+from unittest import mock
+
 import pytest
+from cassandra.cluster import EXEC_PROFILE_DEFAULT
 
-from metrics_server.cassandra_service import CassandraService
+from metrics_server.cassandra_service import COLUMNAR_PROFILE, CassandraService, execute_concurrently
 from metrics_server.errors import ConfigurationError
 
 
@@ -33,3 +36,112 @@ def test_no_host():
     """
     with pytest.raises(ConfigurationError):
         CassandraService({'cassandra': {}}, {})
+
+
+def test_execute_concurrently():
+    """
+    Tests that execute_concurrently never has more than concurrency queries in flight, and returns results and
+    exceptions in order.
+
+    :return:
+    """
+    in_flight = []
+    max_in_flight = []
+
+    def execute_async(statement, params):
+        in_flight.append(params)
+        max_in_flight.append(len(in_flight))
+        future = mock.Mock()
+
+        def result():
+            in_flight.remove(params)
+
+            if params == 3:
+                raise ValueError('bad params')
+
+            return params * 10
+
+        future.result.side_effect = result
+
+        return future
+
+    session = mock.Mock()
+    session.execute_async.side_effect = execute_async
+    results = execute_concurrently(session, 'statement', list(range(10)), concurrency=4)
+
+    assert max(max_in_flight) == 4
+    assert len(in_flight) == 0
+    assert isinstance(results[3], ValueError)
+    assert [result for idx, result in enumerate(results) if idx != 3] == [0, 10, 20, 40, 50, 60, 70, 80, 90]
+
+
+def test_prepare(patched_cs):
+    """
+    Tests that statements are prepared once and then reused.
+
+    :param patched_cs: fixture.
+    :return:
+    """
+    statement = patched_cs.prepare('SELECT * FROM dashboards WHERE type = ?')
+
+    assert patched_cs.prepare('SELECT * FROM dashboards WHERE type = ?') is statement
+    assert patched_cs.session.prepare.call_count == 1
+
+    paged = patched_cs.prepare('SELECT * FROM dashboards WHERE type = ?', fetch_size=100)
+
+    assert paged is not statement
+    assert paged.fetch_size == 100
+    assert patched_cs.prepared_count == 2
+
+
+def test_cluster_settings(mocker):
+    """
+    Tests that the cassandra settings are passed on to the driver, including values read from environment variables.
+
+    :param mocker: pytest.mock fixture.
+    :return:
+    """
+    cluster = mocker.patch('metrics_server.cassandra_service.Cluster')
+    config = {'cassandra': {
+        'host': 'node1, node2', 'port': '9043', 'local_dc': 'dc1', 'executor_threads': 4, 'request_timeout': 5,
+        'metrics_request_timeout': '30', 'speculative_execution': {'delay': 0.2},
+    }}
+    CassandraService(config, {})
+    args, kwargs = cluster.call_args
+    profiles = kwargs['execution_profiles']
+    columnar = profiles[COLUMNAR_PROFILE]
+
+    assert args[0] == ['node1', 'node2']
+    assert kwargs['port'] == 9043
+    assert kwargs['executor_threads'] == 4
+    assert kwargs['compression'] is False
+    assert profiles[EXEC_PROFILE_DEFAULT].request_timeout == 5.0
+    assert columnar.request_timeout == 30.0
+    assert columnar.load_balancing_policy._child_policy.local_dc == 'dc1'
+    assert columnar.speculative_execution_policy.delay == 0.2
+    assert columnar.speculative_execution_policy.max_attempts == 2
+
+
+@pytest.mark.parametrize('settings,expected', [
+    ({'hosts': []}, 'No host value'),
+    ({'port': 'abc'}, 'cassandra.port must be a number'),
+    ({'port': 70000}, 'cassandra.port must be at most 65535'),
+    ({'executor_threads': 0}, 'cassandra.executor_threads must be at least 1'),
+    ({'compression': 'gzip'}, 'cassandra.compression must be one of'),
+    ({'connections_per_host': 4}, 'requires cassandra.protocol_version 1 or 2'),
+    ({'request_timeout': -1}, 'cassandra.request_timeout must be at least'),
+    ({'speculative_execution': {'max_attempts': 0}}, 'cassandra.speculative_execution.max_attempts must be at least 1'),
+])
+def test_invalid_settings(mocker, settings, expected):
+    """
+    Tests that invalid cassandra settings raise a ConfigurationError explaining what is wrong.
+
+    :param mocker: pytest.mock fixture.
+    :return:
+    """
+    mocker.patch('metrics_server.cassandra_service.Cluster')
+
+    with pytest.raises(ConfigurationError) as exc_info:
+        CassandraService({'cassandra': {'host': '0.0.0.0', **settings}}, {})
+
+    assert expected in str(exc_info.value)
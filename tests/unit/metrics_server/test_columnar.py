@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from metrics_server.columnar import ColumnarRows, as_columnar, columnar_factory
+
+TEST_DATE = datetime(2017, 1, 1)
+
+
+def test_columnar_factory_dtypes():
+    """
+    Tests that the columnar factory picks the correct dtype for timestamps, integers, floats, and strings.
+
+    :return:
+    """
+    rows = [
+        (TEST_DATE, 100, 1.5, 'milliseconds'),
+        (TEST_DATE + timedelta(seconds=5), 104, 2.5, 'milliseconds'),
+    ]
+    result = columnar_factory(['metric_timestamp', 'count', 'p99', 'duration_unit'], rows)
+
+    assert len(result) == 2
+    assert result['metric_timestamp'].dtype.kind == 'M'
+    assert result['count'].dtype == np.int64
+    assert result['p99'].dtype == np.float64
+    assert result['duration_unit'].dtype == object
+
+
+def test_columnar_factory_nulls():
+    """
+    Tests that null values in numeric columns become NaN and null timestamps become NaT.
+
+    :return:
+    """
+    rows = [(TEST_DATE, 100), (None, None)]
+    result = columnar_factory(['metric_timestamp', 'count'], rows)
+
+    assert result['count'].dtype == np.float64
+    assert np.isnan(result['count'][1])
+    assert np.isnat(result['metric_timestamp'][1])
+
+
+def test_as_columnar_empty():
+    """
+    ResultSet.current_rows returns an empty list for empty results, make sure we turn that into ColumnarRows.
+
+    :return:
+    """
+    result = as_columnar([], ['metric_timestamp', 'count'])
+
+    assert isinstance(result, ColumnarRows)
+    assert len(result) == 0
+    assert len(result['count']) == 0
+
+
+def test_to_data_frame():
+    """
+    Tests that to_data_frame sets the index and preserves column order.
+
+    :return:
+    """
+    rows = [(TEST_DATE, 100, 90), (TEST_DATE + timedelta(seconds=5), 104, 100)]
+    result = columnar_factory(['metric_timestamp', 'count', 'previous_count'], rows)
+    df = result.to_data_frame(index='metric_timestamp')
+
+    assert list(df.columns) == ['count', 'previous_count']
+    assert df.index.name == 'metric_timestamp'
+    assert list(df['count']) == [100, 104]
+    assert list(result) == [
+        {'metric_timestamp': TEST_DATE, 'count': 100, 'previous_count': 90},
+        {'metric_timestamp': TEST_DATE + timedelta(seconds=5), 'count': 104, 'previous_count': 100},
+    ]
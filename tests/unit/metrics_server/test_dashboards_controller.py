@@ -0,0 +1,125 @@
+import json
+from datetime import datetime
+
+import pytz
+
+from metrics_server.app import App
+from tests.utils import MockPreparedStatement, MockResultSet, columnar_result_set
+
+
+def set_dashboards(patched_app: App, dashboards):
+    rows = [{'type': 'time_series', 'name': name, 'data': json.dumps(data)} for name, data in dashboards.items()]
+    patched_app.services['CassandraService'].session.execute.return_value = MockResultSet(rows)
+
+
+def test_dashboards_etag(patched_app: App):
+    """
+    Tests that dashboards are not cached by default, but a matching If-None-Match still gets a 304.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    client = patched_app.flask_app.test_client()
+    set_dashboards(patched_app, {'ops': {'graphs': []}})
+    etag = client.get('/api/v1/dashboards/time_series').headers['ETag']
+    resp = client.get('/api/v1/dashboards/time_series', headers={'If-None-Match': etag})
+
+    assert patched_app.services['DashboardsService'].cache is None
+    assert resp.status_code == 304
+    assert session.execute.call_count == 2
+
+
+def test_dashboards_cached(mocker):
+    """
+    Tests that with cache_ttl set dashboards are cached with an ETag, that a matching If-None-Match gets a 304 without
+    querying Cassandra, and that writes invalidate the cache.
+
+    :param mocker: pytest.mock fixture.
+    :return:
+    """
+    mocker.patch('metrics_server.cassandra_service.Cluster')
+    patched_app = App({'cassandra': {'host': '0.0.0.0'}, 'dashboards': {'cache_ttl': 60}})
+    patched_app.services['CassandraService'].session.prepare.side_effect = MockPreparedStatement
+    session = patched_app.services['CassandraService'].session
+    client = patched_app.flask_app.test_client()
+    set_dashboards(patched_app, {'ops': {'graphs': []}})
+    resp = client.get('/api/v1/dashboards/time_series')
+    etag = resp.headers['ETag']
+
+    assert resp.status_code == 200
+    assert resp.get_json()['dashboards'][0]['name'] == 'ops'
+    assert session.execute.call_count == 1
+
+    resp = client.get('/api/v1/dashboards/time_series', headers={'If-None-Match': etag})
+
+    assert resp.status_code == 304
+    assert resp.data == b''
+    assert session.execute.call_count == 1
+
+    # The update reads the dashboard to check it exists, then writes it.
+    set_dashboards(patched_app, {'ops': {'graphs': [1]}})
+    assert client.put('/api/v1/dashboards/time_series/ops', json={'data': {'graphs': [1]}}).status_code == 200
+    assert session.execute.call_count == 3
+
+    resp = client.get('/api/v1/dashboards/time_series', headers={'If-None-Match': etag})
+
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert session.execute.call_count == 4
+
+
+def test_dashboard_not_found(patched_app: App):
+    """
+    Tests that missing dashboards are a 404 and are not cached.
+
+    :param patched_app: fixture
+    :return:
+    """
+    client = patched_app.flask_app.test_client()
+    set_dashboards(patched_app, {})
+
+    assert client.get('/api/v1/dashboards/time_series/ops').status_code == 404
+
+    set_dashboards(patched_app, {'ops': {}})
+    resp = client.get('/api/v1/dashboards/time_series/ops')
+
+    assert resp.status_code == 200
+    assert resp.headers['Cache-Control'] == 'no-cache'
+
+
+def test_render_dashboard(patched_app: App):
+    """
+    Tests that every series of a dashboard is returned in one response, with series on the same metric sharing a query.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    timer = {'environment': 'dev', 'application': 'app', 'table': 'raw_timer_with_interval', 'metric_name': 'timer'}
+    chart = {
+        'rangeType': 'fixed', 'startDate': '2017-01-01T00:00:00Z', 'endDate': '2017-01-01T01:00:00Z',
+        'metrics': [dict(timer, measure='p99'), dict(timer, measure='p75'), dict(timer, measure='interval_count'),
+                    dict(timer, measure='')],
+    }
+    set_dashboards(patched_app, {'ops': {'charts': [chart]}})
+    rows = [
+        {'metric_timestamp': datetime(2017, 1, 1, minute=i), 'p99': 2.0 * i, 'p75': float(i), 'count': 10 * i,
+         'previous_count': 0}
+        for i in range(3)
+    ]
+    session.execute_async.return_value.result.return_value = columnar_result_set(rows)
+    resp = patched_app.flask_app.test_client().get('/api/v1/dashboards/time_series/ops/render?size=100')
+    body = resp.get_json()
+    series = body['charts'][0]['series']
+    queries = [call[0][0].query_string for call in session.execute_async.call_args_list]
+
+    assert resp.status_code == 200
+    assert body['dashboard']['name'] == 'ops'
+    assert len(queries) == 2
+    assert queries[0].startswith('SELECT metric_timestamp, p99, p75 FROM raw_timer_with_interval')
+    assert session.execute_async.call_args_list[0][0][1][3] == datetime(2017, 1, 1, tzinfo=pytz.utc)
+    assert [row[1] for row in series[0]['rows']] == [0.0, 2.0, 4.0]
+    assert [row[1] for row in series[1]['rows']] == [0.0, 1.0, 2.0]
+    assert [row[1] for row in series[2]['rows']] == [0, 10, 20]
+    assert 'error' in series[3]
@@ -0,0 +1,187 @@
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask, jsonify
+from metrics_server.data_frame_encoder import (
+    DataFrameEncoder, format_timestamps, get_json_encoder, iter_json_envelope, iter_json_rows, read_columnar_binary,
+    to_columnar_binary, to_columnar_json
+)
+from metrics_server.errors import ConfigurationError
+
+
+def make_data_frame(missing_timestamp=None):
+    index = pd.DatetimeIndex([
+        '2017-01-01T00:00:00', '2017-01-01T00:00:05.250', missing_timestamp or '2017-01-01T00:00:10',
+        '2017-01-01T00:00:15'
+    ], name='metric_timestamp').tz_localize('UTC')
+    df = pd.DataFrame({'count': [1, 2, 3, 4], 'p99': [1.5, np.nan, 2.5, 3.0]}, index=index)
+
+    return df.reset_index()
+
+
+def test_format_timestamps():
+    """
+    Tests that vectorized timestamp formatting matches Timestamp.isoformat.
+
+    :return:
+    """
+    df = make_data_frame(missing_timestamp=pd.NaT)
+    expected = [None if pd.isnull(ts) else ts.isoformat() for ts in df['metric_timestamp']]
+
+    assert format_timestamps(df['metric_timestamp'].values) == expected
+
+
+def test_iter_json_rows():
+    """
+    Tests that the batched row encoder produces ISO 8601 timestamps and null for NaN.
+
+    :return:
+    """
+    df = make_data_frame()
+    chunks = list(iter_json_rows(df, batch_size=3))
+
+    assert len(chunks) == 2
+    assert json.loads(f'[{", ".join(chunks)}]') == [
+        ['2017-01-01T00:00:00+00:00', 1, 1.5],
+        ['2017-01-01T00:00:05.250000+00:00', 2, None],
+        ['2017-01-01T00:00:10+00:00', 3, 2.5],
+        ['2017-01-01T00:00:15+00:00', 4, 3.0],
+    ]
+
+
+def test_iter_json_envelope():
+    """
+    Tests that the streamed envelope is valid JSON containing the envelope keys and the rows.
+
+    :return:
+    """
+    df = make_data_frame()
+    encoded = ''.join(iter_json_envelope({'metric': 'foo'}, 'rows', df, batch_size=1))
+    decoded = json.loads(encoded)
+
+    assert decoded['metric'] == 'foo'
+    assert len(decoded['rows']) == 4
+    assert decoded['rows'][1] == ['2017-01-01T00:00:05.250000+00:00', 2, None]
+    assert json.loads(''.join(iter_json_envelope({}, 'rows', df.iloc[0:0]))) == {'rows': []}
+
+
+def test_to_columnar_json():
+    """
+    Tests that the columnar encoder produces one list per column with integer epoch millisecond timestamps.
+
+    :return:
+    """
+    df = make_data_frame(missing_timestamp=pd.NaT)
+    encoded = to_columnar_json({'metric': 'foo'}, df)
+    decoded = json.loads(encoded)
+
+    assert '1483228800000,' in encoded
+    assert decoded['metric'] == 'foo'
+    assert decoded['length'] == 4
+    assert decoded['columns'] == [
+        {'name': 'metric_timestamp', 'values': [1483228800000, 1483228805250, None, 1483228815000]},
+        {'name': 'count', 'values': [1, 2, 3, 4]},
+        {'name': 'p99', 'values': [1.5, None, 2.5, 3.0]},
+    ]
+
+
+def test_to_columnar_binary():
+    """
+    Tests that the binary encoder round trips and that every buffer is 8 byte aligned.
+
+    :return:
+    """
+    df = make_data_frame()
+    payload = to_columnar_binary({'metric': 'foo'}, df)
+    header, columns = read_columnar_binary(payload)
+
+    assert header['metric'] == 'foo'
+    assert header['length'] == 4
+    assert [column['name'] for column in header['columns']] == ['metric_timestamp', 'count', 'p99']
+    assert (len(payload) - sum(column['nbytes'] for column in header['columns'])) % 8 == 0
+    assert columns['metric_timestamp'].tolist() == [1483228800000, 1483228805250, 1483228810000, 1483228815000]
+    assert columns['count'].tolist() == [1, 2, 3, 4]
+    assert np.isnan(columns['p99'][1])
+
+
+@pytest.mark.parametrize('backend', ['json', 'orjson'])
+def test_data_frame_encoder(backend):
+    """
+    Tests that both JSON backends encode a nested DataFrame as rows with ISO 8601 timestamps and null for NaN and NaT.
+
+    :return:
+    """
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+
+    encoder = get_json_encoder(backend)
+    df = make_data_frame(missing_timestamp=pd.NaT)
+    decoded = json.loads(json.dumps({'data': {'rows': df}}, cls=encoder, sort_keys=True))
+
+    assert decoded['data']['rows'] == [
+        ['2017-01-01T00:00:00+00:00', 1, 1.5],
+        ['2017-01-01T00:00:05.250000+00:00', 2, None],
+        [None, 3, 2.5],
+        ['2017-01-01T00:00:15+00:00', 4, 3.0],
+    ]
+
+
+def jsonify_with(backend, **kwargs):
+    flask_app = Flask(__name__)
+    flask_app.json_encoder = get_json_encoder(backend)
+
+    with flask_app.app_context():
+        return jsonify(**kwargs).get_json()
+
+
+@pytest.mark.parametrize('backend', ['json', 'orjson'])
+def test_data_frame_encoder_jsonify(backend):
+    """
+    Tests that Flask uses the encoder's default for DataFrames, and not its own, with both JSON backends.
+
+    :return:
+    """
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+
+    decoded = jsonify_with(backend, rows=make_data_frame())
+
+    assert decoded['rows'][0] == ['2017-01-01T00:00:00+00:00', 1, 1.5]
+
+
+def test_json_backends_alert_payload():
+    """
+    Tests that both JSON backends encode the datetimes in alert responses the same way.
+
+    :return:
+    """
+    pytest.importorskip('orjson')
+    timestamp = datetime(2017, 1, 1, 0, 0, 5)
+    payload = {
+        'alerts': [
+            {'metric': 'foo', 'data': {'warnings': [{'p99': 1.5, 'metric_timestamp': timestamp}], 'errors': []}},
+            {'metric': 'foo', 'data': {'warnings': {'count': 1, 'first': timestamp, 'last': timestamp},
+                                       'errors': {'count': 0, 'first': None, 'last': None}}},
+            {'metric': 'foo', 'data': {'episodes': [{'start': timestamp, 'end': pd.Timestamp(timestamp),
+                                                     'peak': 2.5, 'level': 'error', 'count': 1}]}},
+        ]
+    }
+    expected = jsonify_with('json', **payload)
+
+    assert jsonify_with('orjson', **payload) == expected
+    assert expected['alerts'][0]['data']['warnings'][0]['metric_timestamp'] == 'Sun, 01 Jan 2017 00:00:05 GMT'
+
+
+def test_get_json_encoder():
+    """
+    Tests that unknown backends are rejected.
+
+    :return:
+    """
+    assert get_json_encoder() is DataFrameEncoder
+
+    with pytest.raises(ConfigurationError):
+        get_json_encoder('simplejson')
@@ -0,0 +1,92 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from metrics_server.app import App
+from metrics_server.cassandra_service import COLUMNAR_PROFILE
+from metrics_server.local_store import LocalSession, translate
+
+INSERT_TIMER_CQL = (
+    'INSERT INTO raw_timer_with_interval (environment, application, metric_name, metric_timestamp, count, '
+    'previous_count, p99, duration_unit, rate_unit) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);'
+)
+
+
+@pytest.fixture()
+def local_app():
+    app = App({'cassandra': {'backend': 'local'}})
+    yield app
+    app.services['CassandraService'].cluster.shutdown()
+
+
+def test_metric_data(local_app: App):
+    """
+    Tests that metric data, the catalog and the metadata query are read from the local store.
+
+    :param local_app: fixture
+    :return:
+    """
+    session = local_app.services['CassandraService'].session
+    start = datetime(2017, 1, 1)
+    statement = session.prepare(INSERT_TIMER_CQL)
+
+    for i in range(10):
+        session.execute(statement, ['dev', 'app', 'timer', start + timedelta(seconds=5 * i), 10 * i, 10 * i - 10,
+                                    float(i), 'milliseconds', 'seconds'])
+
+    metrics_service = local_app.services['MetricsService']
+    rows = metrics_service.get_metric_data('dev', 'app', 'raw_timer_with_interval', 'timer', ['p99', 'interval_count'],
+                                           pytz.utc.localize(start), pytz.utc.localize(start + timedelta(seconds=20)))
+    metrics = metrics_service.get_distinct_metrics_for_table('raw_timer_with_interval')
+
+    assert rows['p99'].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert rows['interval_count'].tolist() == [10] * 5
+    assert rows['metric_timestamp'].iloc[-1] == pytz.utc.localize(start + timedelta(seconds=20))
+    assert metrics == [{
+        'environment': 'dev', 'application': 'app', 'metric_name': 'timer', 'table': 'raw_timer_with_interval',
+        'last_timestamp': '2017-01-01T00:00:45+00:00', 'duration_unit': 'milliseconds', 'rate_unit': 'seconds'
+    }]
+
+
+def test_dashboards(local_app: App):
+    """
+    Tests that dashboards can be created once, updated and deleted.
+
+    :param local_app: fixture
+    :return:
+    """
+    client = local_app.flask_app.test_client()
+    body = {'name': 'ops', 'type': 'time_series', 'data': {'charts': []}}
+
+    assert client.post('/api/v1/dashboards', json=body).status_code == 200
+    assert client.post('/api/v1/dashboards', json=body).status_code == 400
+    assert client.put('/api/v1/dashboards/time_series/ops', json={'data': {'charts': [1]}}).status_code == 200
+    assert client.get('/api/v1/dashboards/time_series/ops').get_json()['dashboard']['data'] == {'charts': [1]}
+    assert client.delete('/api/v1/dashboards/time_series/ops').status_code == 200
+    assert client.get('/api/v1/dashboards/time_series/ops').status_code == 404
+
+
+def test_latency():
+    """
+    Tests that queries are delayed by the configured latency, and that unsupported queries are rejected.
+
+    :return:
+    """
+    session = LocalSession(latency=0.05)
+    statement = session.prepare('SELECT metric_timestamp, p99 FROM raw_timer_with_interval WHERE environment = ?')
+    started = time.monotonic()
+    futures = [session.execute_async(statement, ['dev'], execution_profile=COLUMNAR_PROFILE) for _ in range(20)]
+    results = [future.result() for future in futures]
+    session.shutdown()
+
+    # The latency is waited out concurrently, not once per query.
+    assert 0.05 <= time.monotonic() - started < 0.5
+    assert all(result.current_rows == [] for result in results)
+
+    with pytest.raises(ValueError):
+        translate('SELECT * FROM not_a_table')
+
+    with pytest.raises(ValueError):
+        translate('TRUNCATE dashboards')
@@ -0,0 +1,96 @@
+import json
+from datetime import datetime
+
+from metrics_server.app import App
+from metrics_server.data_frame_encoder import (
+    COLUMNAR_BINARY_MIMETYPE, COLUMNAR_JSON_MIMETYPE, JSON_MIMETYPE, read_columnar_binary
+)
+from tests.utils import columnar_result_set
+
+
+def test_batch(patched_app: App):
+    """
+    Tests that the batch endpoint returns rows for good series and an error for bad ones.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    rows = [{'metric_timestamp': datetime(2017, 1, 1), 'count': 100}]
+    session.execute_async.return_value.result.return_value = columnar_result_set(rows)
+    spec = {'environment': 'dev', 'application': 'app', 'table': 'raw_counter_with_interval', 'metric': 'metric'}
+    body = {
+        'series': [
+            {**spec, 'columns': ['count'], 'start_timestamp': '2017-01-01T00:00:00Z'},
+            {**spec, 'columns': ['not_real_column']},
+        ]
+    }
+    resp = patched_app.flask_app.test_client().post('/api/v1/metrics/batch', json=body)
+    series = resp.get_json()['data']['series']
+
+    assert resp.status_code == 200
+    assert series[0]['rows'] == [['2017-01-01T00:00:00+00:00', 100]]
+    assert 'not_real_column' in series[1]['error']
+
+
+def test_batch_invalid(patched_app: App):
+    """
+    Tests that the batch endpoint validates the request body.
+
+    :param patched_app: fixture
+    :return:
+    """
+    resp = patched_app.flask_app.test_client().post('/api/v1/metrics/batch', json={'series': [{'table': 'foo'}]})
+
+    assert resp.status_code == 400
+
+
+def test_metric_stream(patched_app: App):
+    """
+    Tests that the streaming response contains the same JSON as the regular response.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    rows = [{'metric_timestamp': datetime(2017, 1, 1, 0, 0, i), 'p99': float(i)} for i in range(10)]
+    session.execute.return_value = columnar_result_set(rows)
+    client = patched_app.flask_app.test_client()
+    url = '/api/v1/metrics/raw_timer_with_interval/dev/app/metric?columns=p99'
+    expected = client.get(url).get_json()
+    resp = client.get(url + '&stream=true')
+
+    assert resp.is_streamed
+    assert resp.get_json() == expected
+    assert len(expected['data']['rows']) == 10
+
+
+def test_metric_accept(patched_app: App):
+    """
+    Tests that the response format is negotiated with the Accept header.
+
+    :param patched_app: fixture
+    :return:
+    """
+    session = patched_app.services['CassandraService'].session
+    rows = [{'metric_timestamp': datetime(2017, 1, 1, 0, 0, i), 'p99': float(i)} for i in range(3)]
+    session.execute.side_effect = lambda *args, **kwargs: columnar_result_set(rows)
+    client = patched_app.flask_app.test_client()
+    url = '/api/v1/metrics/raw_timer_with_interval/dev/app/metric?columns=p99'
+
+    resp = client.get(url, headers={'Accept': '*/*'})
+    assert resp.mimetype == JSON_MIMETYPE
+    assert resp.headers['Vary'] == 'Accept'
+    assert len(resp.get_json()['data']['rows']) == 3
+
+    resp = client.get(url, headers={'Accept': COLUMNAR_JSON_MIMETYPE})
+    assert resp.mimetype == COLUMNAR_JSON_MIMETYPE
+    assert resp.headers['Vary'] == 'Accept'
+    assert json.loads(resp.data)['data']['columns'][1] == {'name': 'p99', 'values': [0.0, 1.0, 2.0]}
+
+    resp = client.get(url, headers={'Accept': f'{COLUMNAR_BINARY_MIMETYPE}, {JSON_MIMETYPE};q=0.5'})
+    header, columns = read_columnar_binary(resp.data)
+    assert resp.mimetype == COLUMNAR_BINARY_MIMETYPE
+    assert resp.headers['Vary'] == 'Accept'
+    assert header['metric'] == 'metric'
+    assert columns['p99'].tolist() == [0.0, 1.0, 2.0]
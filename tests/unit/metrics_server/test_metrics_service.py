@@ -1,13 +1,17 @@
 import json
+import threading
+import time
 from datetime import datetime, timedelta
+from unittest import mock
 
+import pandas as pd
 import pytest
 import pytz
 from dateutil.parser import parse
 
-from metrics_server.errors import NotFoundError
+from metrics_server.errors import ConfigurationError, NotFoundError
 from metrics_server.metrics_service import MetricsService, TABLE_NAMES, validate_columns
-from tests.utils import MockResultSet
+from tests.utils import MockResponseFuture, MockResultSet, columnar_result_set, paged_columnar_result_set
 
 TEST_DATE = datetime(2017, 1, 1, tzinfo=pytz.UTC).isoformat()
 
@@ -26,7 +30,7 @@ def metric_data():
     for row in data:
         row['metric_timestamp'] = parse(row['metric_timestamp'])
 
-    return MockResultSet(data)
+    return columnar_result_set(data)
 
 
 def test_get_distinct_metrics_for_table(patched_ms: MetricsService):
@@ -41,7 +45,8 @@ def test_get_distinct_metrics_for_table(patched_ms: MetricsService):
         {'environment': 'foo', 'application': 'bar', 'metric_name': 'baz_two'}
     ]
     fake_ts = [{'metric_timestamp': datetime.now()}]
-    patched_ms.session.execute.side_effect = [fake_metrics, fake_ts, fake_ts]
+    patched_ms.session.execute.side_effect = [fake_metrics]
+    patched_ms.session.execute_async.return_value.result.return_value = fake_ts
     metrics = patched_ms.get_distinct_metrics_for_table('test_table')
 
     assert len(metrics) == 2
@@ -59,12 +64,41 @@ def test_get_all_distinct_metrics(patched_ms: MetricsService):
     fake_ts = [{'metric_timestamp': datetime.now()}]
     fake_counters = [{'environment': 'foo', 'application': 'bar', 'metric_name': 'baz_counter'}]
     fake_timers = [{'environment': 'foo', 'application': 'bar', 'metric_name': 'baz_timer'}]
-    patched_ms.session.execute.side_effect = [fake_counters, fake_ts, fake_timers, fake_ts]
+    patched_ms.session.execute.side_effect = [fake_counters, fake_timers]
+    patched_ms.session.execute_async.return_value.result.return_value = fake_ts
     metrics = patched_ms.get_all_distinct_metrics()
 
     for idx, name in enumerate(TABLE_NAMES):
         assert metrics[idx]['table'] == name
 
+    # The DISTINCT and metadata statements are prepared once per table and reused.
+    assert patched_ms.session.prepare.call_count == 4
+    patched_ms.session.execute.side_effect = [fake_counters, fake_timers]
+    patched_ms.get_all_distinct_metrics()
+    assert patched_ms.session.prepare.call_count == 4
+
+
+def test_get_metric_catalog(patched_ms: MetricsService, mocker):
+    """
+    Tests that the catalog is built once and then served from memory.
+
+    :param patched_ms: fixture
+    :return:
+    """
+    catalog = [{'environment': 'foo', 'application': 'bar', 'metric_name': 'baz', 'table': TABLE_NAMES[0]}]
+    get_all = mocker.patch.object(patched_ms, 'get_all_distinct_metrics', return_value=catalog)
+
+    try:
+        assert patched_ms.get_metric_catalog() == catalog
+        assert patched_ms.get_metric_catalog() == catalog
+        assert get_all.call_count == 1
+    finally:
+        patched_ms.stop_catalog_refresh()
+
+    patched_ms.catalog_refresh_interval = 0
+    patched_ms.get_metric_catalog()
+    assert get_all.call_count == 2
+
 
 @pytest.mark.parametrize(
     'args,expected',
@@ -96,7 +130,7 @@ def test_get_metric_data(patched_ms: MetricsService):
     :return:
     """
     test_date = datetime.utcnow()
-    patched_ms.session.execute.return_value = MockResultSet([
+    patched_ms.session.execute.return_value = columnar_result_set([
         {'metric_timestamp': test_date, 'count': 100},
         {'metric_timestamp': test_date + timedelta(seconds=5), 'count': 100},
         {'metric_timestamp': test_date + timedelta(seconds=10), 'count': 104},
@@ -118,8 +152,8 @@ def test_get_metric_data_resample(patched_ms: MetricsService, metric_data: MockR
     :param metric_data: fixture
     :return:
     """
-    start = metric_data.current_rows[0]['metric_timestamp']
-    end = metric_data.current_rows[-1]['metric_timestamp']
+    start = pd.Timestamp(metric_data.current_rows['metric_timestamp'][0]).to_pydatetime()
+    end = pd.Timestamp(metric_data.current_rows['metric_timestamp'][-1]).to_pydatetime()
     patched_ms.session.execute.return_value = metric_data
     resp = patched_ms.get_metric_data('dev', 'fake_app', 'raw_timer_with_interval', 'fake_metric', ['median'],
                                       start, end)
@@ -132,6 +166,70 @@ def test_get_metric_data_resample(patched_ms: MetricsService, metric_data: MockR
     assert abs(len(resp) - 500) < 100
 
 
+@pytest.mark.parametrize('size', [200, 5000])
+def test_get_metric_data_split(patched_cs, size):
+    """
+    Tests that long windows are fetched as concurrent queries over consecutive slices aligned to the down sampling
+    buckets, and that the merged slices equal the rows of the whole window.
+
+    :param patched_cs: fixture
+    :return:
+    """
+    with open('./tests/data/get_metric_data.json') as f:
+        data = json.load(f)
+
+    for row in data:
+        row['metric_timestamp'] = parse(row['metric_timestamp'])
+
+    def execute(statement, params, **kwargs):
+        exclude_end = 'metric_timestamp < ?' in statement.query_string
+
+        return columnar_result_set([
+            row for row in data
+            if params[3] <= row['metric_timestamp'] and (row['metric_timestamp'] < params[4] if exclude_end else
+                                                         row['metric_timestamp'] <= params[4])
+        ])
+
+    start, end = data[0]['metric_timestamp'], data[-1]['metric_timestamp']
+    args = ['dev', 'fake_app', 'raw_timer_with_interval', 'fake_metric', ['median'], start, end, size]
+    ms = MetricsService({}, {'CassandraService': patched_cs})
+    ms.session.execute.side_effect = execute
+    expected = ms.get_metric_data(*args)
+    split_ms = MetricsService({'metrics': {'split': {'min_span_hours': 1, 'slices': 4}}},
+                              {'CassandraService': patched_cs})
+    split_ms.session.execute_async.side_effect = lambda *a, **kw: MockResponseFuture(execute(*a, **kw))
+    rows = split_ms.get_metric_data(*args)
+    calls = [call[0] for call in split_ms.session.execute_async.call_args_list]
+    bucket_size = (end - start).total_seconds() // size
+
+    pd.testing.assert_frame_equal(rows, expected)
+    assert len(calls) == 4
+    assert calls[0][1][3] == start and calls[-1][1][4] == end
+    assert 'metric_timestamp <= ?' in calls[-1][0].query_string
+
+    for (_, params), (_, next_params) in zip(calls[:-1], calls[1:]):
+        assert params[4] == next_params[3]
+        # Bucket edges are counted from midnight of the day the window starts.
+        assert (params[4] - start.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds() % bucket_size == 0
+
+
+@pytest.mark.parametrize('split,expected', [
+    ({'slices': 0}, 'metrics.split.slices must be at least 1'),
+    ({'slices': 2.5}, 'metrics.split.slices must be a number'),
+    ({'min_span_hours': -1}, 'metrics.split.min_span_hours must be at least 0'),
+    ({'min_span_hours': 'day'}, 'metrics.split.min_span_hours must be a number'),
+])
+def test_invalid_split_settings(patched_cs, split, expected):
+    """
+    Tests that invalid metrics.split settings are rejected when the service is created.
+
+    :param patched_cs: fixture
+    :return:
+    """
+    with pytest.raises(ConfigurationError, match=expected):
+        MetricsService({'metrics': {'split': split}}, {'CassandraService': patched_cs})
+
+
 def test_validate_columns_good():
     test_columns = ['count', 'previous_count']
     columns, is_interval_count = validate_columns('raw_timer_with_interval', test_columns)
@@ -175,3 +273,367 @@ def test_validate_columns_interval(columns, expected_columns):
     actual_columns, is_interval_count = validate_columns('raw_timer_with_interval', columns)
     assert is_interval_count
     assert expected_columns == actual_columns
+
+
+@pytest.mark.parametrize('size', [1000, 500, 37, 5000])
+def test_get_metric_data_paged(patched_ms: MetricsService, metric_data: MockResultSet, size):
+    """
+    Tests that paging through results and down sampling each page as it arrives returns exactly what loading every row
+    and resampling returns.
+
+    :param patched_ms: fixture
+    :param metric_data: fixture
+    :param size: the number of rows to down sample to.
+    :return:
+    """
+    rows = list(metric_data.current_rows)
+    start = pytz.utc.localize(rows[0]['metric_timestamp'])
+    end = pytz.utc.localize(rows[-1]['metric_timestamp'])
+    args = ['dev', 'fake_app', 'raw_timer_with_interval', 'fake_metric', ['median'], start, end, size]
+    patched_ms.session.execute.return_value = metric_data
+    expected = patched_ms.get_metric_data(*args)
+    patched_ms.fetch_size = 100
+    patched_ms.session.execute.return_value = paged_columnar_result_set(rows, 100)
+    actual = patched_ms.get_metric_data(*args)
+
+    pd.testing.assert_frame_equal(expected, actual)
+
+
+def test_get_metric_data_paged_interval_count(patched_ms: MetricsService):
+    """
+    Tests that interval_count is calculated and summed per bucket the same way with and without paging.
+
+    :param patched_ms: fixture
+    :return:
+    """
+    start = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    rows = [
+        {'metric_timestamp': start.replace(tzinfo=None) + timedelta(seconds=i * 5), 'count': i * 3, 'previous_count': i}
+        for i in range(500)
+    ]
+    end = start + timedelta(seconds=500 * 5)
+    args = ['dev', 'fake_app', 'raw_counter_with_interval', 'fake_metric', ['interval_count'], start, end, 100]
+    patched_ms.session.execute.return_value = columnar_result_set(rows)
+    expected = patched_ms.get_metric_data(*args)
+    patched_ms.fetch_size = 64
+    patched_ms.session.execute.return_value = paged_columnar_result_set(rows, 64)
+    actual = patched_ms.get_metric_data(*args)
+
+    assert list(expected.columns) == ['metric_timestamp', 'interval_count']
+    assert expected['interval_count'].sum() == sum(row['count'] - row['previous_count'] for row in rows)
+    pd.testing.assert_frame_equal(expected, actual)
+
+
+def test_get_metric_data_rollups(patched_ms: MetricsService):
+    """
+    Tests that long time ranges are read from the coarsest rollup table that still has enough rows, and that averages
+    are weighted by the number of raw rows in each rollup row.
+
+    :param patched_ms: fixture
+    :return:
+    """
+    patched_ms.use_rollups = True
+    end = datetime(2017, 1, 8, tzinfo=pytz.utc)
+    start = end - timedelta(days=7)
+    rows = [
+        {'metric_timestamp': datetime(2017, 1, 1), 'mean': 10.0, 'sample_count': 1},
+        {'metric_timestamp': datetime(2017, 1, 1, 0, 5), 'mean': 20.0, 'sample_count': 3},
+    ]
+    watermark = MockResultSet([{'last_bucket': datetime(2017, 1, 8)}])
+    patched_ms.session.execute.side_effect = lambda statement, *args, **kwargs: (
+        watermark if 'rollup_watermarks' in statement.query_string else columnar_result_set(rows)
+    )
+    resp = patched_ms.get_metric_data('dev', 'fake_app', 'raw_timer_with_interval', 'fake_metric', ['mean'], start,
+                                      end, 1)
+    query = patched_ms.session.execute.call_args[0][0].query_string
+
+    assert 'FROM rollup_timer_1h' in query
+    assert list(resp.columns) == ['metric_timestamp', 'mean']
+    assert resp['mean'][0] == 17.5
+
+    patched_ms.get_metric_data('dev', 'fake_app', 'raw_timer_with_interval', 'fake_metric', ['mean'], start, end)
+
+    assert 'FROM rollup_timer_5m' in patched_ms.session.execute.call_args[0][0].query_string
+
+
+def test_get_metric_data_rollup_tail(patched_ms: MetricsService):
+    """
+    Tests that rows newer than the last rolled up bucket are read from the raw table and folded in after the rollup
+    rows, and that the raw table is used when nothing in the window has been rolled up yet.
+
+    :param patched_ms: fixture
+    :return:
+    """
+    patched_ms.use_rollups = True
+    end = datetime(2017, 1, 8, tzinfo=pytz.utc)
+    start = end - timedelta(days=7)
+    watermark = datetime(2017, 1, 7, 23)
+    rollup_rows = [{'metric_timestamp': datetime(2017, 1, 7, 22), 'interval_count': 10, 'sample_count': 60}]
+    raw_rows = [
+        {'metric_timestamp': datetime(2017, 1, 7, 23, 30), 'count': 15, 'previous_count': 10},
+        {'metric_timestamp': datetime(2017, 1, 7, 23, 59), 'count': 17, 'previous_count': 15},
+    ]
+    patched_ms.session.execute.return_value = MockResultSet([{'last_bucket': watermark}])
+    patched_ms.session.execute_async.side_effect = [
+        MockResponseFuture(columnar_result_set(rollup_rows)),
+        MockResponseFuture(columnar_result_set(raw_rows)),
+    ]
+    resp = patched_ms.get_metric_data('dev', 'fake_app', 'raw_counter_with_interval', 'fake_metric',
+                                      ['interval_count'], start, end, 1)
+    rollup_call, raw_call = patched_ms.session.execute_async.call_args_list
+
+    assert 'FROM rollup_counter_1h' in rollup_call[0][0].query_string
+    assert 'metric_timestamp < ?' in rollup_call[0][0].query_string
+    assert rollup_call[0][1][4] == pytz.utc.localize(watermark)
+    assert 'FROM raw_counter_with_interval' in raw_call[0][0].query_string
+    assert raw_call[0][1][3:] == [pytz.utc.localize(watermark), end]
+    assert list(resp.columns) == ['metric_timestamp', 'interval_count']
+    assert resp['interval_count'].tolist() == [17]
+
+    patched_ms.session.execute.side_effect = [MockResultSet([]), columnar_result_set(raw_rows)]
+    resp = patched_ms.get_metric_data('dev', 'fake_app', 'raw_counter_with_interval', 'fake_metric',
+                                      ['interval_count'], start, end, 1)
+
+    assert 'FROM raw_counter_with_interval' in patched_ms.session.execute.call_args[0][0].query_string
+    assert resp['interval_count'].tolist() == [7]
+
+
+def test_get_metric_data_cached(patched_cs):
+    """
+    Tests that requests for windows that snap to the same buckets are served from the cache.
+
+    :param patched_cs: fixture
+    :return:
+    """
+    config = {'metrics': {'cache': {}}}
+    ms = MetricsService(config, {'CassandraService': patched_cs})
+    test_date = datetime(2017, 1, 1)
+    ms.session.execute.return_value = columnar_result_set([{'metric_timestamp': test_date, 'count': 100}])
+    start = pytz.utc.localize(test_date) + timedelta(seconds=1)
+    end = start + timedelta(hours=1)
+    args = ['dev', 'fake_app', 'raw_counter_with_interval', 'fake_metric', ['count']]
+    first = ms.get_metric_data(*args, start, end, 100)
+    second = ms.get_metric_data(*args, start + timedelta(seconds=5), end + timedelta(seconds=5), 100)
+
+    assert first is second
+    assert ms.session.execute.call_count == 1
+    assert ms.cache_stats()['hits'] == 1
+
+    ms.get_metric_data(*args, start, end, 50)
+
+    assert ms.session.execute.call_count == 2
+
+
+@pytest.mark.parametrize('fetch_size', [None, 500])
+def test_get_metric_data_cached_buckets(patched_cs, fetch_size):
+    """
+    Tests that snapping the window for the cache keeps the buckets of the requested window, so cached and uncached
+    results are the same. 86 second buckets anchored at midnight are not on the 86 second grid counted from the epoch.
+
+    :param patched_cs: fixture
+    :return:
+    """
+    first = datetime(2017, 1, 1, 12)
+    data = [{'metric_timestamp': first + timedelta(seconds=i * 10), 'mean': float(i % 7), 'max': float(i % 13)}
+            for i in range(24 * 360)]
+
+    def execute(statement, params, **kwargs):
+        start, end = params[3].replace(tzinfo=None), params[4].replace(tzinfo=None)
+        return columnar_result_set([row for row in data if start <= row['metric_timestamp'] <= end])
+
+    start = datetime(2017, 1, 2, tzinfo=pytz.utc)
+    end = start + timedelta(seconds=86 * 500)
+    args = ['dev', 'fake_app', 'raw_timer_with_interval', 'fake_metric', ['mean', 'max'], start, end, 500]
+    results = []
+
+    for config in ({}, {'cache': {}}, {'coalesce': {}}):
+        ms = MetricsService({'metrics': {**config, 'fetch_size': fetch_size}}, {'CassandraService': patched_cs})
+        ms.session.execute.side_effect = execute
+        results.append(ms.get_metric_data(*args))
+
+    assert results[0]['metric_timestamp'][0] == start
+    pd.testing.assert_frame_equal(results[0], results[1])
+    pd.testing.assert_frame_equal(results[0], results[2])
+
+
+def test_get_metric_data_coalesced(patched_cs):
+    """
+    Tests that concurrent requests for windows that snap to the same buckets share one query.
+
+    :param patched_cs: fixture
+    :return:
+    """
+    config = {'metrics': {'coalesce': {}}}
+    ms = MetricsService(config, {'CassandraService': patched_cs})
+    test_date = datetime(2017, 1, 1)
+    release = threading.Event()
+
+    def execute(*args, **kwargs):
+        release.wait(5)
+        return columnar_result_set([{'metric_timestamp': test_date, 'count': 100}])
+
+    ms.session.execute.side_effect = execute
+    start = pytz.utc.localize(test_date) + timedelta(seconds=1)
+    end = start + timedelta(hours=1)
+    args = ['dev', 'fake_app', 'raw_counter_with_interval', 'fake_metric', ['count']]
+    results = []
+    threads = [
+        threading.Thread(target=lambda offset=offset: results.append(
+            ms.get_metric_data(*args, start + offset, end + offset, 100)
+        ))
+        for offset in (timedelta(0), timedelta(seconds=5), timedelta(seconds=10))
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    deadline = time.monotonic() + 5
+
+    while ms.coalesce_stats()['coalesced'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+    release.set()
+
+    for thread in threads:
+        thread.join()
+
+    assert ms.session.execute.call_count == 1
+    assert len(results) == 3
+    assert all(result is results[0] for result in results)
+    assert ms.coalesce_stats()['coalesced'] == 2
+
+
+def test_get_metric_data_batch_coalesced(patched_cs):
+    """
+    Tests that identical series in a batch share one query, including its error.
+
+    :param patched_cs: fixture
+    :return:
+    """
+    ms = MetricsService({'metrics': {'coalesce': {}}}, {'CassandraService': patched_cs})
+    good = mock.Mock()
+    good.result.return_value = columnar_result_set([{'metric_timestamp': datetime(2017, 1, 1), 'count': 100}])
+    bad = mock.Mock()
+    bad.result.side_effect = Exception('Query timed out')
+    ms.session.execute_async.side_effect = [good, bad]
+    end = datetime(2017, 1, 2, tzinfo=pytz.utc)
+    spec = {'environment': 'dev', 'application': 'app', 'table': 'raw_counter_with_interval', 'metric': 'metric',
+            'end_timestamp': end}
+    results = ms.get_metric_data_batch([
+        {**spec, 'columns': ['count']},
+        {**spec, 'columns': ['previous_count']},
+        {**spec, 'columns': ['count']},
+        {**spec, 'columns': ['previous_count']},
+    ])
+
+    assert ms.session.execute_async.call_count == 2
+    assert results[0] is results[2]
+    assert str(results[1]) == str(results[3]) == 'Query timed out'
+    assert ms.coalesce_stats() == {'flights': 2, 'coalesced': 2, 'errors': 1, 'timeouts': 0, 'in_flight': 0}
+
+
+def test_get_metric_data_batch(patched_ms: MetricsService):
+    """
+    Tests that every series in a batch is queried asynchronously and that a failing series doesn't fail the others.
+
+    :param patched_ms: fixture
+    :return:
+    """
+    test_date = datetime(2017, 1, 1)
+    good = mock.Mock()
+    good.result.return_value = columnar_result_set([{'metric_timestamp': test_date, 'count': 100}])
+    bad = mock.Mock()
+    bad.result.side_effect = Exception('Query timed out')
+    patched_ms.session.execute_async.side_effect = [good, bad]
+    spec = {'environment': 'dev', 'application': 'app', 'table': 'raw_counter_with_interval', 'metric': 'metric'}
+    results = patched_ms.get_metric_data_batch([
+        {**spec, 'columns': ['count']},
+        {**spec, 'columns': ['not_real_column']},
+        {**spec, 'columns': ['previous_count']},
+    ])
+
+    assert patched_ms.session.execute_async.call_count == 2
+    assert list(results[0]['count']) == [100]
+    assert isinstance(results[1], NotFoundError)
+    assert str(results[2]) == 'Query timed out'
+
+
+def test_get_all_distinct_metrics_from_catalog(patched_ms: MetricsService):
+    """
+    Tests that the metric_catalog table is read with one query per table when use_catalog_table is set.
+
+    :param patched_ms: fixture
+    :return:
+    """
+    patched_ms.use_catalog_table = True
+    patched_ms.session.execute.side_effect = lambda statement, params: [{
+        'environment': 'foo', 'application': 'bar', 'metric_name': f'baz_{params[0]}',
+        'last_timestamp': datetime(2017, 1, 1), 'duration_unit': None, 'rate_unit': None
+    }]
+    metrics = patched_ms.get_all_distinct_metrics()
+
+    assert patched_ms.session.execute.call_count == len(TABLE_NAMES)
+    assert [metric['table'] for metric in metrics] == TABLE_NAMES
+    assert metrics[0]['metric_name'] == f'baz_{TABLE_NAMES[0]}'
+    assert metrics[0]['last_timestamp'] == '2017-01-01T00:00:00+00:00'
+
+
+def test_reconcile_catalog(patched_ms: MetricsService):
+    """
+    Tests that reconcile_catalog writes every metric found in the raw tables and deletes catalog entries that are gone.
+
+    :param patched_ms: fixture
+    :return:
+    """
+    last_timestamp = datetime(2017, 1, 1)
+    raw = {'environment': 'foo', 'application': 'bar', 'metric_name': 'current'}
+    stale = {'environment': 'foo', 'application': 'bar', 'metric_name': 'stale'}
+    session = patched_ms.session
+
+    def execute(statement, params=None):
+        if statement.query_string.startswith('SELECT DISTINCT'):
+            return [dict(raw)]
+
+        return [dict(raw, last_timestamp=last_timestamp), dict(stale, last_timestamp=last_timestamp)]
+
+    writes = []
+
+    def execute_async(statement, params):
+        future = mock.Mock()
+
+        if statement.query_string.startswith('SELECT'):
+            future.result.return_value = [{'metric_timestamp': last_timestamp, 'duration_unit': 'ms'}]
+        else:
+            writes.append((statement.query_string.split()[0], params))
+
+        return future
+
+    session.execute.side_effect = execute
+    session.execute_async.side_effect = execute_async
+
+    assert patched_ms.reconcile_catalog() == (2, 2)
+    assert ('INSERT', [TABLE_NAMES[0], 'foo', 'bar', 'current', last_timestamp, 'ms', None]) in writes
+    assert ('DELETE', [TABLE_NAMES[1], 'foo', 'bar', 'stale']) in writes
+    assert not any(write[0] == 'DELETE' and write[1][3] == 'current' for write in writes)
+
+
+def test_get_metric_data_prepared(patched_ms: MetricsService):
+    """
+    Tests that repeated requests for the same table and columns execute the same prepared statement.
+
+    :param patched_ms: fixture
+    :return:
+    """
+    patched_ms.session.execute.side_effect = lambda *args, **kwargs: columnar_result_set([])
+    end = datetime(2017, 1, 2, tzinfo=pytz.utc)
+
+    for hours in (1, 2, 24):
+        patched_ms.get_metric_data('dev', 'app', TABLE_NAMES[1], 'metric', ['p99'], end - timedelta(hours=hours), end)
+
+    patched_ms.get_metric_data('dev', 'app', TABLE_NAMES[1], 'metric', ['p95'], end - timedelta(hours=1), end)
+    statements = [call[0][0] for call in patched_ms.session.execute.call_args_list]
+
+    assert statements[0] is statements[1] is statements[2]
+    assert statements[3] is not statements[0]
+    assert patched_ms.session.prepare.call_count == 2
+    assert statements[0].query_string.startswith('SELECT metric_timestamp, p99 FROM raw_timer_with_interval')
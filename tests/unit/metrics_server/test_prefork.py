@@ -0,0 +1,36 @@
+import os
+import signal
+import time
+
+import pytest
+
+from metrics_server.prefork import Arbiter, listen
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+def test_arbiter_reaps_and_shuts_down_workers():
+    """
+    Tests that dead workers are reaped, and that shutdown stops the others and closes the socket.
+
+    :return:
+    """
+    sock = listen('127.0.0.1', 0)
+    arbiter = Arbiter(sock, 2, lambda worker_sock: time.sleep(60), graceful_timeout=5)
+    first = arbiter.spawn()
+    arbiter.spawn()
+    os.kill(first, signal.SIGKILL)
+    deadline = time.monotonic() + 5
+
+    while first in arbiter.children and time.monotonic() < deadline:
+        arbiter.reap()
+        time.sleep(0.05)
+
+    assert list(arbiter.children) != [] and first not in arbiter.children
+
+    started = time.monotonic()
+    arbiter.stopping = True
+    arbiter.shutdown()
+
+    assert arbiter.children == {}
+    assert time.monotonic() - started < 5
+    assert sock.fileno() == -1
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from metrics_server.metrics_service import MetricsService
+from metrics_server.rollup_service import RollupService
+from tests.utils import paged_columnar_result_set
+
+NOW = datetime(2017, 1, 1, 12)
+
+
+@pytest.fixture()
+def rollup_service(patched_cs, patched_ms: MetricsService):
+    config = {'rollups': {'backfill_hours': 1, 'lag_seconds': 0}}
+    return RollupService(config, {'CassandraService': patched_cs, 'MetricsService': patched_ms})
+
+
+def test_roll_up_metric(rollup_service: RollupService, mocker):
+    """
+    Tests that raw rows are aggregated into every resolution and that watermarks are updated.
+
+    :param rollup_service: fixture
+    :param mocker: pytest.mock fixture.
+    :return:
+    """
+    execute_concurrent = mocker.patch('metrics_server.rollup_service.execute_concurrently', return_value=[])
+    start = NOW - timedelta(hours=1)
+    rows = [
+        {'metric_timestamp': start + timedelta(seconds=i * 5), 'count': i * 2, 'previous_count': i} for i in range(720)
+    ]
+    rollup_service.session.execute.side_effect = [
+        [],  # No watermarks yet.
+        paged_columnar_result_set(rows, 100),
+        None, None, None,  # Watermark updates.
+    ]
+    rows_read = rollup_service.roll_up_metric('raw_counter_with_interval', 'dev', 'app', 'metric', NOW)
+
+    assert rows_read == 720
+
+    assert [len(call[0][2]) for call in execute_concurrent.call_args_list] == [60, 12, 1]
+
+    # The 1 hour rollup has a single bucket containing every row.
+    one_hour = execute_concurrent.call_args_list[-1][0][2][0]
+    count, previous_count, interval_count, sample_count = one_hour[4:]
+    assert count == 719 * 2
+    assert previous_count == 719
+    assert interval_count == sum(row['count'] - row['previous_count'] for row in rows)
+    assert sample_count == 720
+
+    watermark_updates = rollup_service.session.execute.call_args_list[2:]
+    assert [call[0][1][-1] for call in watermark_updates] == [NOW, NOW, NOW]
+
+
+def test_roll_up_metric_up_to_date(rollup_service: RollupService):
+    """
+    Tests that we don't query raw data when every resolution is already up to date.
+
+    :param rollup_service: fixture
+    :return:
+    """
+    watermarks = [{'resolution': resolution, 'last_bucket': NOW} for resolution in ('1m', '5m', '1h')]
+    rollup_service.session.execute.side_effect = [watermarks]
+
+    assert rollup_service.roll_up_metric('raw_counter_with_interval', 'dev', 'app', 'metric', NOW) == 0
+    assert rollup_service.session.execute.call_count == 1
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from metrics_server.app import App
+from metrics_server.timing import STATS
+from tests.utils import columnar_result_set
+
+
+def test_stats(patched_app: App):
+    """
+    Tests that requests get a Server-Timing header with their stages, and that the stages and row counts are
+    aggregated by the stats endpoint.
+
+    :param patched_app: fixture
+    :return:
+    """
+    STATS.reset()
+    session = patched_app.services['CassandraService'].session
+    rows = [{'metric_timestamp': datetime(2017, 1, 1, 0, 0, i), 'p99': float(i)} for i in range(10)]
+    session.execute.return_value = columnar_result_set(rows)
+    client = patched_app.flask_app.test_client()
+    url = ('/api/v1/metrics/raw_timer_with_interval/dev/app/metric?columns=p99&size=5'
+           '&start_timestamp=2017-01-01T00:00:00Z&end_timestamp=2017-01-01T00:00:10Z')
+    resp = client.get(url)
+    stages = [timing.split(';')[0] for timing in resp.headers['Server-Timing'].split(', ')]
+
+    assert resp.status_code == 200
+    assert stages == ['metric_query', 'frame', 'resample', 'encode', 'total']
+
+    stats = client.get('/api/v1/_stats').get_json()
+
+    assert stats['tables'] == {'raw_timer_with_interval': {'queries': 1, 'fetched_rows': 10, 'returned_rows': 5}}
+    assert stats['stages']['metric_query']['count'] == 1
+    assert stats['stages']['total']['count'] == 1
+    assert sum(count for _, count in stats['stages']['resample']['buckets']) == 1
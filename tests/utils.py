@@ -1,5 +1,89 @@
+from metrics_server.columnar import columnar_factory
+
+
+class MockPreparedStatement:
+    """
+    Stands in for the PreparedStatement returned by Session.prepare, so tests can check which query was executed.
+    """
+    def __init__(self, query_string):
+        self.query_string = query_string
+        self.fetch_size = None
 
 
 class MockResultSet:
+    has_more_pages = False
+
     def __init__(self, current_rows):
         self.current_rows = current_rows
+
+    def __iter__(self):
+        return iter(self.current_rows)
+
+
+def columnar_result_set(rows):
+    """
+    Creates a MockResultSet from a list of dicts the same way the columnar execution profile would.
+
+    :param rows: list of dicts, all dicts must have the same keys.
+    :return: MockResultSet
+    """
+    if len(rows) == 0:
+        return MockResultSet([])
+
+    column_names = list(rows[0].keys())
+
+    return MockResultSet(columnar_factory(column_names, [tuple(row[name] for name in column_names) for row in rows]))
+
+
+class MockPagedResultSet:
+    """
+    Mimics the paging interface of a ResultSet, each page is returned by current_rows in turn as fetch_next_page is
+    called.
+    """
+    def __init__(self, pages):
+        self.pages = pages
+        self.page = 0
+
+    @property
+    def current_rows(self):
+        return self.pages[self.page]
+
+    @property
+    def has_more_pages(self):
+        return self.page < len(self.pages) - 1
+
+    def fetch_next_page(self):
+        self.page += 1
+
+
+def paged_columnar_result_set(rows, page_size):
+    """
+    Splits a list of dicts into pages of columnar rows.
+
+    :param rows: list of dicts, all dicts must have the same keys.
+    :param page_size: int, the number of rows per page.
+    :return: MockPagedResultSet
+    """
+    pages = [columnar_result_set(rows[i:i + page_size]).current_rows for i in range(0, len(rows), page_size)]
+
+    return MockPagedResultSet(pages or [[]])
+
+
+class MockResponseFuture:
+    """
+    A ResponseFuture that has already completed, it supports both result() and add_callbacks().
+    """
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        if isinstance(self._result, Exception):
+            raise self._result
+
+        return self._result
+
+    def add_callbacks(self, callback, errback):
+        if isinstance(self._result, Exception):
+            errback(self._result)
+        else:
+            callback(self._result.current_rows)